@@ -1,2 +1,2 @@
 BASEDIRPATH=$(dirname $0)
-python3 $BASEDIRPATH/../src/word2/pinyin.py $1 $2
+python3 $BASEDIRPATH/../src/word2/pinyin.py "$@"
@@ -0,0 +1,22 @@
+def edit_distance(sentence, std_sentence):
+    """
+    Levenshtein distance between two strings, counting insertions, deletions and substitutions of characters.
+    Shared by test/evaluate.py and build_table.py --report to score character accuracy.
+
+    Args:
+        sentence: A converted sentence.
+        std_sentence: The correct sentence.
+
+    Returns:
+        The number of characters to insert, delete or substitute to turn sentence into std_sentence.
+    """
+    if sentence == std_sentence:
+        return 0
+    previous_row = list(range(len(std_sentence) + 1))
+    for index, character in enumerate(sentence, 1):
+        current_row = [index]
+        for std_index, std_character in enumerate(std_sentence, 1):
+            current_row.append(min(previous_row[std_index] + 1, current_row[std_index - 1] + 1,
+                                   previous_row[std_index - 1] + (character != std_character)))
+        previous_row = current_row
+    return previous_row[-1]
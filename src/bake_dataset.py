@@ -0,0 +1,513 @@
+import argparse
+import collections
+import gzip
+import itertools
+import json
+import lzma
+import multiprocessing
+import os
+import re
+import sqlite3
+
+import jieba
+import pypinyin
+
+try:
+    # 可选的更快的json解析库
+    import orjson
+    loads_json = orjson.loads
+except ImportError:
+    loads_json = json.loads
+
+# 内存中计数器的最大条目数，超过后批量写入数据库
+MAX_COUNTER_SIZE = 1000000
+# 等待其他进程释放数据库写锁的秒数，写入一批计数可能需要较长时间
+LOCK_TIMEOUT = 600
+# 并行处理时每个新闻文件分段的字节数
+CHUNK_SIZE = 64 * 1024 * 1024
+# 各数据表的名称和主键，顺序与count_text的计数器一致
+TABLE_KEYS = (
+    ("PinyinChar", ("pinyin", "char")),
+    ("PinyinPinyinCharChar", ("pinyin1", "pinyin2", "char1", "char2")),
+    ("PinyinWord", ("pinyin", "word")),
+    ("PinyinPinyinWordWord", ("pinyin1", "pinyin2", "word1", "word2")),
+)
+# 各数据表所在的数据库文件，顺序与TABLE_KEYS一致
+DATABASE_FILENAMES = ("pinyin_char.db", "pinyin_pinyin_char_char.db", "pinyin_word.db", "pinyin_pinyin_word_word.db")
+
+# 子进程的数据库连接，由init_worker设置，顺序与TABLE_KEYS一致
+worker_connections = None
+
+
+def pairwise(iterable):
+    """
+    Iterate as pair (current, next).
+    s -> (s0,s1), (s1,s2), (s2, s3), ...
+
+    Args:
+        iterable: A list or something as a iterable
+    """
+    a, b = itertools.tee(iterable)
+    next(b, None)
+    return zip(a, b)
+
+
+def open_news_file(news_path):
+    """
+    Open a news file in binary mode, .gz and .xz files are decompressed on the fly.
+
+    Args:
+        news_path: Path to a news file.
+
+    Returns:
+        A binary file object.
+    """
+    if news_path.endswith('.gz'):
+        return gzip.open(news_path, 'rb')
+    elif news_path.endswith('.xz'):
+        return lzma.open(news_path, 'rb')
+    else:
+        return open(news_path, 'rb')
+
+
+def get_news_text(news_file):
+    """
+    Retrieve text from news file lazily, so that memory does not grow with file size.
+
+    Args:
+        news_file: Lines of a file containing news.
+            Every line contains a piece of news in json
+            Json keys include: title-新闻标题 html-新闻正文.
+
+    Returns:
+        A generator of texts in news.
+    """
+    for news in news_file:
+        news_data = loads_json(news)
+        yield news_data['title']
+        yield news_data['html']
+
+
+def split_news_files(news_dirname, news_filenames, chunk_size):
+    """
+    Split news files into byte ranges, so that a big file can be shared by several workers.
+
+    Args:
+        news_dirname: Directory of news files.
+        news_filenames: A list of news file names in news_dirname.
+        chunk_size: Maximum size of a byte range.
+
+    Returns:
+        A list of (news_path, start, stop) byte ranges.
+    """
+    news_chunks = []
+    for news_filename in news_filenames:
+        news_path = os.path.join(news_dirname, news_filename)
+        if news_path.endswith(('.gz', '.xz')):
+            # 压缩文件无法按字节随机访问，整个文件作为一段
+            news_chunks.append((news_path, 0, None))
+            continue
+        news_size = os.path.getsize(news_path)
+        for start in range(0, news_size, chunk_size):
+            news_chunks.append(
+                (news_path, start, min(start + chunk_size, news_size)))
+    return news_chunks
+
+
+def read_news_chunk(news_path, start, stop):
+    """
+    Read lines starting within byte range [start, stop) of a news file.
+
+    Args:
+        news_path: Path to a news file.
+        start: First byte of the range.
+        stop: Byte after the last byte of the range, None for the whole file.
+
+    Returns:
+        A generator of lines in bytes whose first byte is in [start, stop).
+    """
+    with open_news_file(news_path) as f:
+        if stop is None:
+            yield from f
+            return
+        if start > 0:
+            # 跳过属于上一段的不完整行
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < stop:
+            line = f.readline()
+            if not line:
+                break
+            yield line
+
+
+def connect_database(database_path):
+    """
+    Open a long-lived connection to a sqlite database for baking.
+
+    Args:
+        database_path: Path to a sqlite database file.
+
+    Returns:
+        A sqlite3 connection in autocommit mode, transactions are opened explicitly.
+    """
+    # 子进程和主进程写同一个数据库，拿不到写锁时等待而不是报错
+    connection = sqlite3.connect(database_path, isolation_level=None, timeout=LOCK_TIMEOUT)
+    # 关闭写同步以加速
+    connection.execute("""pragma synchronous = off""")
+    return connection
+
+
+def count_text(text, counters):
+    """
+    Cut text into words and count pinyin-char, pinyin-pinyin-char-char,
+    pinyin-word and pinyin-pinyin-word-word pairs in one pass.
+    Every word is cut by jieba and converted by pypinyin only once.
+
+    Arg:
+        text: A Chinese sentence.
+        counters: A tuple of 4 Counters in the order of TABLE_KEYS,
+            key->primary key of the table with pinyin separated by space, value->count.
+    """
+    pinyin_char_counter, pinyin_pinyin_char_char_counter, \
+        pinyin_word_counter, pinyin_pinyin_word_word_counter = counters
+    # 记录上一个词语末尾的char以及它是否与下一个词语相连
+    old_char_pinyin = ''
+    old_char = ''
+    old_char_is_neighbor = False
+    # 记录上一个词语，若上一个分词不是中文则为None
+    old_word_pinyin = ''
+    old_word = None
+    # 只考虑中文字符
+    chinese_words = re.compile(u"[\u4e00-\u9fa5]+")
+    # 进行jieba分词以提高拼音准确率
+    segments = jieba.cut(text)
+    for word in segments:
+        if re.match(chinese_words, word):
+            pinyin = pypinyin.lazy_pinyin(
+                word, style=pypinyin.Style.NORMAL, errors='ignore')
+            # Words
+            word_pinyin = ' '.join(pinyin)
+            pinyin_word_counter[(word_pinyin, word)] += 1
+            if old_word is not None:
+                pinyin_pinyin_word_word_counter[
+                    (old_word_pinyin, word_pinyin, old_word, word)] += 1
+            old_word_pinyin = word_pinyin
+            old_word = word
+            # Chars
+            if not pinyin or not word:
+                continue
+            pinyin_char_pair_list = list(zip(pinyin, word))
+            pinyin_char_counter.update(pinyin_char_pair_list)
+            # Neighbor with old char
+            if old_char_is_neighbor:
+                pinyin_pinyin_char_char_counter[
+                    (old_char_pinyin, pinyin[0], old_char, word[0])] += 1
+            # Neighbor within word
+            for (pinyin1, char1), (pinyin2, char2) in pairwise(pinyin_char_pair_list):
+                pinyin_pinyin_char_char_counter[
+                    (pinyin1, pinyin2, char1, char2)] += 1
+            # Update old_char
+            old_char_pinyin = pinyin[-1]
+            old_char = word[-1]
+            old_char_is_neighbor = True
+        else:
+            old_word = None
+            old_char_is_neighbor = False
+
+
+def init_worker(database_paths):
+    """
+    Open the databases in a worker process, to stage the counts of news chunks in.
+
+    Args:
+        database_paths: Paths to the databases in the order of TABLE_KEYS, None for the databases not to bake.
+    """
+    global worker_connections
+    worker_connections = [connect_database(database_path) if database_path is not None else None
+                          for database_path in database_paths]
+
+
+def count_news_chunk(task):
+    """
+    Count pairs in a byte range of a news file into the staging tables (the map step).
+    Counts are staged whenever a counter reaches MAX_COUNTER_SIZE, so that memory does not grow with chunk size.
+
+    Args:
+        task: A (news_path, start, stop) byte range, and indexes of the databases to stage the counts in.
+
+    Returns:
+        news_path.
+    """
+    (news_path, start, stop), targets = task
+    if stop is None:
+        print("Reading " + os.path.basename(news_path) + "...")
+    else:
+        print("Reading " + os.path.basename(news_path) +
+              " [" + str(start) + ", " + str(stop) + ")...")
+    news_filename = os.path.basename(news_path)
+    counters = tuple(collections.Counter() for _ in TABLE_KEYS)
+    news_texts = get_news_text(read_news_chunk(news_path, start, stop))
+    # 逐条分析新闻以减少内存占用
+    for news_text in news_texts:
+        count_text(news_text, counters)
+        # 不合并到任何数据库的计数直接丢弃
+        for index, counter in enumerate(counters):
+            if index not in targets:
+                counter.clear()
+        if max(map(len, counters)) >= MAX_COUNTER_SIZE:
+            for index in targets:
+                stage_counter(counters[index], worker_connections[index], *TABLE_KEYS[index], news_filename)
+    for index in targets:
+        stage_counter(counters[index], worker_connections[index], *TABLE_KEYS[index], news_filename)
+    return news_path
+
+
+def stage_counter(counter, connection, table_name, key_names, news_filename):
+    """
+    Add the counts of a part of a news file into the staging table of table_name with one bulk upsert,
+    then clear counter. The counts reach table_name only after the whole file is counted, see merge_staged_file.
+
+    Args:
+        counter: A Counter, key->tuple of values of key_names, value->count.
+        connection: A sqlite3 connection returned by connect_database.
+        table_name: Name of the table, PinyinChar, PinyinPinyinCharChar, PinyinWord or PinyinPinyinWordWord.
+        key_names: Names of the primary key columns of table_name.
+        news_filename: Name of the news file counted.
+    """
+    if not counter:
+        return
+    try:
+        cursor = connection.cursor()
+        # 立即取得写锁，以免与其他进程的事务互相等待
+        cursor.execute("""begin immediate transaction;""")
+        # 按主键排序后写入以提高B树局部性
+        cursor.executemany("""
+            insert into %sStaging (path, %s, count)
+            values (?, %s, ?)
+            on conflict (path, %s) do update
+            set count = count + excluded.count;
+            """ % (table_name, ', '.join(key_names), ', '.join('?' * len(key_names)), ', '.join(key_names)),
+            ((news_filename, ) + key + (count, ) for key, count in sorted(counter.items())))
+        cursor.execute("""commit transaction;""")
+    finally:
+        cursor.close()
+    counter.clear()
+
+
+def merge_staged_file(connection, table_name, key_names, news_filename, news_file):
+    """
+    Move the staged counts of a fully counted news file into table_name and record the file in BakedFile,
+    in one transaction, so that a news file is either fully merged and recorded or not merged at all.
+
+    Args:
+        connection: A sqlite3 connection returned by connect_database.
+        table_name: Name of the table, PinyinChar, PinyinPinyinCharChar, PinyinWord or PinyinPinyinWordWord.
+        key_names: Names of the primary key columns of table_name.
+        news_filename: Name of the news file.
+        news_file: (size, mtime) of the news file.
+    """
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""begin immediate transaction;""")
+        # 暂存表的主键以path开头，按主键顺序读出，写入时同样有B树局部性
+        cursor.execute("""
+            insert into %s (%s, count)
+            select %s, count
+            from %sStaging
+            where path = ?
+            on conflict (%s) do update
+            set count = count + excluded.count;
+            """ % (table_name, ', '.join(key_names), ', '.join(key_names), table_name, ', '.join(key_names)),
+            (news_filename, ))
+        cursor.execute("""
+            delete from %sStaging
+            where path = ?;
+            """ % table_name, (news_filename, ))
+        cursor.execute("""
+            insert or replace into BakedFile (path, size, mtime)
+            values (?, ?, ?);
+            """, (news_filename, ) + news_file)
+        cursor.execute("""commit transaction;""")
+    finally:
+        cursor.close()
+
+
+def load_baked_files(connection, table_name, key_names):
+    """
+    Load the news files already merged into a database, creating the BakedFile table and the staging table
+    of table_name if needed. Counts staged by an interrupted run are dropped, since their files are not recorded
+    and will be counted again.
+
+    Args:
+        connection: A sqlite3 connection returned by connect_database.
+        table_name: Name of the table baked in the database.
+        key_names: Names of the primary key columns of table_name.
+
+    Returns:
+        A dict, key->news file name, value->(size, mtime).
+    """
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            create table if not exists BakedFile(
+                path varchar(256) not null,
+                size integer not null,
+                mtime real not null,
+                primary key(path)
+            )""")
+        # 新闻文件全部分段计数完成之前，其计数暂存在这里
+        cursor.execute("""
+            create table if not exists %sStaging(
+                path varchar(256) not null,
+                %s,
+                count integer not null,
+                primary key(path, %s)
+            )""" % (table_name, ', '.join("%s not null" % key_name for key_name in key_names), ', '.join(key_names)))
+        cursor.execute("""
+            delete from %sStaging
+            """ % table_name)
+        cursor.execute("""
+            select path, size, mtime
+            from BakedFile
+            """)
+        return {path: (size, mtime) for path, size, mtime in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def select_news_files(news_dirname, news_filenames, baked_files):
+    """
+    Select news files that are not merged into some of the databases yet.
+
+    Args:
+        news_dirname: Directory of news files.
+        news_filenames: A list of news file names in news_dirname.
+        baked_files: A list of dicts returned by load_baked_files, in the order of TABLE_KEYS,
+            None for the databases not to bake.
+
+    Returns:
+        A dict, key->news file name, value->((size, mtime), indexes of the databases to merge into).
+    """
+    news_targets = dict()
+    for news_filename in sorted(news_filenames):
+        news_path = os.path.join(news_dirname, news_filename)
+        news_file = (os.path.getsize(news_path), os.path.getmtime(news_path))
+        targets = []
+        for index, database_baked_files in enumerate(baked_files):
+            if database_baked_files is None:
+                continue
+            if news_filename not in database_baked_files:
+                targets.append(index)
+            elif database_baked_files[news_filename] != news_file:
+                # 已计数的部分无法撤销，只能重建数据库
+                print("Warning: " + news_filename +
+                      " changed after it was baked, rebuild the database to count it again.")
+        if targets:
+            news_targets[news_filename] = (news_file, targets)
+        else:
+            print("Skipping " + news_filename + "...")
+    return news_targets
+
+
+def merge_news_chunks(news_chunks, news_targets, connections, pool):
+    """
+    Count news chunks into the staging tables and merge every news file into the databases once all its chunks
+    are counted. Neither this process nor the workers hold more than MAX_COUNTER_SIZE counts per table.
+
+    Args:
+        news_chunks: A list of (news_path, start, stop) byte ranges.
+        news_targets: A dict returned by select_news_files.
+        connections: sqlite3 connections returned by connect_database, in the order of TABLE_KEYS,
+            None for the databases not to bake.
+        pool: A multiprocessing.Pool initialized by init_worker to count news chunks in, None to count in this
+            process after init_worker.
+    """
+    remaining_chunks = collections.Counter(
+        os.path.basename(news_path) for news_path, _, _ in news_chunks)
+    # 空文件没有分段，直接记为已合并
+    for news_filename, (news_file, targets) in news_targets.items():
+        if remaining_chunks[news_filename] == 0:
+            for index in targets:
+                merge_staged_file(connections[index], *TABLE_KEYS[index], news_filename, news_file)
+    tasks = [(news_chunk, news_targets[os.path.basename(news_chunk[0])][1]) for news_chunk in news_chunks]
+    # 子进程分段计数并暂存(map)，主进程在文件计数完成后合并(reduce)
+    if pool is not None:
+        counted_chunks = pool.imap_unordered(count_news_chunk, tasks)
+    else:
+        counted_chunks = map(count_news_chunk, tasks)
+    for news_path in counted_chunks:
+        news_filename = os.path.basename(news_path)
+        remaining_chunks[news_filename] -= 1
+        if remaining_chunks[news_filename] > 0:
+            continue
+        # 文件的所有分段都已计数，合并到尚未包含它的数据库
+        news_file, targets = news_targets[news_filename]
+        for index in targets:
+            merge_staged_file(connections[index], *TABLE_KEYS[index], news_filename, news_file)
+
+
+def bake_dataset(workers=1, table_names=None):
+    """
+    Bake news in data/sina_news_utf8 into the databases of all three models in one pass.
+    News files already merged into a database are skipped, so an interrupted
+    run can be restarted and newly added news files are merged incrementally.
+
+    Args:
+        workers: Number of worker processes counting news in parallel.
+        table_names: Names of the tables in TABLE_KEYS to bake, None for all of them.
+    """
+    all_table_names = [table_name for table_name, _ in TABLE_KEYS]
+    if table_names is None:
+        table_names = all_table_names
+    for table_name in table_names:
+        if table_name not in all_table_names:
+            raise ValueError("Unknown table: %s" % table_name)
+    # 无自定义拼音库，控制pypinyin不做copy操作, 以减少内存占用
+    os.environ['PYPINYIN_NO_DICT_COPY'] = 'true'
+    # 设置文件和数据库路径
+    news_dirname = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "data", "sina_news_utf8")
+    news_filenames = os.listdir(news_dirname)
+    database_paths = [os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "data", database_filename)
+        for database_filename in DATABASE_FILENAMES]
+    # 不需要生成的数据库不打开，也不会被选为合并目标
+    connections = [connect_database(database_path) if table_name in table_names else None
+                   for database_path, table_name in zip(database_paths, all_table_names)]
+    pool = None
+    try:
+        # 每个数据库分别记录已合并的新闻文件
+        baked_files = [load_baked_files(connection, table_name, key_names) if connection is not None else None
+                       for connection, (table_name, key_names) in zip(connections, TABLE_KEYS)]
+        news_targets = select_news_files(
+            news_dirname, news_filenames, baked_files)
+        news_chunks = split_news_files(
+            news_dirname, list(news_targets), CHUNK_SIZE)
+        worker_database_paths = [database_path if connection is not None else None
+                                 for database_path, connection in zip(database_paths, connections)]
+        if workers > 1:
+            pool = multiprocessing.Pool(workers, init_worker, (worker_database_paths, ))
+        else:
+            init_worker(worker_database_paths)
+        merge_news_chunks(news_chunks, news_targets, connections, pool)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        for connection in itertools.chain(connections, worker_connections or ()):
+            if connection is not None:
+                connection.close()
+
+
+"""
+Convert sina news to the pinyin-char, pinyin-pinyin-char-char, pinyin-word
+and pinyin-pinyin-word-word counts of all three models in one pass.
+"""
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes")
+    parser.add_argument("--tables", nargs='+', choices=[table_name for table_name, _ in TABLE_KEYS], default=None,
+                        help="tables to bake, default all of them")
+    args = parser.parse_args()
+    bake_dataset(args.workers, args.tables)
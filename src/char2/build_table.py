@@ -1,14 +1,26 @@
-import json
+import argparse
+import array
+import glob
 import math
 import os
 import sqlite3
+import sys
+
+# 共用的accuracy.py、engines.py和table_format.py在上一级的src文件夹中
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir))
+
+from engines import import_convert_pinyin
+from table_format import QUANTIZE_TYPECODES, build_strings, prune_bigrams, quantize, write_sections
+
+# 二元组缺失时解码器给出的惩罚，默认与本模型的convert_pinyin一致
+BACKOFF_PENALTY = import_convert_pinyin("char2").BACKOFF_PENALTY
 
 
 def build_table(pinyin_char_database_path, pinyin_pinyin_char_char_database_path):
     """
     Build pinyin-char table and pinyin-pinyin-char-char table using database from database_path.
         pinyin-char table: pinyin -> [[char, log(probability)]].
-        pinyin-pinyin-char-char table: str(pinyin1-pinyin2-char1-char2) -> log(probability).
+        pinyin-pinyin-char-char table: (pinyin1, pinyin2, char1, char2, log(probability)).
 
     Args:
         pinyin_char_database_path: Path to pinyin-char sqlite database file.
@@ -16,14 +28,20 @@ def build_table(pinyin_char_database_path, pinyin_pinyin_char_char_database_path
 
     Returns:
         pinyin-char table: A dict, key->pinyin, value->[[char, log(probability)]].
-        pinyin-pinyin-char-char table: A dict, key->str(pinyin1-pinyin2-char1-char2), value->log(probability).
+        pinyin-pinyin-char-char table: An iterator of (pinyin1, pinyin2, char1, char2, log(probability)) sorted by
+            pinyin1, char1, pinyin2 and char2, streamed from the database by iterate_pinyin_pinyin_char_char_table.
     """
     # Build pinyin-char table
     pinyin_char_table = dict()
-    pinyin_char_count = 0
     try:
         connection = sqlite3.connect(pinyin_char_database_path)
         cursor = connection.cursor()
+        # 先求总数，读取时即可换算为log(probability)
+        cursor.execute("""
+            select sum(count)
+            from PinyinChar
+            """)
+        pinyin_char_count = cursor.fetchone()[0]
         cursor.execute("""
             select pinyin, char, count
             from PinyinChar
@@ -34,11 +52,11 @@ def build_table(pinyin_char_database_path, pinyin_pinyin_char_char_database_path
             if not data_list:
                 break
             for (pinyin, char, count) in data_list:
-                pinyin_char_count += count
+                probability = math.log10(count / pinyin_char_count)
                 if pinyin in pinyin_char_table:
-                    pinyin_char_table[pinyin].append([char, count])
+                    pinyin_char_table[pinyin].append((char, probability))
                 else:
-                    pinyin_char_table[pinyin] = [[char, count], ]
+                    pinyin_char_table[pinyin] = [(char, probability), ]
     finally:
         cursor.close()
         connection.close()
@@ -49,70 +67,193 @@ def build_table(pinyin_char_database_path, pinyin_pinyin_char_char_database_path
     for key, value in pinyin_character_table.items():
         if not key in pinyin_char_table:
             # Reduce an order of magnitude -> 0.1
-            pinyin_char_table[key] = [[value, 0.1], ]
+            pinyin_char_table[key] = [(value, math.log10(0.1 / pinyin_char_count)), ]
             print("Miss: " + key + " Set to: " + value)
-    # Change count to log(probability)
-    for pinyin, char_list in pinyin_char_table.items():
-        char_list = [(char, math.log10(count / pinyin_char_count))
-                     for char, count in char_list]
-        pinyin_char_table[pinyin] = char_list
 
     # Build pinyin-pinyin-char-char table
-    pinyin_pinyin_char_char_table = dict()
-    pinyin_pinyin_char_char_count = 0
+    pinyin_pinyin_char_char_table = iterate_pinyin_pinyin_char_char_table(pinyin_pinyin_char_char_database_path)
+
+    return pinyin_char_table, pinyin_pinyin_char_char_table
+
+
+def iterate_pinyin_pinyin_char_char_table(pinyin_pinyin_char_char_database_path):
+    """
+    Stream pinyin-pinyin-char-char table from the database in the order of a covering index,
+    so memory does not grow with the number of rows.
+
+    Args:
+        pinyin_pinyin_char_char_database_path: Path to pinyin-pinyin-char-char sqlite database file.
+
+    Yields:
+        (pinyin1, pinyin2, char1, char2, log(probability)), sorted by pinyin1, char1, pinyin2 and char2.
+    """
     try:
         connection = sqlite3.connect(pinyin_pinyin_char_char_database_path)
         cursor = connection.cursor()
+        # 主键顺序为(pinyin1, pinyin2, char1, char2)，另建与entry顺序一致的覆盖索引，无需排序整张表
+        cursor.execute("""
+            create index if not exists PinyinPinyinCharCharEntries
+            on PinyinPinyinCharChar(pinyin1, char1, pinyin2, char2, count)
+            """)
+        connection.commit()
+        cursor.execute("""
+            select sum(count)
+            from PinyinPinyinCharChar
+            """)
+        pinyin_pinyin_char_char_count = cursor.fetchone()[0]
         cursor.execute("""
             select pinyin1, pinyin2, char1, char2, count
             from PinyinPinyinCharChar
+            order by pinyin1, char1, pinyin2, char2
             """)
         while True:
             data_list = cursor.fetchmany()
             if not data_list:
                 break
             for (pinyin1, pinyin2, char1, char2, count) in data_list:
-                pinyin_pinyin_char_char_count += count
-                pinyin_char_pair = '-'.join((pinyin1, pinyin2, char1, char2))
-                # pinyin_char_pair is database's primary key
-                assert pinyin_char_pair not in pinyin_pinyin_char_char_table
-                pinyin_pinyin_char_char_table[pinyin_char_pair] = count
+                yield pinyin1, pinyin2, char1, char2, math.log10(count / pinyin_pinyin_char_char_count)
     finally:
         cursor.close()
         connection.close()
-    # Change count to log(probability)
-    for pinyin_pinyin_char_char, count in pinyin_pinyin_char_char_table.items():
-        pinyin_pinyin_char_char_table[pinyin_pinyin_char_char] \
-            = math.log10(count / pinyin_pinyin_char_char_count)
-
-    return pinyin_char_table, pinyin_pinyin_char_char_table
 
 
-def save_table(table, table_path):
+def save_table(pinyin_char_table, pinyin_pinyin_char_char_table, table_path, top_k=None, prune_threshold=None,
+               quantize_bits=None, backoff_penalty=BACKOFF_PENALTY):
     """
-    Save table to table_path.
+    Save pinyin-char table and pinyin-pinyin-char-char table to table_path in a compact binary format.
+        strings, string_offsets: All pinyin and chars, sorted and joined by '\n'.
+        pinyin_ids, pinyin_offsets: String id of every pinyin, in sorted order,
+            and the range of its chars in the entry sections.
+        entry_chars, entry_probabilities: String id and float32 log(probability) of chars,
+            sorted by string id within every pinyin.
+            The index of a (pinyin, char) entry is its id in the bigram sections.
+        bigram_offsets, bigram_successors, bigram_probabilities: Successors of every entry,
+            the sorted entries of pinyin2-char2 following pinyin1-char1 are in
+            bigram_successors[bigram_offsets[entry1]:bigram_offsets[entry1 + 1]],
+            with their float32 log(probability).
+        bigram_levels: Only with quantize_bits, bigram_probabilities are 8 or 16-bit codes of
+            the float32 log(probability) in bigram_levels.
 
     Args:
-        table: A table that can be converted to json.
-        table_path: Path to the destination table json file.
+        pinyin_char_table: A dict, key->pinyin, value->[[char, log(probability)]].
+        pinyin_pinyin_char_char_table: An iterable of (pinyin1, pinyin2, char1, char2, log(probability)),
+            sorted by pinyin1, char1, pinyin2 and char2.
+        table_path: Path to the destination binary table file.
+        top_k: Keep at most top_k most probable successors of every entry, see prune_bigrams.
+        prune_threshold: Drop bigrams changing the decoder little, see prune_bigrams.
+        quantize_bits: Quantize bigram log(probability) to 8 or 16 bits, None to keep float32.
+        backoff_penalty: Penalty of a missing bigram assumed by prune_threshold, see prune_bigrams.
+    """
+    strings = set(pinyin_char_table)
+    for char_list in pinyin_char_table.values():
+        strings.update(char for char, _ in char_list)
+    sections, string_ids = build_strings(strings)
+    pinyin_ids = array.array('I')
+    pinyin_offsets = array.array('I', [0])
+    entry_chars = array.array('I')
+    entry_probabilities = array.array('f')
+    entry_ids = dict()
+    for pinyin in sorted(pinyin_char_table):
+        pinyin_ids.append(string_ids[pinyin])
+        # 同一pinyin的字按string id排序，以便二分查找
+        for char, probability in sorted(pinyin_char_table[pinyin], key=lambda entry: string_ids[entry[0]]):
+            entry_ids[(pinyin, char)] = len(entry_chars)
+            entry_chars.append(string_ids[char])
+            entry_probabilities.append(probability)
+        pinyin_offsets.append(len(entry_chars))
+    # entry按(pinyin, char)排序，按pinyin1, char1, pinyin2, char2排序的二元组即按entry排序，可直接流式写入各数组
+    # 不在pinyin-char表中的字不会被查询
+    bigrams = ((entry_ids[(pinyin1, char1)], entry_ids[(pinyin2, char2)], probability)
+               for pinyin1, pinyin2, char1, char2, probability in pinyin_pinyin_char_char_table
+               if (pinyin1, char1) in entry_ids and (pinyin2, char2) in entry_ids)
+    if top_k is not None or prune_threshold is not None:
+        bigrams = prune_bigrams(bigrams, entry_probabilities, backoff_penalty, top_k, prune_threshold)
+    bigram_offsets = array.array('I', [0] * (len(entry_chars) + 1))
+    bigram_successors = array.array('I')
+    bigram_probabilities = array.array('f')
+    for id1, id2, probability in bigrams:
+        bigram_offsets[id1 + 1] += 1
+        bigram_successors.append(id2)
+        bigram_probabilities.append(probability)
+    for id1 in range(1, len(bigram_offsets)):
+        bigram_offsets[id1] += bigram_offsets[id1 - 1]
+    if quantize_bits is not None:
+        bigram_probabilities, bigram_levels = quantize(bigram_probabilities, quantize_bits)
+        sections.append(("bigram_levels", bigram_levels))
+    sections.extend([
+        ("pinyin_ids", pinyin_ids),
+        ("pinyin_offsets", pinyin_offsets),
+        ("entry_chars", entry_chars),
+        ("entry_probabilities", entry_probabilities),
+        ("bigram_offsets", bigram_offsets),
+        ("bigram_successors", bigram_successors),
+        ("bigram_probabilities", bigram_probabilities),
+    ])
+    with open(table_path, 'wb') as f:
+        write_sections(f, sections)
+
+
+def report_table(table_path):
+    """
+    Print the size of a table and its accuracy on every data/input*.txt against data/output_std*.txt.
     """
-    with open(table_path, 'w') as f:
-        json.dump(table, f)
+    convert_pinyin = import_convert_pinyin("char2")
+    from accuracy import edit_distance
+    pinyin_char_table, pinyin_pinyin_char_char_table = convert_pinyin.load_table(table_path)
+    print("Table size:", os.path.getsize(table_path), "bytes,", len(pinyin_pinyin_char_char_table), "bigrams")
+    data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data")
+    for input_file_path in sorted(glob.glob(os.path.join(data_path, "input*.txt"))):
+        std_output_file_path = os.path.join(
+            data_path, os.path.basename(input_file_path).replace("input", "output_std", 1))
+        if not os.path.exists(std_output_file_path):
+            continue
+        with open(input_file_path, 'r') as input_file, open(std_output_file_path, 'r') as std_output_file:
+            pinyin_lines = [line.strip().lower() for line in input_file]
+            std_sentences = [line.rstrip('\n') for line in std_output_file]
+        sentences = convert_pinyin.convert_batch(pinyin_lines, pinyin_char_table, pinyin_pinyin_char_char_table)
+        accurate_sentence_number = 0
+        total_character_number = 0
+        total_distance = 0
+        for sentence, std_sentence in zip(sentences, std_sentences):
+            # 无法转换的句子记为空
+            sentence = sentence or ""
+            if sentence == std_sentence:
+                accurate_sentence_number += 1
+            # 按编辑距离计算字正确率，漏字或多字不会使之后的字都错位
+            total_distance += edit_distance(sentence, std_sentence)
+            total_character_number += len(std_sentence)
+        print("%s: sentence accuracy %.2f%%, character accuracy %.2f%%" % (
+            os.path.basename(input_file_path), accurate_sentence_number / max(len(std_sentences), 1) * 100,
+            (1 - total_distance / total_character_number) * 100 if total_character_number else 0.0))
 
 
 """
 Build and save pinyin-char table.
 """
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top-k", type=int, default=None,
+                        help="keep at most this many most probable successors of every char")
+    parser.add_argument("--prune-threshold", type=float, default=None,
+                        help="drop bigrams whose probability-weighted change of score is below this, e.g. 1e-7")
+    parser.add_argument("--quantize", type=int, choices=sorted(QUANTIZE_TYPECODES), default=None,
+                        help="quantize bigram log(probability) to 8 or 16 bits")
+    parser.add_argument("--backoff-penalty", type=float, default=BACKOFF_PENALTY,
+                        help="penalty of a missing bigram assumed by --prune-threshold, the decoder's by default")
+    parser.add_argument("--table", default=None,
+                        help="path to the destination table file, data/char2_table.bin by default")
+    parser.add_argument("--report", action="store_true",
+                        help="print the size and the accuracy on data/input*.txt of the table")
+    args = parser.parse_args()
     pinyin_char_database_path = os.path.join(
         os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "pinyin_char.db")
-    pinyin_char_table_path = os.path.join(
-        os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "char2_pinyin_char_table.json")
     pinyin_pinyin_char_char_database_path = os.path.join(
         os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "pinyin_pinyin_char_char.db")
-    char_char_table_path = os.path.join(
-        os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "char2_pinyin_pinyin_char_char_table.json")
+    table_path = args.table or os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "char2_table.bin")
     pinyin_char_table, pinyin_pinyin_char_char_table = build_table(
         pinyin_char_database_path, pinyin_pinyin_char_char_database_path)
-    save_table(pinyin_char_table, pinyin_char_table_path)
-    save_table(pinyin_pinyin_char_char_table, char_char_table_path)
+    save_table(pinyin_char_table, pinyin_pinyin_char_char_table, table_path, args.top_k, args.prune_threshold,
+               args.quantize, args.backoff_penalty)
+    if args.report:
+        report_table(table_path)
@@ -1,77 +1,780 @@
-import copy
-import json
+import bisect
+import functools
+import heapq
+import itertools
+import os
+import sys
+import time
+
+try:
+    # 可选的numpy，用于向量化的转换
+    import numpy
+except ImportError:
+    numpy = None
+
+# 共用的table_format.py在上一级的src文件夹中
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir))
+
+from table_format import (InvalidPinyinError, PinyinSplitter, QuantizedArray, StringPool, map_sections,
+                          normalize_pinyin, prune_column)
+
+# 缓存字表的拼音数
+ENTRY_CACHE_SIZE = 4096
+# 缓存后继dict的entry数
+SUCCESSOR_CACHE_SIZE = 16384
+# 缓存转移矩阵的拼音对数
+TRANSITION_CACHE_SIZE = 4096
+# 二元组不在词库中时的惩罚，build_table.py剪枝时也用它
+BACKOFF_PENALTY = 2
+# 动态规划节点中总句probability的下标，用于prune_column
+SENTENCE_PROBABILITY_INDEX = 1
+
+
+class PinyinCharTable(object):
+    """
+    pinyin-char table queried in place.
+    Behaves like a read-only dict, key->pinyin, value->[(char, log(probability))].
+    """
+
+    def __init__(self, string_pool, pinyin_ids, pinyin_offsets, entry_chars, entry_probabilities):
+        """
+        Args:
+            string_pool: A StringPool.
+            pinyin_ids: Sorted string ids of pinyin.
+            pinyin_offsets: Range of the entries of every pinyin.
+            entry_chars: String ids of chars, sorted within every pinyin.
+            entry_probabilities: log(probability) of chars.
+        """
+        self.string_pool = string_pool
+        self.pinyin_ids = pinyin_ids
+        self.pinyin_offsets = pinyin_offsets
+        self.entry_chars = entry_chars
+        self.entry_probabilities = entry_probabilities
+        # 拼音数目很少，其字表被各句共用
+        self.entries = functools.lru_cache(maxsize=ENTRY_CACHE_SIZE)(self._entries)
+
+    def syllables(self):
+        """
+        Get all the single pinyin in the table.
+        """
+        return [pinyin for pinyin in map(self.string_pool.decode, self.pinyin_ids) if ' ' not in pinyin]
+
+    def find(self, pinyin):
+        """
+        Find the index of pinyin in pinyin_ids, -1 if not found.
+        """
+        pinyin_id = self.string_pool.find(pinyin)
+        if pinyin_id < 0:
+            return -1
+        index = bisect.bisect_left(self.pinyin_ids, pinyin_id)
+        if index < len(self.pinyin_ids) and self.pinyin_ids[index] == pinyin_id:
+            return index
+        return -1
+
+    def __len__(self):
+        return len(self.pinyin_ids)
+
+    def __contains__(self, pinyin):
+        return self.find(pinyin) >= 0
+
+    def __getitem__(self, pinyin):
+        index = self.find(pinyin)
+        if index < 0:
+            raise KeyError(pinyin)
+        start, stop = self.pinyin_offsets[index], self.pinyin_offsets[index + 1]
+        return [(self.string_pool.decode(self.entry_chars[entry]), self.entry_probabilities[entry])
+                for entry in range(start, stop)]
+
+    def _entries(self, pinyin):
+        """
+        Get chars of pinyin by entry index.
+
+        Args:
+            pinyin: A string, a single pinyin.
+
+        Returns:
+            A list of (entry index, log(probability)), empty if pinyin is not in the table.
+        """
+        index = self.find(pinyin)
+        if index < 0:
+            return []
+        start, stop = self.pinyin_offsets[index], self.pinyin_offsets[index + 1]
+        return list(zip(range(start, stop), self.entry_probabilities[start:stop]))
+
+    def decode(self, entry):
+        """
+        Get the char of an entry index.
+        """
+        return self.string_pool.decode(self.entry_chars[entry])
+
+    def find_entry(self, pinyin, char):
+        """
+        Find the entry index of (pinyin, char), -1 if not found.
+        """
+        index = self.find(pinyin)
+        char_id = self.string_pool.find(char)
+        if index < 0 or char_id < 0:
+            return -1
+        start, stop = self.pinyin_offsets[index], self.pinyin_offsets[index + 1]
+        entry = bisect.bisect_left(self.entry_chars, char_id, start, stop)
+        if entry < stop and self.entry_chars[entry] == char_id:
+            return entry
+        return -1
+
+
+class PinyinPinyinCharCharTable(object):
+    """
+    pinyin-pinyin-char-char table queried in place, indexed by the entry indexes of (pinyin, char).
+    Also behaves like a read-only dict, key->str(pinyin1-pinyin2-char1-char2), value->log(probability).
+    """
+
+    def __init__(self, pinyin_char_table, bigram_offsets, bigram_successors, bigram_probabilities):
+        """
+        Args:
+            pinyin_char_table: A PinyinCharTable, whose entry indexes are used in the bigram sections.
+            bigram_offsets: Range of the successors of every entry.
+            bigram_successors: Sorted pinyin2-char2 entries following every pinyin1-char1 entry.
+            bigram_probabilities: log(probability) of bigram_successors.
+        """
+        self.pinyin_char_table = pinyin_char_table
+        self.bigram_offsets = bigram_offsets
+        self.bigram_successors = bigram_successors
+        self.bigram_probabilities = bigram_probabilities
+        # 常用字的后继反复被查询，缓存为dict以免每次在内存映射上二分查找
+        self.successors = functools.lru_cache(maxsize=SUCCESSOR_CACHE_SIZE)(self._successors)
+        # 常用拼音对的转移矩阵同样缓存，供convert_pinyin_vectorized使用
+        self.transition_matrix = functools.lru_cache(maxsize=TRANSITION_CACHE_SIZE)(self._transition_matrix)
+
+    def _successors(self, entry1):
+        """
+        Get all entries following entry1.
+
+        Returns:
+            A dict, key->entry2, value->log(probability).
+        """
+        start, stop = self.bigram_offsets[entry1], self.bigram_offsets[entry1 + 1]
+        return dict(zip(self.bigram_successors[start:stop], self.bigram_probabilities[start:stop]))
+
+    def _transition_matrix(self, pinyin1_index, pinyin2_index):
+        """
+        Get the dense bigram matrix between the chars of two pinyin. Requires numpy.
+
+        Args:
+            pinyin1_index: Index of pinyin1 in pinyin_ids.
+            pinyin2_index: Index of pinyin2 in pinyin_ids.
+
+        Returns:
+            A 2-d float64 numpy array, log(probability) of the j-th char of pinyin2 following the i-th char of
+            pinyin1, NaN if the pair is not in the table.
+        """
+        pinyin_offsets = self.pinyin_char_table.pinyin_offsets
+        start1, stop1 = pinyin_offsets[pinyin1_index], pinyin_offsets[pinyin1_index + 1]
+        start2, stop2 = pinyin_offsets[pinyin2_index], pinyin_offsets[pinyin2_index + 1]
+        matrix = numpy.full((stop1 - start1, stop2 - start2), numpy.nan)
+        # entry1连续，其后继在CSR中也是连续的一段
+        bigram_offsets = numpy.asarray(self.bigram_offsets[start1:stop1 + 1], dtype=numpy.int64)
+        bigram_start, bigram_stop = int(bigram_offsets[0]), int(bigram_offsets[-1])
+        rows = numpy.repeat(numpy.arange(stop1 - start1), numpy.diff(bigram_offsets))
+        columns = numpy.asarray(self.bigram_successors[bigram_start:bigram_stop], dtype=numpy.int64) - start2
+        probabilities = numpy.asarray(self.bigram_probabilities[bigram_start:bigram_stop], dtype=numpy.float64)
+        mask = (columns >= 0) & (columns < stop2 - start2)
+        matrix[rows[mask], columns[mask]] = probabilities[mask]
+        return matrix
+
+    def probability(self, entry1, entry2):
+        """
+        Get log(probability) of entry2 following entry1, None if the pair is not in the table.
+        """
+        start, stop = self.bigram_offsets[entry1], self.bigram_offsets[entry1 + 1]
+        index = bisect.bisect_left(self.bigram_successors, entry2, start, stop)
+        if index < stop and self.bigram_successors[index] == entry2:
+            return self.bigram_probabilities[index]
+        return None
+
+    def __len__(self):
+        return len(self.bigram_successors)
+
+    def get(self, pinyin_char_pair, default=None):
+        pinyin1, pinyin2, char1, char2 = pinyin_char_pair.split('-')
+        entry1 = self.pinyin_char_table.find_entry(pinyin1, char1)
+        entry2 = self.pinyin_char_table.find_entry(pinyin2, char2)
+        if entry1 < 0 or entry2 < 0:
+            return default
+        probability = self.probability(entry1, entry2)
+        return default if probability is None else probability
+
+    def __contains__(self, pinyin_char_pair):
+        return self.get(pinyin_char_pair) is not None
+
+    def __getitem__(self, pinyin_char_pair):
+        probability = self.get(pinyin_char_pair)
+        if probability is None:
+            raise KeyError(pinyin_char_pair)
+        return probability
 
 
 def load_table(table_path):
     """
-    Load table from table_path.
+    Load pinyin-char table and pinyin-pinyin-char-char table from a binary table file
+    written by build_table.save_table.
+    The file is memory-mapped and queried in place, no Python dict is built.
 
     Args:
-        table_path: Path to the source table json file.
+        table_path: Path to the source binary table file.
 
     Returns:
-        table, a datastructure converted from json file.
+        pinyin-char table: A PinyinCharTable, key->pinyin, value->[(char, log(probability))].
+        pinyin-pinyin-char-char table: A PinyinPinyinCharCharTable,
+            key->str(pinyin1-pinyin2-char1-char2), value->log(probability).
+    """
+    sections = map_sections(table_path)
+    string_pool = StringPool(sections['strings'], sections['string_offsets'])
+    pinyin_char_table = PinyinCharTable(string_pool, sections['pinyin_ids'], sections['pinyin_offsets'],
+                                        sections['entry_chars'], sections['entry_probabilities'])
+    bigram_probabilities = sections['bigram_probabilities']
+    if 'bigram_levels' in sections:
+        bigram_probabilities = QuantizedArray(bigram_probabilities, sections['bigram_levels'])
+    pinyin_pinyin_char_char_table = PinyinPinyinCharCharTable(pinyin_char_table, sections['bigram_offsets'],
+                                                              sections['bigram_successors'], bigram_probabilities)
+    return pinyin_char_table, pinyin_pinyin_char_char_table
+
+
+class ConvertStats(object):
     """
-    with open(table_path, 'r') as f:
-        return json.load(f)
+    Counters and timers of ConvertSession, to size beams and caches from real input.
+    A session given a ConvertStats counts once per pinyin, after timing its phases, so the timers do not include
+    the counting. A session without one only checks `stats is not None` a few times per pinyin.
+
+    Counters:
+        sentences: Sentences backtracked by sentence().
+        pushes, pops: Pinyin appended and deleted, fewer than the converted pinyin if sentences share prefixes.
+        restores: Columns restored by push_state(), e.g. from the cache of an Engine.
+        lattice_nodes: Chars of the pinyin, before pruning.
+        pruned_nodes: Nodes dropped by beam pruning.
+        max_column_nodes: Most nodes kept at a pinyin.
+        transitions: Pairs of a front node and a char following it, scored to find the best front node.
+        bigram_hits: Transitions found in the pinyin-pinyin-char-char table.
+        backoff_misses: Transitions not in the pinyin-pinyin-char-char table, scored with the backoff penalty.
+    Phases, in seconds:
+        lookup: Looking up the chars of a pinyin.
+        scoring: Scoring the transitions.
+        pruning: Beam pruning.
+        backtrack: Backtracking and joining the best sentence.
+    """
+
+    COUNTERS = ("sentences", "pushes", "pops", "restores", "lattice_nodes", "pruned_nodes", "max_column_nodes",
+                "transitions", "bigram_hits", "backoff_misses")
+    PHASES = ("lookup", "scoring", "pruning", "backtrack")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Set all counters and timers to 0.
+        """
+        for counter in self.COUNTERS:
+            setattr(self, counter, 0)
+        self.seconds = dict.fromkeys(self.PHASES, 0.0)
+
+    def as_dict(self):
+        """
+        Returns:
+            A dict of the counters, with the seconds of the phases in a dict under "seconds".
+        """
+        stats = {counter: getattr(self, counter) for counter in self.COUNTERS}
+        stats["seconds"] = dict(self.seconds)
+        return stats
+
+    def merge(self, stats):
+        """
+        Add the counters and timers of another ConvertStats or its as_dict(), e.g. from a worker process.
+        """
+        if isinstance(stats, ConvertStats):
+            stats = stats.as_dict()
+        for counter in self.COUNTERS:
+            if counter.startswith("max_"):
+                setattr(self, counter, max(getattr(self, counter), stats[counter]))
+            else:
+                setattr(self, counter, getattr(self, counter) + stats[counter])
+        for phase in self.PHASES:
+            self.seconds[phase] += stats["seconds"][phase]
+
+    def report(self):
+        """
+        Returns:
+            A few lines summarizing the counters and timers.
+        """
+        total_seconds = sum(self.seconds.values())
+        return '\n'.join((
+            "sentences: %d, pinyin pushed: %d, popped: %d, restored: %d" % (
+                self.sentences, self.pushes, self.pops, self.restores),
+            "lattice nodes: %d (%.1f per pinyin), pruned: %d, most kept at a pinyin: %d" % (
+                self.lattice_nodes, self.lattice_nodes / self.pushes if self.pushes else 0.0, self.pruned_nodes,
+                self.max_column_nodes),
+            "transitions: %d, bigram hits: %d (%.1f%%), backoff misses: %d" % (
+                self.transitions, self.bigram_hits,
+                self.bigram_hits / self.transitions * 100 if self.transitions else 0.0, self.backoff_misses),
+            "time: " + ", ".join("%s %.4fs (%.1f%%)" % (
+                phase, self.seconds[phase], self.seconds[phase] / total_seconds * 100 if total_seconds else 0.0)
+                for phase in self.PHASES),
+        ))
+
+
+class ConvertSession(object):
+    """
+    Incremental convert_pinyin, whose dynamic programming table grows and shrinks one pinyin at a time,
+    e.g. as an input method receives and deletes syllables.
+    Appending or deleting a pinyin costs the same no matter how many pinyin are before it.
+    """
+
+    def __init__(self, pinyin_char_table, pinyin_pinyin_char_char_table, beam_width=None, beam_threshold=None,
+                 backoff_penalty=BACKOFF_PENALTY, stats=None):
+        """
+        Args:
+            pinyin_char_table: pinyin-char table, a PinyinCharTable.
+            pinyin_pinyin_char_char_table: pinyin-pinyin-char-char table, a PinyinPinyinCharCharTable.
+            beam_width, beam_threshold: Beam pruning of every column, see prune_column.
+            backoff_penalty: Penalty in log(probability) of a pair not in the pinyin-pinyin-char-char table,
+                see BACKOFF_PENALTY.
+            stats: A ConvertStats to count the work of the session in, None not to count.
+        """
+        self.pinyin_char_table = pinyin_char_table
+        self.pinyin_pinyin_char_char_table = pinyin_pinyin_char_char_table
+        # 每列至少保留一个节点，回溯时前一列总有前驱
+        if beam_width is not None and beam_width < 1:
+            raise ValueError("beam_width must be at least 1")
+        self.beam_width = beam_width
+        self.beam_threshold = beam_threshold
+        self.backoff_penalty = backoff_penalty
+        self.stats = stats
+        self.pinyin_list = []
+        # dynamic_programming_table:二维数组，记录pinyin_list[:stop_index+1]的最优解
+        # 第一维为stop_index，第二维为list(节点编号，总句probability，尾字probability，尾字后继dict)
+        self.dynamic_programming_table = []
+        # 回溯指针：每个节点的尾字entry及最优前驱节点，-1表示句首，只在最后回溯一次拼出整句
+        self.node_entries = []
+        self.node_backs = []
+        # node_counts[stop_index]:到stop_index为止的节点数，删除拼音时据此截断回溯指针
+        self.node_counts = []
 
+    def __len__(self):
+        return len(self.pinyin_list)
 
-def convert_pinyin(pinyin, pinyin_char_table, pinyin_pinyin_char_char_table):
+    def push(self, pinyin_single):
+        """
+        Append a pinyin and compute its column of the dynamic programming table.
+        Raises InvalidPinyinError and leaves the session unchanged if pinyin_single is not in pinyin_char_table.
+
+        Args:
+            pinyin_single: A string, a single pinyin.
+        """
+        pinyin_single = normalize_pinyin(pinyin_single)
+        if pinyin_single not in self.pinyin_char_table:
+            raise InvalidPinyinError("Unknown pinyin " + pinyin_single)
+        successors = self.pinyin_pinyin_char_char_table.successors
+        backoff_penalty = self.backoff_penalty
+        stats = self.stats
+        if stats is not None:
+            start_time = time.perf_counter()
+        entries = self.pinyin_char_table.entries(pinyin_single)
+        if stats is not None:
+            lookup_time = time.perf_counter()
+            stats.seconds["lookup"] += lookup_time - start_time
+        column = []
+        node_entries = []
+        node_backs = []
+        node_count = len(self.node_entries)
+        if not self.dynamic_programming_table:
+            for entry_whole, char_probability_whole in entries:
+                column.append((node_count + len(node_entries), char_probability_whole, char_probability_whole,
+                               successors(entry_whole)))
+                node_entries.append(entry_whole)
+                node_backs.append(-1)
+        else:
+            for entry_back, char_probability_back in entries:
+                # Pushes one sentence for every char_back
+                max_node_front = -1
+                max_sentence_probability = float("-inf")
+                for node_front, sentence_probability_front, char_probability_front, successors_front in self.dynamic_programming_table[-1]:
+                    # log(probability), so * => + , / => -
+                    char_char_probability = successors_front.get(entry_back)
+                    if char_char_probability is not None:
+                        sentence_probability = (
+                            sentence_probability_front + char_char_probability - char_probability_front)
+                    else:
+                        # Add a punishment to increase accuracy
+                        sentence_probability = sentence_probability_front + char_probability_back - backoff_penalty
+                    if max_node_front < 0 or sentence_probability > max_sentence_probability:
+                        max_node_front = node_front
+                        max_sentence_probability = sentence_probability
+                column.append((node_count + len(node_entries), max_sentence_probability, char_probability_back,
+                               successors(entry_back)))
+                node_entries.append(entry_back)
+                node_backs.append(max_node_front)
+        if stats is not None:
+            stats.seconds["scoring"] += time.perf_counter() - lookup_time
+            # 计时之后再数转移，以免计入打分时间
+            stats.pushes += 1
+            stats.lattice_nodes += len(column)
+            if self.dynamic_programming_table:
+                column_front = self.dynamic_programming_table[-1]
+                for entry_back in node_entries:
+                    bigram_hits = sum(entry_back in successors_front for _, _, _, successors_front in column_front)
+                    stats.transitions += len(column_front)
+                    stats.bigram_hits += bigram_hits
+                    stats.backoff_misses += len(column_front) - bigram_hits
+            pruning_time = time.perf_counter()
+        if self.beam_width is not None or self.beam_threshold is not None:
+            column = prune_column(column, SENTENCE_PROBABILITY_INDEX, self.beam_width, self.beam_threshold)
+        if stats is not None:
+            stats.seconds["pruning"] += time.perf_counter() - pruning_time
+            stats.pruned_nodes += len(node_entries) - len(column)
+            stats.max_column_nodes = max(stats.max_column_nodes, len(column))
+        self.pinyin_list.append(pinyin_single)
+        self.dynamic_programming_table.append(column)
+        self.node_entries.extend(node_entries)
+        self.node_backs.extend(node_backs)
+        self.node_counts.append(len(self.node_entries))
+
+    def pop(self):
+        """
+        Delete the last pinyin.
+
+        Returns:
+            The deleted pinyin.
+        """
+        self.dynamic_programming_table.pop()
+        self.node_counts.pop()
+        node_count = self.node_counts[-1] if self.node_counts else 0
+        del self.node_entries[node_count:]
+        del self.node_backs[node_count:]
+        if self.stats is not None:
+            self.stats.pops += 1
+        return self.pinyin_list.pop()
+
+    def column_state(self):
+        """
+        Get what push() added for the last pinyin, to be restored by push_state() in a session holding the same
+        previous pinyin.
+        """
+        node_count = self.node_counts[-2] if len(self.node_counts) > 1 else 0
+        return self.dynamic_programming_table[-1], self.node_entries[node_count:], self.node_backs[node_count:]
+
+    def push_state(self, pinyin_single, state):
+        """
+        Append a pinyin with the column_state() saved by a session holding the same pinyin before it,
+        without computing the column again.
+        """
+        column, node_entries, node_backs = state
+        if self.stats is not None:
+            self.stats.restores += 1
+        self.pinyin_list.append(normalize_pinyin(pinyin_single))
+        self.dynamic_programming_table.append(column)
+        self.node_entries.extend(node_entries)
+        self.node_backs.extend(node_backs)
+        self.node_counts.append(len(self.node_entries))
+
+    def update(self, pinyin_list):
+        """
+        Make the session hold pinyin_list, the columns of the prefix shared with the current pinyin are kept.
+
+        Args:
+            pinyin_list: A list of single pinyin.
+        """
+        pinyin_list = [normalize_pinyin(pinyin_single) for pinyin_single in pinyin_list]
+        common_length = 0
+        for pinyin_current, pinyin_new in zip(self.pinyin_list, pinyin_list):
+            if pinyin_current != pinyin_new:
+                break
+            common_length += 1
+        while len(self.pinyin_list) > common_length:
+            self.pop()
+        for pinyin_single in pinyin_list[common_length:]:
+            self.push(pinyin_single)
+
+    def sentence(self):
+        """
+        Get the best sentence of the current pinyin, an empty string if there is no pinyin.
+        """
+        if not self.dynamic_programming_table:
+            return ""
+        stats = self.stats
+        if stats is not None:
+            start_time = time.perf_counter()
+        max_node = -1
+        max_sentence_probability = float("-inf")
+        for node, sentence_probability, _, _ in self.dynamic_programming_table[-1]:
+            if max_node < 0 or sentence_probability > max_sentence_probability:
+                max_node = node
+                max_sentence_probability = sentence_probability
+        chars = []
+        while max_node >= 0:
+            chars.append(self.pinyin_char_table.decode(self.node_entries[max_node]))
+            max_node = self.node_backs[max_node]
+        sentence = ''.join(reversed(chars))
+        if stats is not None:
+            stats.seconds["backtrack"] += time.perf_counter() - start_time
+            stats.sentences += 1
+        return sentence
+
+    def probability(self):
+        """
+        Get log(probability) of the best sentence of the current pinyin, 0 if there is no pinyin.
+        """
+        if not self.dynamic_programming_table:
+            return 0.0
+        return max(sentence_probability for _, sentence_probability, _, _ in self.dynamic_programming_table[-1])
+
+    def update_continuous(self, text, splitter):
+        """
+        Replace the pinyin with the most probable split of continuous pinyin, see PinyinSplitter.splits.
+        Splits sharing leading pinyin share their columns, like update().
+
+        Args:
+            text: A string of continuous pinyin, e.g. 'woaibeijing'.
+            splitter: A PinyinSplitter of the pinyin table.
+        """
+        max_split = None
+        max_probability = float("-inf")
+        for split in splitter.splits(text):
+            try:
+                self.update(split)
+            except InvalidPinyinError:
+                continue
+            probability = self.probability()
+            if probability > max_probability:
+                max_split = split
+                max_probability = probability
+        if max_split is None:
+            raise InvalidPinyinError("Invalid pinyin: " + text)
+        self.update(max_split)
+
+    def sentences(self, n):
+        """
+        Get the n best sentences of the current pinyin.
+        Paths are searched backwards from the last column with A*, where the probabilities of the dynamic programming
+        are the exact estimates of the unexplored front parts, so sentences come out best first and the search only
+        visits about n paths instead of decoding n times.
+
+        Args:
+            n: Number of sentences.
+
+        Returns:
+            A list of at most n (sentence, log(probability)), best first.
+        """
+        if not self.dynamic_programming_table:
+            return []
+        tie_breaker = itertools.count()
+        # heap: (-估计的总句probability，序号，stop_index，节点，尾字probability，后句probability，后句)
+        stop_index = len(self.dynamic_programming_table) - 1
+        heap = [(-sentence_probability, next(tie_breaker), stop_index, node, char_probability, 0.0, "")
+                for node, sentence_probability, char_probability, _ in self.dynamic_programming_table[-1]]
+        heapq.heapify(heap)
+        sentences = []
+        while heap and len(sentences) < n:
+            estimate, _, stop_index, node, char_probability, suffix_probability, suffix = heapq.heappop(heap)
+            entry = self.node_entries[node]
+            suffix = self.pinyin_char_table.decode(entry) + suffix
+            if stop_index == 0:
+                sentences.append((suffix, -estimate))
+                continue
+            for node_front, sentence_probability_front, char_probability_front, successors_front in self.dynamic_programming_table[stop_index - 1]:
+                char_char_probability = successors_front.get(entry)
+                # 与push中的转移概率一致
+                if char_char_probability is not None:
+                    transition_probability = char_char_probability - char_probability_front
+                else:
+                    transition_probability = char_probability - self.backoff_penalty
+                suffix_probability_front = suffix_probability + transition_probability
+                heapq.heappush(heap, (-(sentence_probability_front + suffix_probability_front), next(tie_breaker),
+                                      stop_index - 1, node_front, char_probability_front,
+                                      suffix_probability_front, suffix))
+        return sentences
+
+    def words(self, n):
+        """
+        Get candidate chars of the first pinyin, more probable chars first.
+
+        Args:
+            n: Number of chars.
+
+        Returns:
+            A list of at most n (char, log(probability), 1).
+        """
+        if not self.pinyin_list:
+            return []
+        entries = heapq.nlargest(n, self.pinyin_char_table.entries(self.pinyin_list[0]),
+                                 key=lambda entry: entry[1])
+        return [(self.pinyin_char_table.decode(entry), char_probability, 1) for entry, char_probability in entries]
+
+
+def convert_pinyin(pinyin, pinyin_char_table, pinyin_pinyin_char_char_table, beam_width=None, beam_threshold=None,
+                   vectorized=False, backoff_penalty=BACKOFF_PENALTY, stats=None):
     """
     Convert pinyin to Chinese sentence.
 
     Args:
         pinyin: A string, a sentence of pinyin separated by space.
-        pinyin_char_table: pinyin-char table, a dict, key->pinyin, value->[[char, log(probability)].
-        pinyin_pinyin_char_char_table: pinyin-pinyin-char-char table, a dict, key->str(pinyin1-pinyin2-char1-char2), value->log(probability)
+        pinyin_char_table: pinyin-char table, a PinyinCharTable.
+        pinyin_pinyin_char_char_table: pinyin-pinyin-char-char table, a PinyinPinyinCharCharTable.
+        beam_width: Keep at most beam_width best sentences for every stop index, None to keep all.
+        beam_threshold: Drop sentences worse than the best of the same stop index by more than beam_threshold
+            in log(probability), None to keep all.
+        vectorized: Convert with convert_pinyin_vectorized, which does not prune or count.
+        backoff_penalty: Penalty in log(probability) of a pair not in the pinyin-pinyin-char-char table,
+            see BACKOFF_PENALTY.
+        stats: A ConvertStats to count the work in, None not to count.
 
     Returns:
         A string of Chinese characters converted from pinyin.
     """
+    if vectorized:
+        if beam_width is not None or beam_threshold is not None:
+            raise ValueError("convert_pinyin_vectorized does not prune")
+        if stats is not None:
+            raise ValueError("convert_pinyin_vectorized does not count")
+        return convert_pinyin_vectorized(pinyin, pinyin_char_table, pinyin_pinyin_char_char_table, backoff_penalty)
     # Dynamic programming strategy.
     pinyin_list = pinyin.split(' ')
     if not pinyin_list or pinyin_list == ['']:
         return ""
-    # 'lue' should be 'lve' and 'nue' should be 'nve' in standard Chinese pinyin.
-    pinyin_list = ['lve' if pinyin_single == 'lue'
-                   else 'nve' if pinyin_single == 'nue'
-                   else pinyin_single
-                   for pinyin_single in pinyin_list]
-    dynamic_programming_table = [[] for _ in range(len(pinyin_list))]
-    # dynamic_programming_table:二维数组，记录pinyin_list[:stop_index+1]的最优解
-    # 第一维为stop_index，第二维为list(总句，总句probability，尾字pinyin，尾字probability)
-    pinyin_whole = pinyin_list[0]
-    assert pinyin_whole in pinyin_char_table
-    for char_whole, char_probability_whole in pinyin_char_table[pinyin_whole]:
-        dynamic_programming_table[0].append(
-            [char_whole, char_probability_whole, pinyin_whole, char_probability_whole])
+    session = ConvertSession(pinyin_char_table, pinyin_pinyin_char_char_table, beam_width, beam_threshold,
+                             backoff_penalty, stats)
+    session.update(pinyin_list)
+    return session.sentence()
+
+
+def convert_continuous(text, pinyin_char_table, pinyin_pinyin_char_char_table, beam_width=None, beam_threshold=None, splitter=None,
+                       backoff_penalty=BACKOFF_PENALTY, stats=None):
+    """
+    Convert continuous pinyin to Chinese sentence, trying the splits of the pinyin, see PinyinSplitter.
+
+    Args:
+        text: A string of continuous pinyin, e.g. 'woaibeijing', "xi'an" or 'lve'.
+        pinyin_char_table: pinyin-char table, a PinyinCharTable.
+        pinyin_pinyin_char_char_table: pinyin-pinyin-char-char table, a PinyinPinyinCharCharTable.
+        beam_width: Keep at most beam_width best sentences for every pinyin, None to keep all.
+        beam_threshold: Drop sentences worse than the best of the same pinyin by more than beam_threshold
+            in log(probability), None to keep all.
+        splitter: A PinyinSplitter, built from pinyin_char_table if None. Building it takes time, so reuse it.
+        backoff_penalty: Penalty in log(probability) of a pair not in the pinyin-pinyin-char-char table,
+            see BACKOFF_PENALTY.
+        stats: A ConvertStats to count the work in, None not to count.
+
+    Returns:
+        A string of Chinese characters converted from the most probable split of the pinyin.
+    """
+    if splitter is None:
+        splitter = PinyinSplitter(pinyin_char_table.syllables())
+    session = ConvertSession(pinyin_char_table, pinyin_pinyin_char_char_table, beam_width, beam_threshold,
+                             backoff_penalty, stats)
+    session.update_continuous(text, splitter)
+    return session.sentence()
+
+
+def convert_batch(pinyin_lines, pinyin_char_table, pinyin_pinyin_char_char_table,
+                  beam_width=None, beam_threshold=None, vectorized=False, backoff_penalty=BACKOFF_PENALTY, stats=None):
+    """
+    Convert a batch of pinyin to Chinese sentences.
+    Identical pinyin is converted only once. Distinct pinyin is converted in sorted order by one ConvertSession,
+    so the dynamic programming of a prefix shared by neighbours is done only once.
+
+    Args:
+        pinyin_lines: An iterable of strings, sentences of pinyin separated by space.
+        pinyin_char_table: pinyin-char table, a PinyinCharTable.
+        pinyin_pinyin_char_char_table: pinyin-pinyin-char-char table, a PinyinPinyinCharCharTable.
+        beam_width, beam_threshold: Beam pruning of convert_pinyin, None to keep all.
+        vectorized: Convert with convert_pinyin_vectorized, which does not prune or count.
+        backoff_penalty: Penalty in log(probability) of a pair not in the pinyin-pinyin-char-char table,
+            see BACKOFF_PENALTY.
+        stats: A ConvertStats to count the work in, None not to count.
+
+    Returns:
+        A list of strings of Chinese characters in the order of pinyin_lines, None for invalid pinyin.
+    """
+    if vectorized and (beam_width is not None or beam_threshold is not None):
+        raise ValueError("convert_pinyin_vectorized does not prune")
+    if vectorized and stats is not None:
+        raise ValueError("convert_pinyin_vectorized does not count")
+    pinyin_lines = list(pinyin_lines)
+    sentences = dict.fromkeys(pinyin_lines)
+    if vectorized:
+        for pinyin in sentences:
+            try:
+                sentences[pinyin] = convert_pinyin_vectorized(pinyin, pinyin_char_table,
+                                                              pinyin_pinyin_char_char_table, backoff_penalty)
+            except InvalidPinyinError:
+                continue
+        return [sentences[pinyin] for pinyin in pinyin_lines]
+    session = ConvertSession(pinyin_char_table, pinyin_pinyin_char_char_table, beam_width, beam_threshold,
+                             backoff_penalty, stats)
+    for pinyin_list in sorted(pinyin.split(' ') for pinyin in sentences):
+        pinyin = ' '.join(pinyin_list)
+        if pinyin_list == ['']:
+            sentences[pinyin] = ""
+            continue
+        try:
+            session.update(pinyin_list)
+        except InvalidPinyinError:
+            # 无法转换的句子保持为None，不影响批中的其他句子
+            continue
+        sentences[pinyin] = session.sentence()
+    return [sentences[pinyin] for pinyin in pinyin_lines]
+
+
+def convert_pinyin_vectorized(pinyin, pinyin_char_table, pinyin_pinyin_char_char_table,
+                              backoff_penalty=BACKOFF_PENALTY):
+    """
+    Convert pinyin to Chinese sentence, the same as convert_pinyin but every step is a max-plus over numpy arrays
+    of all the chars of two adjacent pinyin. Requires numpy.
+
+    Args:
+        pinyin: A string, a sentence of pinyin separated by space.
+        pinyin_char_table: pinyin-char table, a PinyinCharTable.
+        pinyin_pinyin_char_char_table: pinyin-pinyin-char-char table, a PinyinPinyinCharCharTable.
+        backoff_penalty: Penalty in log(probability) of a pair not in the pinyin-pinyin-char-char table,
+            see BACKOFF_PENALTY.
+
+    Returns:
+        A string of Chinese characters converted from pinyin.
+    """
+    if numpy is None:
+        raise ImportError("convert_pinyin_vectorized requires numpy")
+    pinyin_list = pinyin.split(' ')
+    if not pinyin_list or pinyin_list == ['']:
+        return ""
+    pinyin_list = [normalize_pinyin(pinyin_single) for pinyin_single in pinyin_list]
+    pinyin_indexes = [pinyin_char_table.find(pinyin_single) for pinyin_single in pinyin_list]
+    if min(pinyin_indexes) < 0:
+        raise InvalidPinyinError("Unknown pinyin " + pinyin_list[pinyin_indexes.index(-1)])
+    pinyin_offsets = pinyin_char_table.pinyin_offsets
+    char_probabilities = [
+        numpy.asarray(pinyin_char_table.entry_probabilities[pinyin_offsets[index]:pinyin_offsets[index + 1]],
+                      dtype=numpy.float64)
+        for index in pinyin_indexes]
+    # sentence_probabilities: 以前一个拼音的每个字结尾的总句probability
+    # back_pointers[stop_index]: 以该拼音的每个字结尾时，前一个拼音上最优的字
+    sentence_probabilities = char_probabilities[0]
+    back_pointers = []
     for stop_index in range(1, len(pinyin_list)):
-        pinyin_back = pinyin_list[stop_index]
-        # Single pinyin will never fall out of pinyin_char_table
-        assert pinyin_back in pinyin_char_table
-        for char_back, char_probability_back in pinyin_char_table[pinyin_back]:
-            # Pushes one sentence for every char_back
-            max_sentence = [
-                "", float("-inf"), pinyin_back, char_probability_back]
-            for sentence_front, sentence_probability_front, pinyin_front, char_probability_front in dynamic_programming_table[stop_index - 1]:
-                pinyin_char_pair = '-'.join(
-                    (pinyin_front, pinyin_back, sentence_front[-1], char_back))
-                # log(probability), so * => + , / => -
-                if pinyin_char_pair in pinyin_pinyin_char_char_table:
-                    sentence_probability = (
-                        sentence_probability_front + pinyin_pinyin_char_char_table[pinyin_char_pair] - char_probability_front)
-                else:
-                    # Add a punishment to increase accuracy
-                    sentence_probability = sentence_probability_front + char_probability_back - 2
-                if sentence_probability > max_sentence[1]:
-                    max_sentence[0] = sentence_front + char_back
-                    max_sentence[1] = sentence_probability
-            assert max_sentence[0] != ""
-            dynamic_programming_table[stop_index].append(max_sentence)
-
-    max_sentence = ("", float("-inf"))
-    for dp_node in dynamic_programming_table[-1]:
-        if dp_node[1] > max_sentence[1]:
-            max_sentence = (dp_node[0], dp_node[1])
-    assert max_sentence[0] != ""
-    return max_sentence[0]
+        matrix = pinyin_pinyin_char_char_table.transition_matrix(
+            pinyin_indexes[stop_index - 1], pinyin_indexes[stop_index])
+        char_probabilities_front = char_probabilities[stop_index - 1][:, numpy.newaxis]
+        sentence_probabilities_front = sentence_probabilities[:, numpy.newaxis]
+        # log(probability), so * => + , / => -
+        # Add a punishment to unseen pairs to increase accuracy
+        scores = numpy.where(numpy.isnan(matrix),
+                             sentence_probabilities_front + char_probabilities[stop_index] - backoff_penalty,
+                             sentence_probabilities_front + matrix - char_probabilities_front)
+        # argmax取第一个最大值，与逐个比较时的结果一致
+        best_fronts = scores.argmax(axis=0)
+        sentence_probabilities = scores[best_fronts, numpy.arange(scores.shape[1])]
+        back_pointers.append(best_fronts)
+    best = int(sentence_probabilities.argmax())
+    chars = []
+    for stop_index in range(len(pinyin_list) - 1, -1, -1):
+        chars.append(pinyin_char_table.decode(pinyin_offsets[pinyin_indexes[stop_index]] + best))
+        if stop_index > 0:
+            best = int(back_pointers[stop_index - 1][best])
+    return ''.join(reversed(chars))
@@ -1,43 +1,218 @@
+import argparse
+import collections
+import itertools
+import multiprocessing
 import os
 import sys
 
-from convert_pinyin import load_table, convert_pinyin
-
-
-"""
-main() of the pinyin program.
-"""
-pinyin_char_table_path = os.path.join(
-    os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "char2_pinyin_char_table.json")
-char_char_table_path = os.path.join(
-    os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "char2_pinyin_pinyin_char_char_table.json")
-if len(sys.argv) == 1:
-    # Interactive mode
-    print("Initializing...")
-    pinyin_char_table = load_table(pinyin_char_table_path)
-    char_char_table = load_table(char_char_table_path)
-    print("Initialization finished.")
+from convert_pinyin import (load_table, ConvertSession, ConvertStats, InvalidPinyinError, PinyinSplitter, convert_batch,
+                            convert_continuous, convert_pinyin_vectorized)
+
+# 文件模式下每批转换的行数
+BATCH_SIZE = 10000
+
+
+# 子进程的词库、转换参数、拼音切分器和计数，由init_worker设置
+worker_tables = None
+worker_options = None
+worker_splitter = None
+worker_stats = None
+
+
+def iterate_batches(pinyin_lines):
+    """
+    Split lines of pinyin into lists of at most BATCH_SIZE lines.
+    """
     while True:
-        pinyin = input("全拼拼音，音与音之间用空格隔开：")
-        pinyin = pinyin.strip().lower()
-        sentence = convert_pinyin(pinyin, pinyin_char_table, char_char_table)
-        print(sentence)
-elif len(sys.argv) == 3:
-    # File input-output mode
-    print("Initializing...")
-    pinyin_char_table = load_table(pinyin_char_table_path)
-    char_char_table = load_table(char_char_table_path)
-    print("Initialization finished.")
-    with open(sys.argv[1], 'r') as input_file, open(sys.argv[2], 'w') as output_file:
-        for pinyin in input_file:
-            pinyin = pinyin.strip().lower()
-            sentence = convert_pinyin(
-                pinyin, pinyin_char_table, char_char_table)
+        pinyin_batch = list(itertools.islice(pinyin_lines, BATCH_SIZE))
+        if not pinyin_batch:
+            return
+        yield pinyin_batch
+
+
+def convert_each(convert, pinyin_batch):
+    """
+    Convert every pinyin of a batch with the worker tables and options, None for invalid pinyin like convert_batch.
+    """
+    sentences = []
+    for pinyin in pinyin_batch:
+        try:
+            sentences.append(convert(pinyin, *worker_tables, splitter=worker_splitter, **worker_options))
+        except InvalidPinyinError:
+            sentences.append(None)
+    return sentences
+
+
+def init_worker(table_path, options, split=False, profile=False):
+    """
+    Load the table in a worker process. The table file is memory-mapped, so all workers share one copy of it.
+    A PinyinSplitter is also built if split, and a ConvertStats if profile.
+    """
+    global worker_tables, worker_options, worker_splitter, worker_stats
+    worker_tables = load_table(table_path)
+    if not isinstance(worker_tables, tuple):
+        worker_tables = (worker_tables,)
+    worker_stats = ConvertStats() if profile else None
+    worker_options = dict(options, stats=worker_stats) if profile else options
+    worker_splitter = PinyinSplitter(worker_tables[0].syllables()) if split else None
+
+
+def convert_worker_batch(pinyin_batch):
+    """
+    Convert a batch of pinyin in a worker process.
+
+    Returns:
+        A list of sentences, None for invalid pinyin, and the as_dict() of the ConvertStats of the batch if
+        profiling, otherwise None.
+    """
+    if worker_splitter is not None:
+        sentences = convert_each(convert_continuous, pinyin_batch)
+    else:
+        sentences = convert_batch(pinyin_batch, *worker_tables, **worker_options)
+    if worker_stats is None:
+        return sentences, None
+    # 每批取走计数后清零，由主进程累加
+    batch_stats = worker_stats.as_dict()
+    worker_stats.reset()
+    return sentences, batch_stats
+
+
+def convert_file(input_file, output_file, table_path, options, jobs, split=False, profile=False):
+    """
+    Convert every line of input_file and write the sentences to output_file in the same order.
+    A line of invalid pinyin is written as an empty line and its line number is reported to stderr.
+
+    Args:
+        input_file: A text file of pinyin, one sentence per line.
+        output_file: A text file to write Chinese sentences to.
+        table_path: Path to the binary table file.
+        options: Keyword arguments of convert_batch.
+        jobs: Number of worker processes, 1 to convert in this process.
+        split: Whether the pinyin is continuous and has to be split, see convert_continuous.
+        profile: Whether to count the work of the conversion, see ConvertStats.
+
+    Returns:
+        A ConvertStats of the work of all processes if profile, otherwise None.
+    """
+    pinyin_lines = (pinyin.strip().lower() for pinyin in input_file)
+    stats = ConvertStats() if profile else None
+    line_number = 0
+
+    def write_batch(result):
+        nonlocal line_number
+        sentences, batch_stats = result
+        if stats is not None:
+            stats.merge(batch_stats)
+        for sentence in sentences:
+            line_number += 1
+            if sentence is None:
+                # 无法转换的行输出空行，以免之后的行错位
+                print("Line %d: invalid pinyin" % line_number, file=sys.stderr)
+                sentence = ""
             output_file.write(sentence)
             output_file.write('\n')
-else:
-    # Help
-    print("拼音输入法使用方法：")
-    print("1.提供输入文件名和输出文件名并运行程序，例如: ")
-    print("  pinyin ../data/input.txt ../data/output.txt")
-    print("2.交互模式，直接运行程序即可")
+
+    if jobs <= 1:
+        init_worker(table_path, options, split, profile)
+        for pinyin_batch in iterate_batches(pinyin_lines):
+            write_batch(convert_worker_batch(pinyin_batch))
+        return stats
+    with multiprocessing.Pool(jobs, init_worker, (table_path, options, split, profile)) as pool:
+        # 按提交顺序取回结果以保持输出顺序，并限制排队的批数以免把整个文件读进内存
+        pending_results = collections.deque()
+        for pinyin_batch in iterate_batches(pinyin_lines):
+            pending_results.append(pool.apply_async(convert_worker_batch, (pinyin_batch,)))
+            while len(pending_results) > jobs * 2 or (pending_results and pending_results[0].ready()):
+                write_batch(pending_results.popleft().get())
+        while pending_results:
+            write_batch(pending_results.popleft().get())
+    return stats
+
+
+def main():
+    """
+    main() of the pinyin program.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs='*')
+    parser.add_argument("--beam-width", type=int, default=None,
+                        help="keep at most this many best sentences at every pinyin, default keep all")
+    parser.add_argument("--beam-threshold", type=float, default=None,
+                        help="drop sentences worse than the best by more than this log10 probability, default keep all")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="score every step with numpy over all chars at once, requires numpy")
+    parser.add_argument("--candidates", type=int, default=0,
+                        help="also print this many best sentences and words in interactive mode")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of processes converting the input file in parallel")
+    parser.add_argument("--split", action="store_true",
+                        help="pinyin is continuous like woaibeijing or xi'an, try the ways to split it")
+    parser.add_argument("--profile", action="store_true",
+                        help="print counters and time of the phases of conversion to stderr")
+    args = parser.parse_args()
+    if args.vectorized and (args.beam_width is not None or args.beam_threshold is not None):
+        parser.error("--vectorized does not prune, it can not be used with --beam-width or --beam-threshold")
+    if args.vectorized and args.split:
+        parser.error("--vectorized can not be used with --split")
+    if args.vectorized and args.profile:
+        parser.error("--vectorized does not count, it can not be used with --profile")
+    table_path = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "char2_table.bin")
+    if len(args.files) == 0:
+        # Interactive mode
+        print("Initializing...")
+        pinyin_char_table, char_char_table = load_table(table_path)
+        print("Initialization finished.")
+        # 保留与上一句相同的前缀的动态规划结果，只计算新增的拼音
+        stats = ConvertStats() if args.profile else None
+        session = ConvertSession(pinyin_char_table, char_char_table,
+                                 beam_width=args.beam_width, beam_threshold=args.beam_threshold, stats=stats)
+        splitter = PinyinSplitter(pinyin_char_table.syllables()) if args.split else None
+        while True:
+            pinyin = input("全拼拼音，可不用空格连续输入：" if splitter is not None else "全拼拼音，音与音之间用空格隔开：")
+            pinyin = pinyin.strip().lower()
+            try:
+                if args.vectorized:
+                    print(convert_pinyin_vectorized(pinyin, pinyin_char_table, char_char_table))
+                    continue
+                if splitter is not None:
+                    session.update_continuous(pinyin, splitter)
+                else:
+                    session.update(pinyin.split(' ') if pinyin else [])
+            except InvalidPinyinError as error:
+                print("无法转换：", error)
+                continue
+            print(session.sentence())
+            if stats is not None:
+                # 只给出这一句新增的计数
+                print(stats.report(), file=sys.stderr)
+                stats.reset()
+            if args.candidates > 0:
+                for index, (sentence, probability) in enumerate(session.sentences(args.candidates), 1):
+                    print("%d. %s %.2f" % (index, sentence, probability))
+                print(" ".join(word for word, _, _ in session.words(args.candidates)))
+    elif len(args.files) == 2:
+        # File input-output mode
+        options = {"beam_width": args.beam_width, "beam_threshold": args.beam_threshold}
+        if args.vectorized:
+            options["vectorized"] = True
+        with open(args.files[0], 'r') as input_file, open(args.files[1], 'w') as output_file:
+            stats = convert_file(input_file, output_file, table_path, options, args.jobs, args.split, args.profile)
+        if stats is not None:
+            print(stats.report(), file=sys.stderr)
+    else:
+        # Help
+        print("拼音输入法使用方法：")
+        print("1.提供输入文件名和输出文件名并运行程序，例如: ")
+        print("  pinyin ../data/input.txt ../data/output.txt")
+        print("2.交互模式，直接运行程序即可")
+        print("可选参数--beam-width N和--beam-threshold T限制每个拼音处保留的候选句数和概率差，以精度换取速度")
+        print("可选参数--candidates N在交互模式下同时给出前N个候选句和候选词")
+        print("可选参数--jobs N用N个进程并行转换输入文件")
+        print("可选参数--profile在标准错误输出中给出格点数、转移数、二元组命中数和各阶段耗时")
+        print("可选参数--split表示拼音连续输入不用空格隔开，例如woaibeijing，由程序切分")
+        print("可选参数--vectorized用numpy向量化计算每一步，需要安装numpy")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import collections
+import importlib.util
+import os
+import sys
+
+# 三个模型的名称，即src下的子文件夹名
+ENGINE_NAMES = ("char2", "word1", "word2")
+SOURCE_DIRNAME = os.path.dirname(os.path.realpath(__file__))
+DATA_DIRNAME = os.path.join(SOURCE_DIRNAME, os.path.pardir, "data")
+
+
+def import_convert_pinyin(name):
+    """
+    Import convert_pinyin.py of a model.
+    Every model has its own convert_pinyin.py, so they are imported under different module names
+    and several models can be used in one process.
+
+    Args:
+        name: Name of the model, one of ENGINE_NAMES.
+
+    Returns:
+        The convert_pinyin module of the model.
+    """
+    if name not in ENGINE_NAMES:
+        raise ValueError("Unknown engine: %s" % name)
+    module_name = "%s_convert_pinyin" % name
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(
+        module_name, os.path.join(SOURCE_DIRNAME, name, "convert_pinyin.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def approximate_size(value):
+    """
+    Approximate memory size of a cached value in bytes.
+    Tuples and lists are counted with their items, dicts are successors shared with the tables and not counted.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        for item in value:
+            if isinstance(item, (tuple, list, str, float)):
+                size += approximate_size(item)
+    return size
+
+
+class LRUCache(object):
+    """
+    A bounded least recently used cache, counting hits and misses.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        """
+        Args:
+            max_entries: Keep at most max_entries entries, None for no limit.
+            max_bytes: Keep entries of at most max_bytes bytes by approximate_size, None for no limit.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Get the value of key and mark it as recently used, None if not cached.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        """
+        Cache value under key, evicting the least recently used entries beyond the limits.
+        """
+        entry_size = approximate_size(key) + approximate_size(value) if self.max_bytes is not None else 0
+        old_entry = self.entries.pop(key, None)
+        if old_entry is not None:
+            self.size -= old_entry[1]
+        self.entries[key] = (value, entry_size)
+        self.size += entry_size
+        while self.entries and ((self.max_entries is not None and len(self.entries) > self.max_entries)
+                                or (self.max_bytes is not None and self.size > self.max_bytes)):
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        """
+        Returns:
+            A dict of the counters of the cache.
+        """
+        return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+
+class ConversionCache(object):
+    """
+    Caches of an Engine for repeated pinyin, keyed on the normalized pinyin and the options of conversion.
+
+    Two caches share the limits:
+        sentences: The converted sentence of a whole pinyin sentence.
+        columns: The lattice column of every pinyin prefix, saved by ConvertSession.column_state(),
+            so that a sentence sharing leading pinyin with a cached one only computes the columns after them.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        """
+        Args:
+            max_entries: Keep at most max_entries sentences and max_entries columns, None for no limit.
+            max_bytes: Keep at most max_bytes bytes of sentences and columns in total, None for no limit.
+                Columns are much larger than sentences, so they get 7/8 of the budget.
+        """
+        self.sentences = LRUCache(max_entries, max_bytes // 8 if max_bytes is not None else None)
+        self.columns = LRUCache(max_entries, max_bytes - max_bytes // 8 if max_bytes is not None else None)
+
+    def clear(self):
+        self.sentences.clear()
+        self.columns.clear()
+
+    def stats(self):
+        """
+        Returns:
+            A dict of the counters of the sentence cache and the column cache.
+        """
+        return {"sentences": self.sentences.stats(), "columns": self.columns.stats()}
+
+
+class Engine(object):
+    """
+    A loaded model, converting pinyin to Chinese sentences.
+    """
+
+    def __init__(self, name, module, tables, cache=None):
+        """
+        Args:
+            name: Name of the model, one of ENGINE_NAMES.
+            module: The convert_pinyin module of the model.
+            tables: A tuple of the tables returned by module.load_table.
+            cache: A ConversionCache for repeated pinyin, None to convert every time.
+        """
+        self.name = name
+        self.module = module
+        self.tables = tables
+        self.cache = cache
+        # 切分连续拼音的trie，首次使用时建立
+        self.splitter = None
+
+    def convert(self, pinyin, **options):
+        """
+        Convert pinyin to Chinese sentence.
+
+        Args:
+            pinyin: A string, a sentence of pinyin separated by space.
+            options: Keyword arguments of convert_pinyin of the model, e.g. beam_width, or stats to count the work
+                in a ConvertStats of the model, which does not count pinyin answered by the cache.
+
+        Returns:
+            A string of Chinese characters converted from pinyin.
+        """
+        # char2的向量化解码没有可缓存的列，与convert_batch一样不经过缓存；vectorized=False不传给ConvertSession
+        if options.pop("vectorized", False):
+            return self.module.convert_pinyin(pinyin, *self.tables, vectorized=True, **options)
+        if self.cache is None:
+            return self.module.convert_pinyin(pinyin, *self.tables, **options)
+        pinyin_list = pinyin.split(' ')
+        if pinyin_list == ['']:
+            return ""
+        pinyin_list = [self.module.normalize_pinyin(pinyin_single) for pinyin_single in pinyin_list]
+        # stats只计数，不影响结果，不放进缓存的键
+        options_key = tuple(sorted(item for item in options.items() if item[0] != "stats"))
+        sentence_key = (options_key, tuple(pinyin_list))
+        sentence = self.cache.sentences.get(sentence_key)
+        if sentence is not None:
+            return sentence
+        # 复用已缓存的最长拼音前缀的各列，只计算其后的列
+        session = self.module.ConvertSession(*self.tables, **options)
+        cached = True
+        for index, pinyin_single in enumerate(pinyin_list):
+            column_key = sentence_key if index == len(pinyin_list) - 1 \
+                else (options_key, tuple(pinyin_list[:index + 1]))
+            state = self.cache.columns.get(column_key) if cached else None
+            if state is None:
+                # 之后的列都由本次计算，不再查找缓存
+                cached = False
+                session.push(pinyin_single)
+                self.cache.columns.put(column_key, session.column_state())
+            else:
+                session.push_state(pinyin_single, state)
+        sentence = session.sentence()
+        self.cache.sentences.put(sentence_key, sentence)
+        return sentence
+
+    def convert_batch(self, pinyin_lines, **options):
+        """
+        Convert a batch of pinyin to Chinese sentences, see convert_batch of the model.
+
+        Args:
+            pinyin_lines: An iterable of strings, sentences of pinyin separated by space.
+            options: Keyword arguments of convert_batch of the model, e.g. beam_width.
+
+        Returns:
+            A list of strings of Chinese characters in the order of pinyin_lines, None for invalid pinyin.
+        """
+        # char2的向量化解码整批计算，不经过缓存
+        if options.pop("vectorized", False):
+            return self.module.convert_batch(pinyin_lines, *self.tables, vectorized=True, **options)
+        if self.cache is None:
+            return self.module.convert_batch(pinyin_lines, *self.tables, **options)
+        sentences = []
+        for pinyin in pinyin_lines:
+            try:
+                sentences.append(self.convert(pinyin, **options))
+            except self.module.InvalidPinyinError:
+                sentences.append(None)
+        return sentences
+
+    def convert_continuous(self, text, **options):
+        """
+        Convert continuous pinyin like 'woaibeijing' to Chinese sentence, see convert_continuous of the model.
+
+        Args:
+            text: A string of continuous pinyin.
+            options: Keyword arguments of convert_continuous of the model, e.g. beam_width.
+
+        Returns:
+            A string of Chinese characters converted from the most probable split of the pinyin.
+        """
+        if self.splitter is None:
+            self.splitter = self.module.PinyinSplitter(self.tables[0].syllables())
+        return self.module.convert_continuous(text, *self.tables, splitter=self.splitter, **options)
+
+    def convert_abbreviated(self, text, **options):
+        """
+        Convert abbreviated pinyin like 'bj' or 'zhongguor' to Chinese sentence, see convert_abbreviated of the model.
+        Only word1 and word2 have the initials index, char2 has no words to abbreviate.
+
+        Args:
+            text: A string of abbreviated pinyin, continuous or separated by space.
+            options: Keyword arguments of convert_abbreviated of the model, e.g. beam_width.
+
+        Returns:
+            A string of Chinese characters converted from the most probable split of the pinyin.
+        """
+        if not hasattr(self.module, "convert_abbreviated"):
+            raise ValueError("%s does not support abbreviated pinyin" % self.name)
+        if self.splitter is None:
+            self.splitter = self.module.PinyinSplitter(self.tables[0].syllables())
+        return self.module.convert_abbreviated(text, *self.tables, splitter=self.splitter, **options)
+
+    def session(self, **options):
+        """
+        Start an incremental conversion, see ConvertSession of the model.
+
+        Args:
+            options: Keyword arguments of ConvertSession of the model, e.g. beam_width.
+
+        Returns:
+            A ConvertSession, pinyin is appended by push() and deleted by pop().
+        """
+        return self.module.ConvertSession(*self.tables, **options)
+
+
+def load_engine(name, table_path=None, cache_entries=None, cache_bytes=None):
+    """
+    Load a model.
+
+    Args:
+        name: Name of the model, one of ENGINE_NAMES.
+        table_path: Path to the binary table file, data/<name>_table.bin by default.
+        cache_entries: Cache at most cache_entries sentences and lattice columns, see ConversionCache.
+        cache_bytes: Cache at most cache_bytes bytes of sentences and lattice columns, see ConversionCache.
+            Repeated pinyin is not cached if both cache_entries and cache_bytes are None.
+
+    Returns:
+        An Engine.
+    """
+    module = import_convert_pinyin(name)
+    if table_path is None:
+        table_path = os.path.join(DATA_DIRNAME, "%s_table.bin" % name)
+    tables = module.load_table(table_path)
+    if not isinstance(tables, tuple):
+        tables = (tables,)
+    cache = None
+    if cache_entries is not None or cache_bytes is not None:
+        cache = ConversionCache(cache_entries, cache_bytes)
+    return Engine(name, module, tables, cache)
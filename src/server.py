@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import urllib.parse
+
+from engines import ENGINE_NAMES, load_engine
+
+# 每次从连接读取的最大字节数
+READ_SIZE = 64 * 1024
+# HTTP请求头的最大字节数
+MAX_HEADER_SIZE = 64 * 1024
+# Unix socket上一行拼音的最大字节数，超过时关闭连接
+MAX_LINE_SIZE = 64 * 1024
+# HTTP请求体的最大字节数，超过时回答413并关闭连接
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+
+class ConversionServer(object):
+    """
+    A long-running server converting pinyin with a model loaded once.
+
+    Two protocols are served:
+        Unix socket: one sentence of pinyin per line, answered by one Chinese sentence per line in the same
+            order. Clients may pipeline any number of lines, the lines that arrive together are converted as a batch.
+        HTTP: GET /convert?pinyin=ni+hao answers {"pinyin": ..., "sentence": ...} in json,
+            GET /convert?pinyin=ni+hao&n=5 also answers the 5 best "sentences" and "words" with their log(probability),
+            POST /convert answers every line of the body with a line of Chinese sentence,
+            GET /stats answers the counters of the cache of the engine in json.
+            Connections are kept alive, so pipelined requests are answered in order.
+    A connection sending a line longer than MAX_LINE_SIZE, a header longer than MAX_HEADER_SIZE or a body longer
+    than MAX_BODY_SIZE is closed, so that a client cannot make the server buffer without limit.
+    """
+
+    def __init__(self, engine, options):
+        """
+        Args:
+            engine: An engines.Engine.
+            options: Keyword arguments of the convert functions of the model, e.g. beam_width.
+        """
+        self.engine = engine
+        self.options = options
+        # 转换占用CPU，放到线程中执行以免阻塞事件循环；只用一个线程，因为引擎的缓存不是线程安全的
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def convert(self, pinyin_lines):
+        """
+        Convert a batch of pinyin, invalid pinyin is converted to None.
+        """
+        return self.engine.convert_batch(pinyin_lines, **self.options)
+
+    def convert_lines(self, lines):
+        """
+        Convert lines of pinyin in bytes to lines of Chinese sentences in bytes.
+        A line of invalid pinyin is answered by an empty line, so that answers stay in line with requests.
+        """
+        pinyin_lines = [line.decode('utf-8', 'replace').strip().lower() for line in lines]
+        sentences = self.convert(pinyin_lines)
+        return b''.join((sentence or '').encode('utf-8') + b'\n' for sentence in sentences)
+
+    async def handle_lines(self, reader, writer):
+        """
+        Serve the line protocol on a connection.
+        """
+        loop = asyncio.get_running_loop()
+        buffer = b''
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                buffer += data
+                # 一次转换所有已到达的完整行
+                lines = buffer.split(b'\n')
+                buffer = lines.pop()
+                if lines:
+                    writer.write(await loop.run_in_executor(self.executor, self.convert_lines, lines))
+                    await writer.drain()
+                if len(buffer) > MAX_LINE_SIZE:
+                    # 不完整的行已超过上限，不再等待它的结尾
+                    buffer = b''
+                    break
+            if buffer.strip():
+                writer.write(await loop.run_in_executor(self.executor, self.convert_lines, [buffer]))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def respond_http(self, writer, status, content_type, body, keep_alive):
+        """
+        Write an HTTP response.
+        """
+        headers = [
+            "HTTP/1.1 %s" % status,
+            "Content-Type: %s" % content_type,
+            "Content-Length: %d" % len(body),
+            "Connection: %s" % ("keep-alive" if keep_alive else "close"),
+        ]
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body)
+
+    def handle_http_request(self, method, target, body):
+        """
+        Handle one HTTP request.
+
+        Returns:
+            status, content type and body of the response.
+        """
+        url = urllib.parse.urlsplit(target)
+        if url.path == "/stats" and method == "GET":
+            stats = self.engine.cache.stats() if self.engine.cache is not None else {}
+            return "200 OK", "application/json; charset=utf-8", json.dumps(stats).encode('utf-8')
+        if url.path != "/convert":
+            return "404 Not Found", "text/plain; charset=utf-8", b"Not Found\n"
+        if method == "GET":
+            query = urllib.parse.parse_qs(url.query)
+            if "pinyin" not in query:
+                return "400 Bad Request", "text/plain; charset=utf-8", b"Missing pinyin\n"
+            pinyin = query["pinyin"][0].strip().lower()
+            sentence = self.convert([pinyin])[0]
+            if sentence is None:
+                return "400 Bad Request", "text/plain; charset=utf-8", b"Invalid pinyin\n"
+            result = {"pinyin": pinyin, "sentence": sentence}
+            try:
+                candidate_number = int(query.get("n", ["0"])[0])
+            except ValueError:
+                return "400 Bad Request", "text/plain; charset=utf-8", b"Invalid n\n"
+            if candidate_number > 0:
+                session = self.engine.session(**self.options)
+                try:
+                    session.update(pinyin.split(' ') if pinyin else [])
+                except self.engine.module.InvalidPinyinError:
+                    return "400 Bad Request", "text/plain; charset=utf-8", b"Invalid pinyin\n"
+                result["sentences"] = session.sentences(candidate_number)
+                result["words"] = session.words(candidate_number)
+            response = json.dumps(result, ensure_ascii=False)
+            return "200 OK", "application/json; charset=utf-8", response.encode('utf-8')
+        if method == "POST":
+            lines = body.split(b'\n')
+            if lines and not lines[-1].strip():
+                lines.pop()
+            return "200 OK", "text/plain; charset=utf-8", self.convert_lines(lines)
+        return "405 Method Not Allowed", "text/plain; charset=utf-8", b"Method Not Allowed\n"
+
+    async def handle_http(self, reader, writer):
+        """
+        Serve HTTP/1.1 on a connection.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    header = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.LimitOverrunError:
+                    self.respond_http(writer, "431 Request Header Fields Too Large",
+                                      "text/plain; charset=utf-8", b"", False)
+                    break
+                request_line, *header_lines = header.decode('latin-1').rstrip('\r\n').split('\r\n')
+                try:
+                    method, target, version = request_line.split(' ')
+                except ValueError:
+                    self.respond_http(writer, "400 Bad Request", "text/plain; charset=utf-8", b"", False)
+                    break
+                headers = {}
+                for header_line in header_lines:
+                    name, _, value = header_line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    content_length = int(headers.get("content-length", 0))
+                except ValueError:
+                    content_length = -1
+                if content_length < 0:
+                    self.respond_http(writer, "400 Bad Request", "text/plain; charset=utf-8", b"", False)
+                    break
+                if content_length > MAX_BODY_SIZE:
+                    self.respond_http(writer, "413 Payload Too Large", "text/plain; charset=utf-8", b"", False)
+                    break
+                body = await reader.readexactly(content_length)
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                status, content_type, response = await loop.run_in_executor(
+                    self.executor, self.handle_http_request, method, target, body)
+                self.respond_http(writer, status, content_type, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(server, unix_path=None, port=None, host="127.0.0.1"):
+    """
+    Serve the line protocol on unix_path and HTTP on host:port until cancelled.
+    """
+    servers = []
+    if unix_path is not None:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        servers.append(await asyncio.start_unix_server(server.handle_lines, path=unix_path))
+    if port is not None:
+        servers.append(await asyncio.start_server(server.handle_http, host, port, limit=MAX_HEADER_SIZE))
+    try:
+        await asyncio.gather(*(asyncio_server.serve_forever() for asyncio_server in servers))
+    finally:
+        for asyncio_server in servers:
+            asyncio_server.close()
+        if unix_path is not None and os.path.exists(unix_path):
+            os.remove(unix_path)
+
+
+"""
+Load a model once and serve pinyin conversion over a Unix socket and/or localhost HTTP.
+"""
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", choices=ENGINE_NAMES, default="word2",
+                        help="model to serve")
+    parser.add_argument("--table", default=None,
+                        help="path to the binary table file, data/<engine>_table.bin by default")
+    parser.add_argument("--unix", default=None,
+                        help="path of the Unix socket serving one sentence per line")
+    parser.add_argument("--port", type=int, default=None,
+                        help="port of the HTTP server")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address of the HTTP server")
+    parser.add_argument("--beam-width", type=int, default=None,
+                        help="beam width of char2 and word2, default keep all")
+    parser.add_argument("--beam-threshold", type=float, default=None,
+                        help="beam threshold of char2 and word2, default keep all")
+    parser.add_argument("--cache-entries", type=int, default=None,
+                        help="cache at most this many sentences and lattice columns of repeated pinyin")
+    parser.add_argument("--cache-bytes", type=int, default=None,
+                        help="cache at most this many bytes of sentences and lattice columns of repeated pinyin")
+    args = parser.parse_args()
+    if args.unix is None and args.port is None:
+        parser.error("at least one of --unix and --port is required")
+    if args.engine == "word1" and (args.beam_width is not None or args.beam_threshold is not None):
+        parser.error("word1 does not support --beam-width or --beam-threshold")
+    options = {}
+    if args.beam_width is not None:
+        options["beam_width"] = args.beam_width
+    if args.beam_threshold is not None:
+        options["beam_threshold"] = args.beam_threshold
+    conversion_server = ConversionServer(
+        load_engine(args.engine, args.table, args.cache_entries, args.cache_bytes), options)
+    try:
+        asyncio.run(serve(conversion_server, args.unix, args.port, args.host))
+    except KeyboardInterrupt:
+        pass
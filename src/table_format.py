@@ -0,0 +1,452 @@
+import array
+import bisect
+import collections
+import heapq
+import itertools
+import mmap
+import operator
+import struct
+
+# 二进制词库文件格式：文件头 + 段目录 + 按8字节对齐的各段数组
+TABLE_MAGIC = b'PINYINv1'
+# magic, 段数
+HEADER_FORMAT = '<8sI4x'
+# 段名, array类型码, 偏移, 元素个数
+SECTION_FORMAT = '<24sc7xQQ'
+# 量化位数对应的array类型码
+QUANTIZE_TYPECODES = {8: 'B', 16: 'H'}
+# 连续输入的拼音最多尝试的切分方式数
+MAX_SPLITS = 16
+# 连续输入中拼音之间的分隔符
+PINYIN_SEPARATORS = " '"
+# 简拼索引收录的词语最多的音节数
+MAX_INITIALS_LENGTH = 6
+# 简拼索引中每个简拼保留的词数
+INITIALS_TOP_K = 32
+
+
+class InvalidPinyinError(ValueError):
+    """
+    Raised when pinyin can not be converted, e.g. a syllable not in the table or no word ending with it.
+    Unlike assert, it is not stripped by python -O.
+    """
+
+
+def map_sections(table_path):
+    """
+    Map a binary table file written by write_sections into memory.
+    Sections are read in place, so processes loading the same file share one copy in the page cache.
+
+    Args:
+        table_path: Path to the source binary table file.
+
+    Returns:
+        A dict, key->section name, value->memoryview cast to the type of the section.
+    """
+    with open(table_path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, section_count = struct.unpack_from(HEADER_FORMAT, data, 0)
+    if magic != TABLE_MAGIC:
+        raise ValueError("Table file format is not recognized")
+    view = memoryview(data)
+    sections = dict()
+    position = struct.calcsize(HEADER_FORMAT)
+    for _ in range(section_count):
+        name, typecode, offset, length = struct.unpack_from(
+            SECTION_FORMAT, data, position)
+        position += struct.calcsize(SECTION_FORMAT)
+        typecode = typecode.decode('ascii')
+        itemsize = struct.calcsize(typecode)
+        sections[name.rstrip(b'\0').decode('ascii')] = \
+            view[offset:offset + length * itemsize].cast(typecode)
+    return sections
+
+
+class QuantizedArray(object):
+    """
+    log(probability) quantized by quantize, read like an array of floats.
+    """
+
+    def __init__(self, codes, levels):
+        """
+        Args:
+            codes: 8 or 16-bit codes.
+            levels: float32 log(probability) of every code.
+        """
+        self.codes = codes
+        self.levels = levels.tolist()
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.levels[code] for code in self.codes[index]]
+        return self.levels[self.codes[index]]
+
+
+class StringPool(object):
+    """
+    Sorted strings of a table file, indexed by string id and queried in place.
+    Behaves like a read-only sequence of utf-8 bytes, so that it can be binary searched.
+    """
+
+    def __init__(self, strings, string_offsets):
+        """
+        Args:
+            strings: Sorted strings in utf-8 joined by '\n'.
+            string_offsets: Start of every string in strings, followed by len(strings) + 1.
+        """
+        self.strings = strings
+        self.string_offsets = string_offsets
+
+    def __len__(self):
+        return len(self.string_offsets) - 1
+
+    def __getitem__(self, string_id):
+        return bytes(self.strings[self.string_offsets[string_id]:self.string_offsets[string_id + 1] - 1])
+
+    def decode(self, string_id):
+        """
+        Get the string of string_id.
+        """
+        return self[string_id].decode('utf-8')
+
+    def find(self, string):
+        """
+        Find the string id of string, -1 if not found.
+        """
+        key = string.encode('utf-8')
+        string_id = bisect.bisect_left(self, key)
+        if string_id < len(self) and self[string_id] == key:
+            return string_id
+        return -1
+
+
+class InitialsIndex(object):
+    """
+    Index from the initials of pinyin to the most probable entries of the pinyin, e.g. 'bj' -> 'bei jing', ...
+    Queried in place, see build_initials.
+    """
+
+    def __init__(self, string_pool, initial_entry_offsets, initial_entries):
+        """
+        Args:
+            string_pool: A StringPool of the sorted initials.
+            initial_entry_offsets: Range of the entries of every initials.
+            initial_entries: Entries of the pinyin-word table, more probable first.
+        """
+        self.string_pool = string_pool
+        self.initial_entry_offsets = initial_entry_offsets
+        self.initial_entries = initial_entries
+
+    def __len__(self):
+        return len(self.string_pool)
+
+    def entries(self, initials):
+        """
+        Get the entries of initials, more probable first, empty if initials is not in the index.
+        """
+        index = self.string_pool.find(initials)
+        if index < 0:
+            return []
+        return self.initial_entries[self.initial_entry_offsets[index]:self.initial_entry_offsets[index + 1]].tolist()
+
+
+def normalize_pinyin(pinyin_single):
+    """
+    'lue' should be 'lve' and 'nue' should be 'nve' in standard Chinese pinyin.
+    """
+    if pinyin_single == 'lue':
+        return 'lve'
+    if pinyin_single == 'nue':
+        return 'nve'
+    return pinyin_single
+
+
+class PinyinSplitter(object):
+    """
+    Split continuous pinyin like 'woaibeijing' into single pinyin with a trie of all valid single pinyin.
+    Space and "'" force a split, e.g. "xi'an", and 'ü' may be written as 'v', 'ü' or 'u:'.
+    """
+
+    def __init__(self, syllables):
+        """
+        Args:
+            syllables: An iterable of valid single pinyin, e.g. syllables() of the pinyin table.
+        """
+        syllables = set(syllables)
+        # 'lue'和'nue'与'lve'和'nve'同样可以输入
+        syllables.update(alias for alias in ('lue', 'nue') if normalize_pinyin(alias) in syllables)
+        # 每个结点为dict，key->下一个字母，key''表示到此为一个完整的拼音
+        self.trie = dict()
+        for syllable in syllables:
+            node = self.trie
+            for letter in syllable:
+                node = node.setdefault(letter, dict())
+            node[''] = None
+
+    def lattice(self, text, partial=False):
+        """
+        Build the lattice of all the ways to split continuous pinyin.
+
+        Args:
+            text: A string of continuous pinyin.
+            partial: Also split into prefixes of single pinyin, for abbreviated pinyin like 'bjing'.
+
+        Returns:
+            letters: A string, text in lower case without separators.
+            edges: A list, edges[start] is a list of the stops of pinyin letters[start:stop] that are followed by
+                a complete split of letters[stop:], longer pinyin first. Empty edges[0] means text can not be split.
+        """
+        text = text.strip().lower().replace('ü', 'v').replace('u:', 'v')
+        letters = []
+        # 分隔符之后必须开始一个新的拼音
+        boundaries = set()
+        for letter in text:
+            if letter in PINYIN_SEPARATORS:
+                boundaries.add(len(letters))
+            else:
+                letters.append(letter)
+        letters = ''.join(letters)
+        # 从后向前，只保留之后能被完整切分的拼音
+        edges = [[] for _ in range(len(letters) + 1)]
+        splittable = [False] * len(letters) + [True]
+        for start in range(len(letters) - 1, -1, -1):
+            node = self.trie
+            for stop in range(start + 1, len(letters) + 1):
+                node = node.get(letters[stop - 1])
+                if node is None:
+                    break
+                if ('' in node or partial) and splittable[stop]:
+                    edges[start].append(stop)
+                if stop in boundaries:
+                    break
+            edges[start].reverse()
+            splittable[start] = bool(edges[start])
+        return letters, edges
+
+    def splits(self, text, max_splits=MAX_SPLITS, partial=False):
+        """
+        Generate the ways to split continuous pinyin, longer pinyin first, so the first split is the greedy one.
+        Consecutive splits share as many leading pinyin as possible.
+
+        Args:
+            text: A string of continuous pinyin.
+            max_splits: Generate at most max_splits splits.
+            partial: Also split into prefixes of single pinyin, see lattice.
+
+        Yields:
+            Lists of single pinyin. An empty text yields an empty list, and a text that can not be split yields
+            nothing.
+        """
+        letters, edges = self.lattice(text, partial)
+        if not letters:
+            yield []
+            return
+        split = []
+        # 深度优先遍历，栈中为各层尚未尝试的边
+        stack = [iter(edges[0])]
+        starts = [0]
+        count = 0
+        while stack:
+            stop = next(stack[-1], None)
+            if stop is None:
+                stack.pop()
+                starts.pop()
+                if split:
+                    split.pop()
+                continue
+            if len(split) == len(stack):
+                split.pop()
+            split.append(letters[starts[-1]:stop])
+            if stop == len(letters):
+                yield list(split)
+                count += 1
+                if count >= max_splits:
+                    return
+                continue
+            stack.append(iter(edges[stop]))
+            starts.append(stop)
+
+
+def prune_column(column, probability_index, beam_width=None, beam_threshold=None):
+    """
+    Beam pruning of one column of the dynamic programming table.
+
+    Args:
+        column: A list of dynamic programming nodes ending at the same stop index.
+        probability_index: Index of log(sentence probability) in a node.
+        beam_width: Keep at most beam_width nodes of the highest sentence probability, None for no limit.
+        beam_threshold: Drop nodes whose log(sentence probability) is lower than the best by more than
+            beam_threshold, None for no limit.
+
+    Returns:
+        The kept nodes in their original order.
+    """
+    if beam_threshold is not None and column:
+        best_probability = max(node[probability_index] for node in column)
+        column = [node for node in column if node[probability_index] >= best_probability - beam_threshold]
+    if beam_width is not None and len(column) > beam_width:
+        # 稳定排序，概率相同时保留靠前的节点
+        kept_indexes = sorted(range(len(column)), key=lambda index: column[index][probability_index],
+                              reverse=True)[:beam_width]
+        column = [column[index] for index in sorted(kept_indexes)]
+    return column
+
+
+def write_sections(table_file, sections):
+    """
+    Write named arrays to table_file in native byte order.
+    A header indexes every section, and every section is 8-byte aligned.
+
+    Args:
+        table_file: A file opened in binary write mode.
+        sections: A list of (name, array.array).
+    """
+    position = struct.calcsize(HEADER_FORMAT) + \
+        len(sections) * struct.calcsize(SECTION_FORMAT)
+    section_offsets = []
+    for name, data in sections:
+        position += -position % 8
+        section_offsets.append(position)
+        position += len(data) * data.itemsize
+    table_file.write(struct.pack(HEADER_FORMAT, TABLE_MAGIC, len(sections)))
+    for (name, data), offset in zip(sections, section_offsets):
+        table_file.write(struct.pack(SECTION_FORMAT, name.encode(
+            'ascii'), data.typecode.encode('ascii'), offset, len(data)))
+    for (name, data), offset in zip(sections, section_offsets):
+        table_file.write(b'\0' * (offset - table_file.tell()))
+        data.tofile(table_file)
+
+
+def build_strings(strings):
+    """
+    Build a string pool.
+
+    Args:
+        strings: A set of strings without '\n'.
+
+    Returns:
+        A list of sections (strings, string_offsets), and a dict, key->string, value->string id.
+        String ids follow the sorted order of strings, so that the pool can be binary searched.
+    """
+    strings = sorted(strings)
+    string_offsets = array.array('I', [0])
+    for string in strings:
+        string_offsets.append(
+            string_offsets[-1] + len(string.encode('utf-8')) + 1)
+    string_pool = array.array('B', '\n'.join(strings).encode('utf-8'))
+    string_ids = {string: string_id for string_id,
+                  string in enumerate(strings)}
+    return [("strings", string_pool), ("string_offsets", string_offsets)], string_ids
+
+
+def prune_bigrams(bigrams, unigram_probabilities, backoff_penalty, top_k=None, prune_threshold=None):
+    """
+    Prune bigrams to shrink the table.
+    A bigram is dropped if it changes the score of the decoder little: when id2 does not follow id1 in the table,
+    the decoder scores log(probability of id2) - backoff_penalty instead of log(probability of id1-id2 /
+    probability of id1). The change weighted by probability of id1-id2 approximates the relative entropy
+    between the models with and without the bigram.
+
+    Args:
+        bigrams: An iterable of (id1, id2, log(probability)), sorted by id1. Ids are words of word2
+            or (pinyin, char) entries of char2.
+        unigram_probabilities: log(probability) of every id, indexed by id.
+        backoff_penalty: Penalty of a missing bigram in the decoder the table is pruned for,
+            BACKOFF_PENALTY of the convert_pinyin of the model.
+        top_k: Keep at most top_k most probable successors of every id, None to keep all.
+        prune_threshold: Drop bigrams whose weighted change is below prune_threshold, None to keep all.
+
+    Yields:
+        The kept bigrams, sorted by id1 and id2.
+    """
+    for id1, successors in itertools.groupby(bigrams, key=operator.itemgetter(0)):
+        successors = list(successors)
+        if prune_threshold is not None:
+            successors = [(id1, id2, probability) for _, id2, probability in successors
+                          if 10 ** probability * abs(probability - unigram_probabilities[id1]
+                                                     - unigram_probabilities[id2] + backoff_penalty)
+                          >= prune_threshold]
+        if top_k is not None and len(successors) > top_k:
+            successors = sorted(heapq.nlargest(top_k, successors, key=operator.itemgetter(2)))
+        yield from successors
+
+
+def quantize(probabilities, bits):
+    """
+    Quantize log(probability) to codes of bits bits.
+    The range of values is split into 2 ** bits bins of the same width, and every level is the mean of the values in
+    its bin, so the error is at most the width of a bin. Values are kept exactly if there are no more distinct values
+    than levels.
+
+    Args:
+        probabilities: A sequence of log(probability).
+        bits: 8 or 16.
+
+    Returns:
+        An array.array of the codes, and an array.array('f') of the levels indexed by codes.
+    """
+    level_count = 1 << bits
+    value_counts = sorted(collections.Counter(probabilities).items())
+    if len(value_counts) <= level_count:
+        bins = [[(value, count)] for value, count in value_counts]
+    else:
+        minimum, maximum = value_counts[0][0], value_counts[-1][0]
+        bins = collections.defaultdict(list)
+        for value, count in value_counts:
+            bins[min(int((value - minimum) / (maximum - minimum) * level_count), level_count - 1)].append(
+                (value, count))
+        # 跳过空的区间
+        bins = [bins[index] for index in sorted(bins)]
+    levels = array.array('f')
+    value_codes = dict()
+    for value_count_list in bins:
+        for value, _ in value_count_list:
+            value_codes[value] = len(levels)
+        levels.append(sum(value * count for value, count in value_count_list) /
+                      sum(count for _, count in value_count_list))
+    codes = array.array(QUANTIZE_TYPECODES[bits], (value_codes[value] for value in probabilities))
+    return codes, levels
+
+
+def build_initials(pinyin_entries, top_k=INITIALS_TOP_K):
+    """
+    Build an index from the initials of pinyin to its most probable entries,
+    e.g. 'bj' -> the entries of 'bei jing', 'bu jiu', ... Every single pinyin contributes its first letter,
+    so the initials of a pinyin have as many letters as it has single pinyin.
+
+    Args:
+        pinyin_entries: An iterable of (pinyin, entry index, log(probability)).
+        top_k: Keep at most top_k most probable entries of every initials.
+
+    Returns:
+        A list of sections:
+            initials, initial_offsets: All initials, sorted and joined by '\n'.
+            initial_entry_offsets, initial_entries: The entries of every initials are in
+                initial_entries[initial_entry_offsets[i]:initial_entry_offsets[i + 1]], more probable first.
+    """
+    initials_entries = collections.defaultdict(list)
+    for pinyin, entry, probability in pinyin_entries:
+        syllables = pinyin.split(' ')
+        if len(syllables) > MAX_INITIALS_LENGTH:
+            continue
+        # 每个简拼只保留最可能的top_k个，堆中为(概率, -entry)，概率相同时保留靠前的entry
+        heap = initials_entries[''.join(syllable[0] for syllable in syllables)]
+        if len(heap) < top_k:
+            heapq.heappush(heap, (probability, -entry))
+        elif (probability, -entry) > heap[0]:
+            heapq.heapreplace(heap, (probability, -entry))
+    (_, initials), (_, initial_offsets) = build_strings(initials_entries.keys())[0]
+    initial_entry_offsets = array.array('I', [0])
+    initial_entries = array.array('I')
+    for key in sorted(initials_entries):
+        initial_entries.extend(-negative_entry for _, negative_entry in sorted(initials_entries[key], reverse=True))
+        initial_entry_offsets.append(len(initial_entries))
+    return [
+        ("initials", initials),
+        ("initial_offsets", initial_offsets),
+        ("initial_entry_offsets", initial_entry_offsets),
+        ("initial_entries", initial_entries),
+    ]
@@ -1,7 +1,14 @@
-import json
+import argparse
+import array
 import math
 import os
 import sqlite3
+import sys
+
+# 共用的table_format.py在上一级的src文件夹中
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir))
+
+from table_format import INITIALS_TOP_K, build_initials, build_strings, write_sections
 
 
 def build_table(database_path):
@@ -16,22 +23,30 @@ def build_table(database_path):
         pinyin-word table: A dict, key->pinyin, value->(word, log(probability)).
     """
     pinyin_word_table = dict()
-    pinyin_word_count = 0
     try:
         connection = sqlite3.connect(database_path)
         cursor = connection.cursor()
         cursor.execute("""
-            select pinyin, word, count
+            select sum(count)
             from PinyinWord
             """)
-        data_list = cursor.fetchall()
-        for (pinyin, word, count) in data_list:
-            pinyin_word_count += count
-            if pinyin in pinyin_word_table:
-                if count > pinyin_word_table[pinyin][1]:
-                    pinyin_word_table[pinyin] = (word, count)
-            else:
-                pinyin_word_table[pinyin] = (word, count)
+        pinyin_word_count = cursor.fetchone()[0]
+        # 由sqlite取每个pinyin出现次数最多的词，次数相同时按rowid取最先插入的词，与逐行比较count >的旧规则一致
+        cursor.execute("""
+            select pinyin, word, count
+            from (
+                select pinyin, word, count,
+                    row_number() over (partition by pinyin order by count desc, rowid) as rank
+                from PinyinWord
+            )
+            where rank = 1
+            """)
+        while True:
+            data_list = cursor.fetchmany()
+            if not data_list:
+                break
+            for (pinyin, word, count) in data_list:
+                pinyin_word_table[pinyin] = (word, math.log10(count / pinyin_word_count))
     finally:
         cursor.close()
         connection.close()
@@ -43,35 +58,62 @@ def build_table(database_path):
     for key, value in pinyin_character_table.items():
         if not key in pinyin_word_table:
             # Reduce an order of magnitude -> 0.1
-            pinyin_word_table[key] = (value, 0.1)
+            pinyin_word_table[key] = (value, math.log10(0.1 / pinyin_word_count))
             print("Miss: " + key + " Set to: " + value)
-    # Change count to log(probability)
-    for pinyin, (word, count) in pinyin_word_table.items():
-        pinyin_word_table[pinyin] = (
-            word, math.log10(count / pinyin_word_count))
 
     return pinyin_word_table
 
 
-def save_table(pinyin_word_table, pinyin_word_table_path):
+def save_table(pinyin_word_table, table_path, initials_top_k=INITIALS_TOP_K):
     """
-    Save pinyin_word_table to pinyin_word_table_path.
+    Save pinyin-word table to table_path in a compact binary format.
+        strings, string_offsets: All pinyin and words, sorted and joined by '\n'.
+        pinyin_ids: String id of every pinyin, in sorted order.
+        entry_words, entry_probabilities: String id and float32 log(probability)
+            of the most frequent word of every pinyin.
+        initials, initial_offsets, initial_entry_offsets, initial_entries: Index of abbreviated pinyin,
+            see build_initials. The entry of a pinyin is its index in pinyin_ids.
 
     Args:
         pinyin_word_table: A dict, key->pinyin, value->(word, log(probability)).
-        pinyin_word_table_path: Path to the destination pinyin-word table json file.
+        table_path: Path to the destination binary table file.
+        initials_top_k: Index at most initials_top_k entries of every initials, 0 for no index.
     """
-    with open(pinyin_word_table_path, 'w') as f:
-        json.dump(pinyin_word_table, f)
+    strings = set(pinyin_word_table)
+    strings.update(word for word, _ in pinyin_word_table.values())
+    sections, string_ids = build_strings(strings)
+    pinyin_ids = array.array('I')
+    entry_words = array.array('I')
+    entry_probabilities = array.array('f')
+    for pinyin in sorted(pinyin_word_table):
+        word, probability = pinyin_word_table[pinyin]
+        pinyin_ids.append(string_ids[pinyin])
+        entry_words.append(string_ids[word])
+        entry_probabilities.append(probability)
+    if initials_top_k > 0:
+        sections.extend(build_initials(
+            ((pinyin, entry, entry_probabilities[entry]) for entry, pinyin in enumerate(sorted(pinyin_word_table))),
+            initials_top_k))
+    sections.extend([
+        ("pinyin_ids", pinyin_ids),
+        ("entry_words", entry_words),
+        ("entry_probabilities", entry_probabilities),
+    ])
+    with open(table_path, 'wb') as f:
+        write_sections(f, sections)
 
 
 """
 Build and save pinyin-word table.
 """
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--initials-top-k", type=int, default=INITIALS_TOP_K,
+                        help="index this many most probable words of every abbreviated pinyin like bj, 0 for no index")
+    args = parser.parse_args()
     database_path = os.path.join(
         os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "pinyin_word.db")
     pinyin_word_table_path = os.path.join(
-        os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "word1_pinyin_word_table.json")
+        os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "word1_table.bin")
     pinyin_word_table = build_table(database_path)
-    save_table(pinyin_word_table, pinyin_word_table_path)
+    save_table(pinyin_word_table, pinyin_word_table_path, args.initials_top_k)
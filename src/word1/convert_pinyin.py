@@ -1,28 +1,477 @@
-import copy
-import json
+import bisect
+import functools
+import heapq
+import itertools
+import os
+import sys
+import time
 
+# 共用的table_format.py在上一级的src文件夹中
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir))
 
-def load_table(pinyin_word_table_path):
+from table_format import (MAX_INITIALS_LENGTH, InitialsIndex, InvalidPinyinError, PinyinSplitter, StringPool,
+                          map_sections, normalize_pinyin)
+
+# 缓存的拼音前缀数
+PREFIX_CACHE_SIZE = 65536
+# 缓存的简拼片段序列数
+ABBREVIATION_CACHE_SIZE = 16384
+
+
+class PinyinWordTable(object):
+    """
+    pinyin-word table queried in place.
+    Behaves like a read-only dict, key->pinyin, value->(word, log(probability)).
+    """
+
+    def __init__(self, string_pool, pinyin_ids, entry_words, entry_probabilities):
+        """
+        Args:
+            string_pool: A StringPool.
+            pinyin_ids: Sorted string ids of pinyin.
+            entry_words: String id of the most frequent word of every pinyin.
+            entry_probabilities: log(probability) of entry_words.
+        """
+        self.string_pool = string_pool
+        self.pinyin_ids = pinyin_ids
+        self.entry_words = entry_words
+        self.entry_probabilities = entry_probabilities
+        # 拼音前缀的查找结果被各句共用
+        self.prefix_range = functools.lru_cache(maxsize=PREFIX_CACHE_SIZE)(self._prefix_range)
+        # 简拼索引，由load_table设置，旧的词库文件中没有
+        self.initials = None
+        self.abbreviated_entries = functools.lru_cache(maxsize=ABBREVIATION_CACHE_SIZE)(self._abbreviated_entries)
+
+    def syllables(self):
+        """
+        Get all the single pinyin in the table.
+        """
+        return [pinyin for pinyin in map(self.string_pool.decode, self.pinyin_ids) if ' ' not in pinyin]
+
+    def find(self, pinyin):
+        """
+        Find the index of pinyin in pinyin_ids, -1 if not found.
+        """
+        pinyin_id = self.string_pool.find(pinyin)
+        if pinyin_id < 0:
+            return -1
+        index = bisect.bisect_left(self.pinyin_ids, pinyin_id)
+        if index < len(self.pinyin_ids) and self.pinyin_ids[index] == pinyin_id:
+            return index
+        return -1
+
+    def __len__(self):
+        return len(self.pinyin_ids)
+
+    def __contains__(self, pinyin):
+        return self.find(pinyin) >= 0
+
+    def __getitem__(self, pinyin):
+        index = self.find(pinyin)
+        if index < 0:
+            raise KeyError(pinyin)
+        return self.word_at(index)
+
+    def word_at(self, index):
+        """
+        Get (word, log(probability)) of the pinyin at index of pinyin_ids.
+        """
+        return (self.string_pool.decode(self.entry_words[index]), self.entry_probabilities[index])
+
+    def _abbreviated_entries(self, pieces):
+        """
+        Get words of abbreviated pinyin, whose every piece is a prefix of a single pinyin, e.g. ('b', 'jing').
+        The word of the pinyin equal to the pieces is found in the table, and the others in the initials index.
+
+        Args:
+            pieces: A tuple of prefixes of single pinyin.
+
+        Returns:
+            A list of (word id, log(probability)) of different words.
+        """
+        words = dict()
+        index = self.find(' '.join(pieces))
+        if index >= 0:
+            words[self.entry_words[index]] = self.entry_probabilities[index]
+        if self.initials is not None and len(pieces) <= MAX_INITIALS_LENGTH:
+            # word1每个拼音只有一个词，entry即拼音的下标
+            for index in self.initials.entries(''.join(piece[0] for piece in pieces)):
+                syllables = self.string_pool.decode(self.pinyin_ids[index]).split(' ')
+                if all(map(str.startswith, syllables, pieces)) and self.entry_words[index] not in words:
+                    words[self.entry_words[index]] = self.entry_probabilities[index]
+        return list(words.items())
+
+    def _prefix_range(self, prefix):
+        """
+        Find the pinyin beginning with prefix.
+        Strings are sorted, so pinyin equal to prefix or beginning with 'prefix ' forms a contiguous range
+        [prefix, prefix + '!') of the string pool, which lies inside the range of prefix without its last syllable.
+
+        Args:
+            prefix: Pinyin in utf-8 bytes, separated by space.
+
+        Returns:
+            low, high: Range of the string pool, empty if no pinyin begins with prefix.
+            index: Index of prefix in pinyin_ids, -1 if prefix itself is not in the table.
+        """
+        string_pool = self.string_pool
+        separator = prefix.rfind(b' ')
+        if separator < 0:
+            low, high = 0, len(string_pool)
+        else:
+            low, high, _ = self.prefix_range(prefix[:separator])
+        low = bisect.bisect_left(string_pool, prefix, low, high)
+        high = bisect.bisect_left(string_pool, prefix + b'!', low, high)
+        if low < high and string_pool[low] == prefix:
+            index = bisect.bisect_left(self.pinyin_ids, low)
+            if index < len(self.pinyin_ids) and self.pinyin_ids[index] == low:
+                return low, high, index
+        return low, high, -1
+
+
+def load_table(table_path):
     """
-    Load pinyin-word table from pinyin_word_table_path.
+    Load pinyin-word table from a binary table file written by build_table.save_table.
+    The file is memory-mapped and queried in place, no Python dict is built.
 
     Args:
-        pinyin_word_table_path: Path to the source pinyin-word table json file.
+        table_path: Path to the source binary table file.
 
     Returns:
-        pinyin-word table, a dict, key->pinyin, value->(word, log(probability)).
+        pinyin-word table, a PinyinWordTable, key->pinyin, value->(word, log(probability)).
     """
-    with open(pinyin_word_table_path, 'r') as f:
-        return json.load(f)
+    sections = map_sections(table_path)
+    string_pool = StringPool(sections['strings'], sections['string_offsets'])
+    pinyin_word_table = PinyinWordTable(string_pool, sections['pinyin_ids'],
+                                        sections['entry_words'], sections['entry_probabilities'])
+    if 'initials' in sections:
+        pinyin_word_table.initials = InitialsIndex(StringPool(sections['initials'], sections['initial_offsets']),
+                                                   sections['initial_entry_offsets'], sections['initial_entries'])
+    return pinyin_word_table
 
 
-def convert_pinyin(pinyin, pinyin_word_table):
+class ConvertStats(object):
+    """
+    Counters and timers of ConvertSession, to size caches from real input.
+    A session given a ConvertStats counts once per pinyin, after timing it, so the timers do not include
+    the counting. A session without one only checks `stats is not None` a few times per pinyin.
+
+    Counters:
+        sentences: Sentences backtracked by sentence().
+        pushes, pops: Pinyin appended and deleted, fewer than the converted pinyin if sentences share prefixes.
+        restores: Columns restored by push_state(), e.g. from the cache of an Engine.
+        prefix_lookups: Pinyin prefixes looked up in the pinyin-word table.
+        lattice_nodes: Words ending at a pinyin.
+        max_column_nodes: Most words ending at a pinyin.
+    Phases, in seconds:
+        lattice: Looking up the words ending at a pinyin and scoring them, done in one pass in word1.
+        backtrack: Backtracking and joining the best sentence.
+    """
+
+    COUNTERS = ("sentences", "pushes", "pops", "restores", "prefix_lookups", "lattice_nodes", "max_column_nodes")
+    PHASES = ("lattice", "backtrack")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Set all counters and timers to 0.
+        """
+        for counter in self.COUNTERS:
+            setattr(self, counter, 0)
+        self.seconds = dict.fromkeys(self.PHASES, 0.0)
+
+    def as_dict(self):
+        """
+        Returns:
+            A dict of the counters, with the seconds of the phases in a dict under "seconds".
+        """
+        stats = {counter: getattr(self, counter) for counter in self.COUNTERS}
+        stats["seconds"] = dict(self.seconds)
+        return stats
+
+    def merge(self, stats):
+        """
+        Add the counters and timers of another ConvertStats or its as_dict(), e.g. from a worker process.
+        """
+        if isinstance(stats, ConvertStats):
+            stats = stats.as_dict()
+        for counter in self.COUNTERS:
+            if counter.startswith("max_"):
+                setattr(self, counter, max(getattr(self, counter), stats[counter]))
+            else:
+                setattr(self, counter, getattr(self, counter) + stats[counter])
+        for phase in self.PHASES:
+            self.seconds[phase] += stats["seconds"][phase]
+
+    def report(self):
+        """
+        Returns:
+            A few lines summarizing the counters and timers.
+        """
+        total_seconds = sum(self.seconds.values())
+        return '\n'.join((
+            "sentences: %d, pinyin pushed: %d, popped: %d, restored: %d, prefix lookups: %d" % (
+                self.sentences, self.pushes, self.pops, self.restores, self.prefix_lookups),
+            "lattice nodes: %d (%.1f per pinyin), most at a pinyin: %d" % (
+                self.lattice_nodes, self.lattice_nodes / self.pushes if self.pushes else 0.0, self.max_column_nodes),
+            "time: " + ", ".join("%s %.4fs (%.1f%%)" % (
+                phase, self.seconds[phase], self.seconds[phase] / total_seconds * 100 if total_seconds else 0.0)
+                for phase in self.PHASES),
+        ))
+
+
+class ConvertSession(object):
+    """
+    Incremental convert_pinyin, whose dynamic programming table grows and shrinks one pinyin at a time,
+    e.g. as an input method receives and deletes syllables.
+    Appending or deleting a pinyin costs the same no matter how many pinyin are before it.
+    """
+
+    def __init__(self, pinyin_word_table, stats=None):
+        """
+        Args:
+            pinyin_word_table: pinyin-word table, a PinyinWordTable.
+            stats: A ConvertStats to count the work of the session in, None not to count.
+        """
+        self.pinyin_word_table = pinyin_word_table
+        self.stats = stats
+        self.pinyin_list = []
+        # dynamic_programming_table: 记录pinyin_list[:stop_index+1]的最优解
+        # 第一维为stop_index，第二维为(整句probability, 尾词起点, 尾词拼音index)，由尾词起点回溯整句
+        self.dynamic_programming_table = []
+        # candidates[stop_index]:以stop_index结尾的所有候选词的(起点，拼音index，词probability)，供sentences()使用
+        self.candidates = []
+        # prefixes[stop_index]:仍有拼音以之开头、可被下一个拼音延伸的(起点，前缀)，按起点排序
+        self.prefixes = []
+
+    def __len__(self):
+        return len(self.pinyin_list)
+
+    def push(self, pinyin_single):
+        """
+        Append a pinyin and compute its column of the dynamic programming table.
+        Raises InvalidPinyinError and leaves the session unchanged if no word ends with pinyin_single.
+
+        Args:
+            pinyin_single: A string, a single pinyin.
+        """
+        pinyin_single = normalize_pinyin(pinyin_single)
+        syllable = pinyin_single.encode('utf-8')
+        stop_index = len(self.pinyin_list)
+        stats = self.stats
+        if stats is not None:
+            start_time = time.perf_counter()
+        # 延伸上一个拼音处仍然存在的前缀，并从当前拼音开始一个新前缀，如同在音节trie上同时向下走
+        prefixes = []
+        candidates = []
+        max_now = (float("-inf"), -1, -1)
+        for start_index, prefix in itertools.chain(self.prefixes[-1] if self.prefixes else (), ((stop_index, b''),)):
+            prefix = prefix + b' ' + syllable if prefix else syllable
+            low, high, pinyin_index = self.pinyin_word_table.prefix_range(prefix)
+            if low == high:
+                continue
+            prefixes.append((start_index, prefix))
+            if pinyin_index < 0:
+                continue
+            word_probability = self.pinyin_word_table.entry_probabilities[pinyin_index]
+            candidates.append((start_index, pinyin_index, word_probability))
+            if start_index == 0:
+                probability = word_probability
+            else:
+                # log(probability), so * => +
+                probability = word_probability + self.dynamic_programming_table[start_index - 1][0]
+            if probability > max_now[0]:
+                max_now = (probability, start_index, pinyin_index)
+        if max_now[2] < 0:
+            raise InvalidPinyinError("No word ends with " + pinyin_single)
+        if stats is not None:
+            stats.seconds["lattice"] += time.perf_counter() - start_time
+            stats.pushes += 1
+            stats.prefix_lookups += (len(self.prefixes[-1]) if self.prefixes else 0) + 1
+            stats.lattice_nodes += len(candidates)
+            stats.max_column_nodes = max(stats.max_column_nodes, len(candidates))
+        self.pinyin_list.append(pinyin_single)
+        self.dynamic_programming_table.append(max_now)
+        self.candidates.append(candidates)
+        self.prefixes.append(prefixes)
+
+    def pop(self):
+        """
+        Delete the last pinyin.
+
+        Returns:
+            The deleted pinyin.
+        """
+        self.dynamic_programming_table.pop()
+        self.candidates.pop()
+        self.prefixes.pop()
+        if self.stats is not None:
+            self.stats.pops += 1
+        return self.pinyin_list.pop()
+
+    def column_state(self):
+        """
+        Get what push() added for the last pinyin, to be restored by push_state() in a session holding the same
+        previous pinyin.
+        """
+        return self.dynamic_programming_table[-1], self.candidates[-1], self.prefixes[-1]
+
+    def push_state(self, pinyin_single, state):
+        """
+        Append a pinyin with the column_state() saved by a session holding the same pinyin before it,
+        without computing the column again.
+        """
+        max_now, candidates, prefixes = state
+        if self.stats is not None:
+            self.stats.restores += 1
+        self.pinyin_list.append(normalize_pinyin(pinyin_single))
+        self.dynamic_programming_table.append(max_now)
+        self.candidates.append(candidates)
+        self.prefixes.append(prefixes)
+
+    def update(self, pinyin_list):
+        """
+        Make the session hold pinyin_list, the columns of the prefix shared with the current pinyin are kept.
+
+        Args:
+            pinyin_list: A list of single pinyin.
+        """
+        pinyin_list = [normalize_pinyin(pinyin_single) for pinyin_single in pinyin_list]
+        common_length = 0
+        for pinyin_current, pinyin_new in zip(self.pinyin_list, pinyin_list):
+            if pinyin_current != pinyin_new:
+                break
+            common_length += 1
+        while len(self.pinyin_list) > common_length:
+            self.pop()
+        for pinyin_single in pinyin_list[common_length:]:
+            self.push(pinyin_single)
+
+    def sentence(self):
+        """
+        Get the best sentence of the current pinyin, an empty string if there is no pinyin.
+        """
+        stats = self.stats
+        if stats is not None:
+            start_time = time.perf_counter()
+        words = []
+        stop_index = len(self.dynamic_programming_table) - 1
+        while stop_index >= 0:
+            _, start_index, pinyin_index = self.dynamic_programming_table[stop_index]
+            words.append(self.pinyin_word_table.word_at(pinyin_index)[0])
+            stop_index = start_index - 1
+        sentence = ''.join(reversed(words))
+        if stats is not None:
+            stats.seconds["backtrack"] += time.perf_counter() - start_time
+            stats.sentences += 1
+        return sentence
+
+    def probability(self):
+        """
+        Get log(probability) of the best sentence of the current pinyin, 0 if there is no pinyin.
+        """
+        if not self.dynamic_programming_table:
+            return 0.0
+        return self.dynamic_programming_table[-1][0]
+
+    def update_continuous(self, text, splitter):
+        """
+        Replace the pinyin with the most probable split of continuous pinyin, see PinyinSplitter.splits.
+        Splits sharing leading pinyin share their columns, like update().
+
+        Args:
+            text: A string of continuous pinyin, e.g. 'woaibeijing'.
+            splitter: A PinyinSplitter of the pinyin table.
+        """
+        max_split = None
+        max_probability = float("-inf")
+        for split in splitter.splits(text):
+            try:
+                self.update(split)
+            except InvalidPinyinError:
+                continue
+            probability = self.probability()
+            if probability > max_probability:
+                max_split = split
+                max_probability = probability
+        if max_split is None:
+            raise InvalidPinyinError("Invalid pinyin: " + text)
+        self.update(max_split)
+
+    def sentences(self, n):
+        """
+        Get the n best sentences of the current pinyin.
+        Segmentations are searched backwards from the last pinyin with A*, where the probabilities of the dynamic
+        programming are the exact estimates of the unexplored front parts, so sentences come out best first and
+        the search only visits about n segmentations instead of decoding n times.
+
+        Args:
+            n: Number of sentences.
+
+        Returns:
+            A list of at most n distinct (sentence, log(probability)), best first.
+        """
+        if not self.dynamic_programming_table:
+            return []
+        tie_breaker = itertools.count()
+        # heap: (-估计的总句probability，序号，已确定的后句之前的stop_index，后句probability，后句)
+        heap = [(-self.dynamic_programming_table[-1][0], next(tie_breaker), len(self.dynamic_programming_table) - 1,
+                 0.0, "")]
+        # 在同一位置之前接相同的后句时，只有最先出堆的能得到新的句子
+        visited = set()
+        sentences = []
+        while heap and len(sentences) < n:
+            estimate, _, stop_index, suffix_probability, suffix = heapq.heappop(heap)
+            if (stop_index, suffix) in visited:
+                continue
+            visited.add((stop_index, suffix))
+            if stop_index < 0:
+                sentences.append((suffix, -estimate))
+                continue
+            for start_index, pinyin_index, word_probability in self.candidates[stop_index]:
+                # log(probability), so * => +
+                suffix_probability_front = word_probability + suffix_probability
+                sentence_probability_front = (
+                    self.dynamic_programming_table[start_index - 1][0] if start_index > 0 else 0.0)
+                heapq.heappush(heap, (-(sentence_probability_front + suffix_probability_front), next(tie_breaker),
+                                      start_index - 1, suffix_probability_front,
+                                      self.pinyin_word_table.word_at(pinyin_index)[0] + suffix))
+        return sentences
+
+    def words(self, n):
+        """
+        Get candidate words beginning at the first pinyin, longer words first.
+
+        Args:
+            n: Number of words.
+
+        Returns:
+            A list of at most n (word, log(probability), number of pinyin of the word).
+        """
+        candidates = []
+        prefix = b''
+        for length, pinyin_single in enumerate(self.pinyin_list, 1):
+            syllable = pinyin_single.encode('utf-8')
+            prefix = prefix + b' ' + syllable if prefix else syllable
+            low, high, pinyin_index = self.pinyin_word_table.prefix_range(prefix)
+            if low == high:
+                break
+            if pinyin_index >= 0:
+                candidates.append((length, pinyin_index))
+        return [self.pinyin_word_table.word_at(pinyin_index) + (length,)
+                for length, pinyin_index in sorted(candidates, reverse=True)[:n]]
+
+
+def convert_pinyin(pinyin, pinyin_word_table, stats=None):
     """
     Convert pinyin to Chinese sentence.
 
     Args:
         pinyin: A string, a sentence of pinyin separated by space.
-        pinyin_word_table: pinyin-word table, a dict, key->pinyin, value->(word, log(probability)).
+        pinyin_word_table: pinyin-word table, a PinyinWordTable.
+        stats: A ConvertStats to count the work in, None not to count.
 
     Returns:
         A string of Chinese characters converted from pinyin.
@@ -31,33 +480,9 @@ def convert_pinyin(pinyin, pinyin_word_table):
     pinyin_list = pinyin.split(' ')
     if not pinyin_list or pinyin_list == ['']:
         return ""
-    # 'lue' should be 'lve' and 'nue' should be 'nve' in standard Chinese pinyin.
-    pinyin_list = ['lve' if pinyin_single == 'lue'
-                   else 'nve' if pinyin_single == 'nue'
-                   else pinyin_single
-                   for pinyin_single in pinyin_list]
-    dynamic_programming_table = [[] for _ in range(len(pinyin_list))]
-    # dynamic_programming_table: 二维数组，记录pinyin_list[:stop_index+1]的最优解
-    # 第一维为stop_index，第二维为(整句, 整句probability)
-    for stop_index in range(len(pinyin_list)):
-        pinyin_whole = ' '.join(pinyin_list[:stop_index + 1])
-        if pinyin_whole in pinyin_word_table:
-            max_now = pinyin_word_table[pinyin_whole]
-        else:
-            max_now = ["", float("-inf")]
-        for mid_stop_index in range(stop_index):
-            pinyin_back = ' '.join(
-                pinyin_list[mid_stop_index + 1:stop_index + 1])
-            if pinyin_back in pinyin_word_table:
-                word, word_probability = pinyin_word_table[pinyin_back]
-                sentence, sentence_probability = dynamic_programming_table[mid_stop_index]
-                # log(probability), so * => +
-                probability = word_probability + sentence_probability
-                if probability > max_now[1]:
-                    max_now = [sentence + word, probability]
-        assert max_now[0] != ""
-        dynamic_programming_table[stop_index] = max_now
-    return dynamic_programming_table[-1][0]
+    session = ConvertSession(pinyin_word_table, stats)
+    session.update(pinyin_list)
+    return session.sentence()
     # # Greedy stategy.
     # words = []
     # pinyin_start = 0
@@ -79,3 +504,121 @@ def convert_pinyin(pinyin, pinyin_word_table):
     #     pinyin_start = pinyin_stop + 1
     #     pinyin_stop = len(pinyin)
     # return ''.join(words)
+
+
+def convert_continuous(text, pinyin_word_table, splitter=None, stats=None):
+    """
+    Convert continuous pinyin to Chinese sentence, trying the splits of the pinyin, see PinyinSplitter.
+
+    Args:
+        text: A string of continuous pinyin, e.g. 'woaibeijing', "xi'an" or 'lve'.
+        pinyin_word_table: pinyin-word table, a PinyinWordTable.
+        splitter: A PinyinSplitter, built from pinyin_word_table if None. Building it takes time, so reuse it.
+        stats: A ConvertStats to count the work in, None not to count.
+
+    Returns:
+        A string of Chinese characters converted from the most probable split of the pinyin.
+    """
+    if splitter is None:
+        splitter = PinyinSplitter(pinyin_word_table.syllables())
+    session = ConvertSession(pinyin_word_table, stats)
+    session.update_continuous(text, splitter)
+    return session.sentence()
+
+
+def decode_abbreviated(pieces, pinyin_word_table):
+    """
+    Decode a split of abbreviated pinyin by dynamic programming on the lattice of words matching its pieces.
+
+    Args:
+        pieces: A list of prefixes of single pinyin.
+        pinyin_word_table: pinyin-word table, a PinyinWordTable.
+
+    Returns:
+        The best sentence and its log(probability), None if no words match the pieces.
+    """
+    # 以每个片段结尾的最可能的句子，(log(probability), start index, word id)，与ConvertSession一致
+    dynamic_programming_table = []
+    for stop_index in range(len(pieces)):
+        max_now = (float("-inf"), -1, -1)
+        for start_index in range(max(0, stop_index + 1 - MAX_INITIALS_LENGTH), stop_index + 1):
+            if start_index > 0 and dynamic_programming_table[start_index - 1][2] < 0:
+                continue
+            for word, word_probability in pinyin_word_table.abbreviated_entries(
+                    tuple(pieces[start_index:stop_index + 1])):
+                probability = word_probability
+                if start_index > 0:
+                    # log(probability), so * => +
+                    probability += dynamic_programming_table[start_index - 1][0]
+                if probability > max_now[0]:
+                    max_now = (probability, start_index, word)
+        dynamic_programming_table.append(max_now)
+    if not dynamic_programming_table or dynamic_programming_table[-1][2] < 0:
+        return None
+    words = []
+    stop_index = len(dynamic_programming_table) - 1
+    while stop_index >= 0:
+        _, start_index, word = dynamic_programming_table[stop_index]
+        words.append(pinyin_word_table.string_pool.decode(word))
+        stop_index = start_index - 1
+    return ''.join(reversed(words)), dynamic_programming_table[-1][0]
+
+
+def convert_abbreviated(text, pinyin_word_table, splitter=None):
+    """
+    Convert abbreviated pinyin to Chinese sentence, e.g. 'bj' to '北京' or 'zhongguor' to '中国人'.
+    Every piece of the pinyin may be a prefix of a single pinyin, the words are found by the initials index
+    built by build_table.py, and the most probable split of the pinyin wins.
+
+    Args:
+        text: A string of abbreviated pinyin, continuous or separated by space or "'".
+        pinyin_word_table: pinyin-word table, a PinyinWordTable with initials index.
+        splitter: A PinyinSplitter, built from pinyin_word_table if None. Building it takes time, so reuse it.
+
+    Returns:
+        A string of Chinese characters converted from pinyin.
+    """
+    if pinyin_word_table.initials is None:
+        raise ValueError("Table has no initials index, rebuild it with build_table.py")
+    if splitter is None:
+        splitter = PinyinSplitter(pinyin_word_table.syllables())
+    max_result = None
+    for split in splitter.splits(text, partial=True):
+        result = decode_abbreviated([normalize_pinyin(piece) for piece in split], pinyin_word_table) \
+            if split else ("", 0.0)
+        if result is not None and (max_result is None or result[1] > max_result[1]):
+            max_result = result
+    if max_result is None:
+        raise InvalidPinyinError("Invalid pinyin: " + text)
+    return max_result[0]
+
+
+def convert_batch(pinyin_lines, pinyin_word_table, stats=None):
+    """
+    Convert a batch of pinyin to Chinese sentences.
+    Identical pinyin is converted only once. Distinct pinyin is converted in sorted order by one ConvertSession,
+    so the dynamic programming of a prefix shared by neighbours is done only once.
+
+    Args:
+        pinyin_lines: An iterable of strings, sentences of pinyin separated by space.
+        pinyin_word_table: pinyin-word table, a PinyinWordTable.
+        stats: A ConvertStats to count the work in, None not to count.
+
+    Returns:
+        A list of strings of Chinese characters in the order of pinyin_lines, None for invalid pinyin.
+    """
+    pinyin_lines = list(pinyin_lines)
+    sentences = dict.fromkeys(pinyin_lines)
+    session = ConvertSession(pinyin_word_table, stats)
+    for pinyin_list in sorted(pinyin.split(' ') for pinyin in sentences):
+        pinyin = ' '.join(pinyin_list)
+        if pinyin_list == ['']:
+            sentences[pinyin] = ""
+            continue
+        try:
+            session.update(pinyin_list)
+        except InvalidPinyinError:
+            # 无法转换的句子保持为None，不影响批中的其他句子
+            continue
+        sentences[pinyin] = session.sentence()
+    return [sentences[pinyin] for pinyin in pinyin_lines]
@@ -1,14 +1,28 @@
-import json
+import argparse
+import array
+import collections
+import glob
 import math
 import os
 import sqlite3
+import sys
+
+# 共用的accuracy.py、engines.py和table_format.py在上一级的src文件夹中
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir))
+
+from engines import import_convert_pinyin
+from table_format import (INITIALS_TOP_K, QUANTIZE_TYPECODES, build_initials, build_strings, prune_bigrams, quantize,
+                          write_sections)
+
+# 二元组缺失时解码器给出的惩罚，默认与本模型的convert_pinyin一致
+BACKOFF_PENALTY = import_convert_pinyin("word2").BACKOFF_PENALTY
 
 
 def build_table(pinyin_word_database_path, pinyin_pinyin_word_word_database_path):
     """
     Build pinyin-word table and word-word table using database from database_path.
         pinyin-word table: pinyin -> [[word, log(probability)]].
-        word-word table: str(word1-word2) -> log(probability) with count over a threshold.
+        word-word table: (word1, word2, log(probability)) with count over a threshold.
 
     Args:
         pinyin_word_database_path: Path to pinyin-word sqlite database file.
@@ -16,14 +30,20 @@ def build_table(pinyin_word_database_path, pinyin_pinyin_word_word_database_path
 
     Returns:
         pinyin-word table: A dict, key->pinyin, value->[[word, log(probability)]].
-        word-word table: A dict, key->str(word1-word2), value->log(probability).
+        word-word table: An iterator of (word1, word2, log(probability)) sorted by word1 and word2,
+            streamed from the database by iterate_word_word_table.
     """
     # Build pinyin-word table
     pinyin_word_table = dict()
-    pinyin_word_count = 0
     try:
         connection = sqlite3.connect(pinyin_word_database_path)
         cursor = connection.cursor()
+        # 先求总数，读取时即可换算为log(probability)
+        cursor.execute("""
+            select sum(count)
+            from PinyinWord
+            """)
+        pinyin_word_count = cursor.fetchone()[0]
         cursor.execute("""
             select pinyin, word, count
             from PinyinWord
@@ -34,11 +54,11 @@ def build_table(pinyin_word_database_path, pinyin_pinyin_word_word_database_path
             if not data_list:
                 break
             for (pinyin, word, count) in data_list:
-                pinyin_word_count += count
+                probability = math.log10(count / pinyin_word_count)
                 if pinyin in pinyin_word_table:
-                    pinyin_word_table[pinyin].append([word, count])
+                    pinyin_word_table[pinyin].append((word, probability))
                 else:
-                    pinyin_word_table[pinyin] = [[word, count], ]
+                    pinyin_word_table[pinyin] = [(word, probability), ]
     finally:
         cursor.close()
         connection.close()
@@ -49,73 +69,206 @@ def build_table(pinyin_word_database_path, pinyin_pinyin_word_word_database_path
     for key, value in pinyin_character_table.items():
         if not key in pinyin_word_table:
             # Reduce an order of magnitude -> 0.1
-            pinyin_word_table[key] = [[value, 0.1], ]
+            pinyin_word_table[key] = [(value, math.log10(0.1 / pinyin_word_count)), ]
             print("Miss: " + key + " Set to: " + value)
-    # Change count to log(probability)
-    for pinyin, word_list in pinyin_word_table.items():
-        word_list = [(word, math.log10(count / pinyin_word_count))
-                     for word, count in word_list]
-        pinyin_word_table[pinyin] = word_list
 
     # Build word-word table
-    word_word_table = dict()
-    word_word_count = 0
+    word_word_table = iterate_word_word_table(pinyin_pinyin_word_word_database_path)
+
+    return pinyin_word_table, word_word_table
+
+
+def iterate_word_word_table(pinyin_pinyin_word_word_database_path):
+    """
+    Stream word-word table from the database.
+    Counts of the same words with different pinyin are summed by sqlite over a covering index,
+    so memory does not grow with the number of rows.
+
+    Args:
+        pinyin_pinyin_word_word_database_path: Path to pinyin-pinyin-word-word sqlite database file.
+
+    Yields:
+        (word1, word2, log(probability)) with count over a threshold, sorted by word1 and word2.
+    """
     try:
         connection = sqlite3.connect(pinyin_pinyin_word_word_database_path)
         cursor = connection.cursor()
+        # 按(word1, word2)有序的覆盖索引，分组时顺序读取即可，无需排序整张表
+        cursor.execute("""
+            create index if not exists PinyinPinyinWordWordWords
+            on PinyinPinyinWordWord(word1, word2, count)
+            """)
+        connection.commit()
+        cursor.execute("""
+            select sum(count)
+            from PinyinPinyinWordWord
+            """)
+        word_word_count = cursor.fetchone()[0]
+        # Add threshold to avoid wrongly cut words and reduce number of words
+        # 同词不同音，合并计数
         cursor.execute("""
-            select word1, word2, count
+            select word1, word2, sum(count)
             from PinyinPinyinWordWord
+            where count > 1
+            group by word1, word2
+            order by word1, word2
             """)
         while True:
             data_list = cursor.fetchmany()
             if not data_list:
                 break
             for (word1, word2, count) in data_list:
-                word_word_count += count
-                # Add threshold to avoid wrongly cut words and reduce number of words
-                if count > 1:
-                    word_pair = '-'.join((word1, word2))
-                    if word_pair in word_word_table:
-                        # 同词不同音，忽略
-                        word_word_table[word_pair] += count
-                    else:
-                        word_word_table[word_pair] = count
+                yield word1, word2, math.log10(count / word_word_count)
     finally:
         cursor.close()
         connection.close()
-    # Change count to log(probability)
-    for word_word, count in word_word_table.items():
-        word_word_table[word_word] = math.log10(count / word_word_count)
-
-    return pinyin_word_table, word_word_table
 
 
-def save_table(table, table_path):
+def save_table(pinyin_word_table, word_word_table, table_path, top_k=None, prune_threshold=None,
+               quantize_bits=None, initials_top_k=INITIALS_TOP_K, backoff_penalty=BACKOFF_PENALTY):
     """
-    Save table to table_path.
+    Save pinyin-word table and word-word table to table_path in a compact binary format.
+        strings, string_offsets: All pinyin and words, sorted and joined by '\n'.
+        pinyin_ids, pinyin_offsets: String id of every pinyin, in sorted order,
+            and the range of its words in the entry sections.
+        entry_words, entry_probabilities: String id and float32 log(probability) of words.
+        bigram_offsets, bigram_successors, bigram_probabilities: Successors of every word,
+            the sorted string ids of word2 following word1 are in
+            bigram_successors[bigram_offsets[word1 id]:bigram_offsets[word1 id + 1]],
+            with their float32 log(probability).
+        bigram_levels: Only with quantize_bits, bigram_probabilities are 8 or 16-bit codes of
+            the float32 log(probability) in bigram_levels.
+        initials, initial_offsets, initial_entry_offsets, initial_entries: Index of abbreviated pinyin,
+            see build_initials.
 
     Args:
-        table: A table that can be converted to json.
-        table_path: Path to the destination table json file.
+        pinyin_word_table: A dict, key->pinyin, value->[[word, log(probability)]].
+        word_word_table: An iterable of (word1, word2, log(probability)), sorted by word1 and word2.
+        table_path: Path to the destination binary table file.
+        top_k: Keep at most top_k most probable successors of every word, see prune_bigrams.
+        prune_threshold: Drop bigrams changing the decoder little, see prune_bigrams.
+        quantize_bits: Quantize bigram log(probability) to 8 or 16 bits, None to keep float32.
+        initials_top_k: Index at most initials_top_k entries of every initials, 0 for no index.
+        backoff_penalty: Penalty of a missing bigram assumed by prune_threshold, see prune_bigrams.
+    """
+    strings = set(pinyin_word_table)
+    for word_list in pinyin_word_table.values():
+        strings.update(word for word, _ in word_list)
+    sections, string_ids = build_strings(strings)
+    pinyin_ids = array.array('I')
+    pinyin_offsets = array.array('I', [0])
+    entry_words = array.array('I')
+    entry_probabilities = array.array('f')
+    # 词语在各读音下的总概率，用于剪枝
+    word_counts = collections.defaultdict(float)
+    for pinyin in sorted(pinyin_word_table):
+        pinyin_ids.append(string_ids[pinyin])
+        for word, probability in pinyin_word_table[pinyin]:
+            entry_words.append(string_ids[word])
+            entry_probabilities.append(probability)
+            word_counts[string_ids[word]] += 10 ** probability
+        pinyin_offsets.append(len(entry_words))
+    if initials_top_k > 0:
+        sections.extend(build_initials(
+            ((pinyin, entry, entry_probabilities[entry])
+             for index, pinyin in enumerate(sorted(pinyin_word_table))
+             for entry in range(pinyin_offsets[index], pinyin_offsets[index + 1])), initials_top_k))
+    # string id与词语的排序一致，按词语排序的二元组即按id排序，可直接流式写入各数组
+    # 不在pinyin-word表中的词语不会被查询
+    bigrams = ((string_ids[word1], string_ids[word2], probability)
+               for word1, word2, probability in word_word_table
+               if word1 in string_ids and word2 in string_ids)
+    if top_k is not None or prune_threshold is not None:
+        unigram_probabilities = {word_id: math.log10(count) for word_id, count in word_counts.items()}
+        bigrams = prune_bigrams(bigrams, unigram_probabilities, backoff_penalty, top_k, prune_threshold)
+    bigram_offsets = array.array('I', [0] * (len(string_ids) + 1))
+    bigram_successors = array.array('I')
+    bigram_probabilities = array.array('f')
+    for id1, id2, probability in bigrams:
+        bigram_offsets[id1 + 1] += 1
+        bigram_successors.append(id2)
+        bigram_probabilities.append(probability)
+    for id1 in range(1, len(bigram_offsets)):
+        bigram_offsets[id1] += bigram_offsets[id1 - 1]
+    if quantize_bits is not None:
+        bigram_probabilities, bigram_levels = quantize(bigram_probabilities, quantize_bits)
+        sections.append(("bigram_levels", bigram_levels))
+    sections.extend([
+        ("pinyin_ids", pinyin_ids),
+        ("pinyin_offsets", pinyin_offsets),
+        ("entry_words", entry_words),
+        ("entry_probabilities", entry_probabilities),
+        ("bigram_offsets", bigram_offsets),
+        ("bigram_successors", bigram_successors),
+        ("bigram_probabilities", bigram_probabilities),
+    ])
+    with open(table_path, 'wb') as f:
+        write_sections(f, sections)
+
+
+def report_table(table_path):
+    """
+    Print the size of a table and its accuracy on every data/input*.txt against data/output_std*.txt.
     """
-    with open(table_path, 'w') as f:
-        json.dump(table, f)
+    convert_pinyin = import_convert_pinyin("word2")
+    from accuracy import edit_distance
+    pinyin_word_table, word_word_table = convert_pinyin.load_table(table_path)
+    print("Table size:", os.path.getsize(table_path), "bytes,", len(word_word_table), "bigrams")
+    data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data")
+    for input_file_path in sorted(glob.glob(os.path.join(data_path, "input*.txt"))):
+        std_output_file_path = os.path.join(
+            data_path, os.path.basename(input_file_path).replace("input", "output_std", 1))
+        if not os.path.exists(std_output_file_path):
+            continue
+        with open(input_file_path, 'r') as input_file, open(std_output_file_path, 'r') as std_output_file:
+            pinyin_lines = [line.strip().lower() for line in input_file]
+            std_sentences = [line.rstrip('\n') for line in std_output_file]
+        sentences = convert_pinyin.convert_batch(pinyin_lines, pinyin_word_table, word_word_table)
+        accurate_sentence_number = 0
+        total_character_number = 0
+        total_distance = 0
+        for sentence, std_sentence in zip(sentences, std_sentences):
+            # 无法转换的句子记为空
+            sentence = sentence or ""
+            if sentence == std_sentence:
+                accurate_sentence_number += 1
+            # 按编辑距离计算字正确率，漏字或多字不会使之后的字都错位
+            total_distance += edit_distance(sentence, std_sentence)
+            total_character_number += len(std_sentence)
+        print("%s: sentence accuracy %.2f%%, character accuracy %.2f%%" % (
+            os.path.basename(input_file_path), accurate_sentence_number / max(len(std_sentences), 1) * 100,
+            (1 - total_distance / total_character_number) * 100 if total_character_number else 0.0))
 
 
 """
 Build and save pinyin-word table.
 """
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top-k", type=int, default=None,
+                        help="keep at most this many most probable successors of every word")
+    parser.add_argument("--prune-threshold", type=float, default=None,
+                        help="drop bigrams whose probability-weighted change of score is below this, e.g. 1e-7")
+    parser.add_argument("--quantize", type=int, choices=sorted(QUANTIZE_TYPECODES), default=None,
+                        help="quantize bigram log(probability) to 8 or 16 bits")
+    parser.add_argument("--backoff-penalty", type=float, default=BACKOFF_PENALTY,
+                        help="penalty of a missing bigram assumed by --prune-threshold, the decoder's by default")
+    parser.add_argument("--initials-top-k", type=int, default=INITIALS_TOP_K,
+                        help="index this many most probable words of every abbreviated pinyin like bj, 0 for no index")
+    parser.add_argument("--table", default=None,
+                        help="path to the destination table file, data/word2_table.bin by default")
+    parser.add_argument("--report", action="store_true",
+                        help="print the size and the accuracy on data/input*.txt of the table")
+    args = parser.parse_args()
     pinyin_word_database_path = os.path.join(
         os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "pinyin_word.db")
-    pinyin_word_table_path = os.path.join(
-        os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "word2_pinyin_word_table.json")
     pinyin_pinyin_word_word_database_path = os.path.join(
         os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "pinyin_pinyin_word_word.db")
-    word_word_table_path = os.path.join(
-        os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "word2_word_word_table.json")
+    table_path = args.table or os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), os.path.pardir, os.path.pardir, "data", "word2_table.bin")
     pinyin_word_table, word_word_table = build_table(
         pinyin_word_database_path, pinyin_pinyin_word_word_database_path)
-    save_table(pinyin_word_table, pinyin_word_table_path)
-    save_table(word_word_table, word_word_table_path)
+    save_table(pinyin_word_table, word_word_table, table_path, args.top_k, args.prune_threshold, args.quantize,
+               args.initials_top_k, args.backoff_penalty)
+    if args.report:
+        report_table(table_path)
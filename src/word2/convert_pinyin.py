@@ -1,28 +1,679 @@
-import json
+import bisect
+import functools
+import heapq
+import itertools
+import os
+import sys
+import time
+
+# 共用的table_format.py在上一级的src文件夹中
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir))
+
+from table_format import (MAX_INITIALS_LENGTH, InitialsIndex, InvalidPinyinError, PinyinSplitter, QuantizedArray,
+                          StringPool, map_sections, normalize_pinyin, prune_column)
+
+# 缓存的拼音前缀数
+PREFIX_CACHE_SIZE = 65536
+# 缓存后继dict的词数
+SUCCESSOR_CACHE_SIZE = 4096
+# 二元组不在词库中时的惩罚，build_table.py剪枝时也用它
+BACKOFF_PENALTY = 0.5
+# 动态规划节点中总句probability的下标，用于prune_column
+SENTENCE_PROBABILITY_INDEX = 2
+# 缓存的简拼片段序列数
+ABBREVIATION_CACHE_SIZE = 16384
+# 简拼解码时每个位置保留的候选句数
+ABBREVIATED_BEAM_WIDTH = 32
+
+
+class PinyinWordTable(object):
+    """
+    pinyin-word table queried in place.
+    Behaves like a read-only dict, key->pinyin, value->[(word, log(probability))].
+    """
+
+    def __init__(self, string_pool, pinyin_ids, pinyin_offsets, entry_words, entry_probabilities):
+        """
+        Args:
+            string_pool: A StringPool.
+            pinyin_ids: Sorted string ids of pinyin.
+            pinyin_offsets: Range of the entries of every pinyin.
+            entry_words: String ids of words.
+            entry_probabilities: log(probability) of words.
+        """
+        self.string_pool = string_pool
+        self.pinyin_ids = pinyin_ids
+        self.pinyin_offsets = pinyin_offsets
+        self.entry_words = entry_words
+        self.entry_probabilities = entry_probabilities
+        # 拼音前缀的查找结果被各句共用
+        self.prefix_range = functools.lru_cache(maxsize=PREFIX_CACHE_SIZE)(self._prefix_range)
+        # 简拼索引，由load_table设置，旧的词库文件中没有
+        self.initials = None
+        self.abbreviated_entries = functools.lru_cache(maxsize=ABBREVIATION_CACHE_SIZE)(self._abbreviated_entries)
+
+    def syllables(self):
+        """
+        Get all the single pinyin in the table.
+        """
+        return [pinyin for pinyin in map(self.string_pool.decode, self.pinyin_ids) if ' ' not in pinyin]
+
+    def find(self, pinyin):
+        """
+        Find the index of pinyin in pinyin_ids, -1 if not found.
+        """
+        pinyin_id = self.string_pool.find(pinyin)
+        if pinyin_id < 0:
+            return -1
+        index = bisect.bisect_left(self.pinyin_ids, pinyin_id)
+        if index < len(self.pinyin_ids) and self.pinyin_ids[index] == pinyin_id:
+            return index
+        return -1
+
+    def __len__(self):
+        return len(self.pinyin_ids)
+
+    def __contains__(self, pinyin):
+        return self.find(pinyin) >= 0
+
+    def __getitem__(self, pinyin):
+        index = self.find(pinyin)
+        if index < 0:
+            raise KeyError(pinyin)
+        start, stop = self.pinyin_offsets[index], self.pinyin_offsets[index + 1]
+        return [(self.string_pool.decode(self.entry_words[entry]), self.entry_probabilities[entry])
+                for entry in range(start, stop)]
+
+    def entries(self, pinyin):
+        """
+        Get words of pinyin by string id.
+
+        Args:
+            pinyin: A string, pinyin separated by space.
+
+        Returns:
+            A list of (word id, log(probability)), empty if pinyin is not in the table.
+        """
+        index = self.find(pinyin)
+        if index < 0:
+            return []
+        return self.entries_at(index)
+
+    def entries_at(self, index):
+        """
+        Get words of the pinyin at index of pinyin_ids, as a list of (word id, log(probability)).
+        """
+        start, stop = self.pinyin_offsets[index], self.pinyin_offsets[index + 1]
+        return list(zip(self.entry_words[start:stop], self.entry_probabilities[start:stop]))
+
+    def _abbreviated_entries(self, pieces):
+        """
+        Get words of abbreviated pinyin, whose every piece is a prefix of a single pinyin, e.g. ('b', 'jing').
+        Words of the pinyin equal to the pieces are found in the table, and the others in the initials index.
+
+        Args:
+            pieces: A tuple of prefixes of single pinyin.
+
+        Returns:
+            A list of (word id, log(probability)) of different words.
+        """
+        words = dict(self.entries(' '.join(pieces)))
+        if self.initials is not None and len(pieces) <= MAX_INITIALS_LENGTH:
+            for entry in self.initials.entries(''.join(piece[0] for piece in pieces)):
+                pinyin_index = bisect.bisect_right(self.pinyin_offsets, entry) - 1
+                syllables = self.string_pool.decode(self.pinyin_ids[pinyin_index]).split(' ')
+                if all(map(str.startswith, syllables, pieces)) and self.entry_words[entry] not in words:
+                    words[self.entry_words[entry]] = self.entry_probabilities[entry]
+        return list(words.items())
+
+    def _prefix_range(self, prefix):
+        """
+        Find the pinyin beginning with prefix.
+        Strings are sorted, so pinyin equal to prefix or beginning with 'prefix ' forms a contiguous range
+        [prefix, prefix + '!') of the string pool, which lies inside the range of prefix without its last syllable.
+
+        Args:
+            prefix: Pinyin in utf-8 bytes, separated by space.
+
+        Returns:
+            low, high: Range of the string pool, empty if no pinyin begins with prefix.
+            index: Index of prefix in pinyin_ids, -1 if prefix itself is not in the table.
+        """
+        string_pool = self.string_pool
+        separator = prefix.rfind(b' ')
+        if separator < 0:
+            low, high = 0, len(string_pool)
+        else:
+            low, high, _ = self.prefix_range(prefix[:separator])
+        low = bisect.bisect_left(string_pool, prefix, low, high)
+        high = bisect.bisect_left(string_pool, prefix + b'!', low, high)
+        if low < high and string_pool[low] == prefix:
+            index = bisect.bisect_left(self.pinyin_ids, low)
+            if index < len(self.pinyin_ids) and self.pinyin_ids[index] == low:
+                return low, high, index
+        return low, high, -1
+
+
+class WordWordTable(object):
+    """
+    word-word table queried in place, indexed by the string ids of words.
+    Also behaves like a read-only dict, key->str(word1-word2), value->log(probability).
+    """
+
+    def __init__(self, string_pool, bigram_offsets, bigram_successors, bigram_probabilities):
+        """
+        Args:
+            string_pool: A StringPool.
+            bigram_offsets: Range of the successors of every word id.
+            bigram_successors: Sorted word2 ids following every word1 id.
+            bigram_probabilities: log(probability) of bigram_successors.
+        """
+        self.string_pool = string_pool
+        self.bigram_offsets = bigram_offsets
+        self.bigram_successors = bigram_successors
+        self.bigram_probabilities = bigram_probabilities
+        # 常用词的后继反复被查询，缓存为dict以免每次在内存映射上二分查找
+        self.successors = functools.lru_cache(maxsize=SUCCESSOR_CACHE_SIZE)(self._successors)
+
+    def _successors(self, word1_id):
+        """
+        Get all words following word1.
+
+        Returns:
+            A dict, key->word2 id, value->log(probability).
+        """
+        start, stop = self.bigram_offsets[word1_id], self.bigram_offsets[word1_id + 1]
+        return dict(zip(self.bigram_successors[start:stop], self.bigram_probabilities[start:stop]))
+
+    def probability(self, word1_id, word2_id):
+        """
+        Get log(probability) of word2 following word1, None if the pair is not in the table.
+        """
+        start, stop = self.bigram_offsets[word1_id], self.bigram_offsets[word1_id + 1]
+        index = bisect.bisect_left(self.bigram_successors, word2_id, start, stop)
+        if index < stop and self.bigram_successors[index] == word2_id:
+            return self.bigram_probabilities[index]
+        return None
+
+    def __len__(self):
+        return len(self.bigram_successors)
+
+    def get(self, word_pair, default=None):
+        word1, word2 = word_pair.split('-')
+        word1_id = self.string_pool.find(word1)
+        word2_id = self.string_pool.find(word2)
+        if word1_id < 0 or word2_id < 0:
+            return default
+        probability = self.probability(word1_id, word2_id)
+        return default if probability is None else probability
+
+    def __contains__(self, word_pair):
+        return self.get(word_pair) is not None
+
+    def __getitem__(self, word_pair):
+        probability = self.get(word_pair)
+        if probability is None:
+            raise KeyError(word_pair)
+        return probability
 
 
 def load_table(table_path):
     """
-    Load table from table_path.
+    Load pinyin-word table and word-word table from a binary table file written by build_table.save_table.
+    The file is memory-mapped and queried in place, no Python dict is built.
 
     Args:
-        table_path: Path to the source table json file.
+        table_path: Path to the source binary table file.
 
     Returns:
-        table, a datastructure converted from json file.
+        pinyin-word table: A PinyinWordTable, key->pinyin, value->[(word, log(probability))].
+        word-word table: A WordWordTable, key->str(word1-word2), value->log(probability).
+    """
+    sections = map_sections(table_path)
+    string_pool = StringPool(sections['strings'], sections['string_offsets'])
+    pinyin_word_table = PinyinWordTable(string_pool, sections['pinyin_ids'], sections['pinyin_offsets'],
+                                        sections['entry_words'], sections['entry_probabilities'])
+    bigram_probabilities = sections['bigram_probabilities']
+    if 'bigram_levels' in sections:
+        bigram_probabilities = QuantizedArray(bigram_probabilities, sections['bigram_levels'])
+    word_word_table = WordWordTable(string_pool, sections['bigram_offsets'],
+                                    sections['bigram_successors'], bigram_probabilities)
+    if 'initials' in sections:
+        pinyin_word_table.initials = InitialsIndex(StringPool(sections['initials'], sections['initial_offsets']),
+                                                   sections['initial_entry_offsets'], sections['initial_entries'])
+    return pinyin_word_table, word_word_table
+
+
+class ConvertStats(object):
+    """
+    Counters and timers of ConvertSession, to size beams and caches from real input.
+    A session given a ConvertStats counts once per pinyin, after timing its phases, so the timers do not include
+    the counting. A session without one only checks `stats is not None` a few times per pinyin.
+
+    Counters:
+        sentences: Sentences backtracked by sentence().
+        pushes, pops: Pinyin appended and deleted, fewer than the converted pinyin if sentences share prefixes.
+        restores: Columns restored by push_state(), e.g. from the cache of an Engine.
+        prefix_lookups: Pinyin prefixes looked up in the pinyin-word table.
+        lattice_nodes: Words ending at a pinyin, before pruning.
+        pruned_nodes: Nodes dropped by beam pruning.
+        max_column_nodes: Most nodes kept at a pinyin.
+        transitions: Pairs of a front node and a word following it, scored to find the best front node.
+        bigram_hits: Transitions found in the word-word table.
+        backoff_misses: Transitions not in the word-word table, scored with the backoff penalty.
+    Phases, in seconds:
+        lookup: Looking up the prefixes and the words ending at a pinyin.
+        scoring: Scoring the transitions.
+        pruning: Beam pruning.
+        backtrack: Backtracking and joining the best sentence.
     """
-    with open(table_path, 'r') as f:
-        return json.load(f)
+
+    COUNTERS = ("sentences", "pushes", "pops", "restores", "prefix_lookups", "lattice_nodes", "pruned_nodes",
+                "max_column_nodes", "transitions", "bigram_hits", "backoff_misses")
+    PHASES = ("lookup", "scoring", "pruning", "backtrack")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Set all counters and timers to 0.
+        """
+        for counter in self.COUNTERS:
+            setattr(self, counter, 0)
+        self.seconds = dict.fromkeys(self.PHASES, 0.0)
+
+    def as_dict(self):
+        """
+        Returns:
+            A dict of the counters, with the seconds of the phases in a dict under "seconds".
+        """
+        stats = {counter: getattr(self, counter) for counter in self.COUNTERS}
+        stats["seconds"] = dict(self.seconds)
+        return stats
+
+    def merge(self, stats):
+        """
+        Add the counters and timers of another ConvertStats or its as_dict(), e.g. from a worker process.
+        """
+        if isinstance(stats, ConvertStats):
+            stats = stats.as_dict()
+        for counter in self.COUNTERS:
+            if counter.startswith("max_"):
+                setattr(self, counter, max(getattr(self, counter), stats[counter]))
+            else:
+                setattr(self, counter, getattr(self, counter) + stats[counter])
+        for phase in self.PHASES:
+            self.seconds[phase] += stats["seconds"][phase]
+
+    def report(self):
+        """
+        Returns:
+            A few lines summarizing the counters and timers.
+        """
+        total_seconds = sum(self.seconds.values())
+        return '\n'.join((
+            "sentences: %d, pinyin pushed: %d, popped: %d, restored: %d, prefix lookups: %d" % (
+                self.sentences, self.pushes, self.pops, self.restores, self.prefix_lookups),
+            "lattice nodes: %d (%.1f per pinyin), pruned: %d, most kept at a pinyin: %d" % (
+                self.lattice_nodes, self.lattice_nodes / self.pushes if self.pushes else 0.0, self.pruned_nodes,
+                self.max_column_nodes),
+            "transitions: %d, bigram hits: %d (%.1f%%), backoff misses: %d" % (
+                self.transitions, self.bigram_hits,
+                self.bigram_hits / self.transitions * 100 if self.transitions else 0.0, self.backoff_misses),
+            "time: " + ", ".join("%s %.4fs (%.1f%%)" % (
+                phase, self.seconds[phase], self.seconds[phase] / total_seconds * 100 if total_seconds else 0.0)
+                for phase in self.PHASES),
+        ))
 
 
-def convert_pinyin(pinyin, pinyin_word_table, word_word_table):
+class ConvertSession(object):
+    """
+    Incremental convert_pinyin, whose dynamic programming table grows and shrinks one pinyin at a time,
+    e.g. as an input method receives and deletes syllables.
+    Appending or deleting a pinyin costs the same no matter how many pinyin are before it.
+    """
+
+    def __init__(self, pinyin_word_table, word_word_table, beam_width=None, beam_threshold=None,
+                 backoff_penalty=BACKOFF_PENALTY, stats=None):
+        """
+        Args:
+            pinyin_word_table: pinyin-word table, a PinyinWordTable.
+            word_word_table: word-word table, a WordWordTable.
+            beam_width, beam_threshold: Beam pruning of every column, see prune_column.
+            backoff_penalty: Penalty in log(probability) of a pair not in the word-word table, see BACKOFF_PENALTY.
+            stats: A ConvertStats to count the work of the session in, None not to count.
+        """
+        self.pinyin_word_table = pinyin_word_table
+        self.word_word_table = word_word_table
+        # 每列至少保留一个节点，回溯时前一列总有前驱
+        if beam_width is not None and beam_width < 1:
+            raise ValueError("beam_width must be at least 1")
+        self.beam_width = beam_width
+        self.beam_threshold = beam_threshold
+        self.backoff_penalty = backoff_penalty
+        self.stats = stats
+        self.pinyin_list = []
+        # dynamic_programming_table:二维数组，记录pinyin_list[:stop_index+1]的所有可能尾词的分别最优解
+        # 第一维为stop_index，第二维为list(节点编号，尾词probability，总句probability，尾词后继dict)
+        self.dynamic_programming_table = []
+        # prefixes[stop_index]:仍有拼音以之开头、可被下一个拼音延伸的(起点，前缀)，按起点排序
+        self.prefixes = []
+        # 回溯指针：每个节点的尾词id及最优前驱节点，-1表示句首，只在最后回溯一次拼出整句
+        self.node_words = []
+        self.node_backs = []
+        # 每个节点的尾词起点，供sentences()找到前驱所在的列
+        self.node_starts = []
+        # node_counts[stop_index]:到stop_index为止的节点数，删除拼音时据此截断回溯指针
+        self.node_counts = []
+
+    def __len__(self):
+        return len(self.pinyin_list)
+
+    def push(self, pinyin_single):
+        """
+        Append a pinyin and compute its column of the dynamic programming table.
+        Raises InvalidPinyinError and leaves the session unchanged if no word ends with pinyin_single.
+
+        Args:
+            pinyin_single: A string, a single pinyin.
+        """
+        pinyin_single = normalize_pinyin(pinyin_single)
+        syllable = pinyin_single.encode('utf-8')
+        stop_index = len(self.pinyin_list)
+        successors = self.word_word_table.successors
+        backoff_penalty = self.backoff_penalty
+        stats = self.stats
+        if stats is not None:
+            start_time = time.perf_counter()
+        # 延伸上一个拼音处仍然存在的前缀，并从当前拼音开始一个新前缀，如同在音节trie上同时向下走
+        prefixes = []
+        candidates = []
+        for start_index, prefix in itertools.chain(self.prefixes[-1] if self.prefixes else (), ((stop_index, b''),)):
+            prefix = prefix + b' ' + syllable if prefix else syllable
+            low, high, pinyin_index = self.pinyin_word_table.prefix_range(prefix)
+            if low == high:
+                continue
+            prefixes.append((start_index, prefix))
+            if pinyin_index >= 0:
+                candidates.append((start_index, pinyin_index))
+        if stats is not None:
+            lookup_time = time.perf_counter()
+            stats.seconds["lookup"] += lookup_time - start_time
+        column = []
+        node_words = []
+        node_backs = []
+        node_starts = []
+        node_count = len(self.node_words)
+        for start_index, pinyin_index in candidates:
+            if start_index == 0:
+                for word_whole, probability_whole in self.pinyin_word_table.entries_at(pinyin_index):
+                    column.append((node_count + len(node_words), probability_whole, probability_whole,
+                                   successors(word_whole)))
+                    node_words.append(word_whole)
+                    node_backs.append(-1)
+                    node_starts.append(0)
+                continue
+            for word_back, word_probability_back in self.pinyin_word_table.entries_at(pinyin_index):
+                # Pushes one sentence for every word_back
+                max_node_front = -1
+                max_sentence_probability = float("-inf")
+                for node_front, word_probability_front, sentence_probability_front, successors_front in self.dynamic_programming_table[start_index - 1]:
+                    bigram_probability = successors_front.get(word_back)
+                    # log(probability), so * => + , / => -
+                    if bigram_probability is not None:
+                        sentence_probability = (
+                            sentence_probability_front + bigram_probability - word_probability_front)
+                    else:
+                        # Add a punishment to increase accuracy
+                        sentence_probability = sentence_probability_front + word_probability_back - backoff_penalty
+                    if max_node_front < 0 or sentence_probability > max_sentence_probability:
+                        max_node_front = node_front
+                        max_sentence_probability = sentence_probability
+                column.append((node_count + len(node_words), word_probability_back, max_sentence_probability,
+                               successors(word_back)))
+                node_words.append(word_back)
+                node_backs.append(max_node_front)
+                node_starts.append(start_index)
+        if not column:
+            raise InvalidPinyinError("No word ends with " + pinyin_single)
+        if stats is not None:
+            stats.seconds["scoring"] += time.perf_counter() - lookup_time
+            # 计时之后再数转移，以免计入打分时间
+            stats.pushes += 1
+            stats.prefix_lookups += (len(self.prefixes[-1]) if self.prefixes else 0) + 1
+            stats.lattice_nodes += len(column)
+            for word_back, start_index in zip(node_words, node_starts):
+                if start_index > 0:
+                    column_front = self.dynamic_programming_table[start_index - 1]
+                    bigram_hits = sum(word_back in successors_front for _, _, _, successors_front in column_front)
+                    stats.transitions += len(column_front)
+                    stats.bigram_hits += bigram_hits
+                    stats.backoff_misses += len(column_front) - bigram_hits
+            pruning_time = time.perf_counter()
+        if self.beam_width is not None or self.beam_threshold is not None:
+            column = prune_column(column, SENTENCE_PROBABILITY_INDEX, self.beam_width, self.beam_threshold)
+        if stats is not None:
+            stats.seconds["pruning"] += time.perf_counter() - pruning_time
+            stats.pruned_nodes += len(node_words) - len(column)
+            stats.max_column_nodes = max(stats.max_column_nodes, len(column))
+        self.pinyin_list.append(pinyin_single)
+        self.dynamic_programming_table.append(column)
+        self.prefixes.append(prefixes)
+        self.node_words.extend(node_words)
+        self.node_backs.extend(node_backs)
+        self.node_starts.extend(node_starts)
+        self.node_counts.append(len(self.node_words))
+
+    def pop(self):
+        """
+        Delete the last pinyin.
+
+        Returns:
+            The deleted pinyin.
+        """
+        self.dynamic_programming_table.pop()
+        self.prefixes.pop()
+        self.node_counts.pop()
+        node_count = self.node_counts[-1] if self.node_counts else 0
+        del self.node_words[node_count:]
+        del self.node_backs[node_count:]
+        del self.node_starts[node_count:]
+        if self.stats is not None:
+            self.stats.pops += 1
+        return self.pinyin_list.pop()
+
+    def column_state(self):
+        """
+        Get what push() added for the last pinyin, to be restored by push_state() in a session holding the same
+        previous pinyin.
+        """
+        node_count = self.node_counts[-2] if len(self.node_counts) > 1 else 0
+        return (self.dynamic_programming_table[-1], self.prefixes[-1], self.node_words[node_count:],
+                self.node_backs[node_count:], self.node_starts[node_count:])
+
+    def push_state(self, pinyin_single, state):
+        """
+        Append a pinyin with the column_state() saved by a session holding the same pinyin before it,
+        without computing the column again.
+        """
+        column, prefixes, node_words, node_backs, node_starts = state
+        if self.stats is not None:
+            self.stats.restores += 1
+        self.pinyin_list.append(normalize_pinyin(pinyin_single))
+        self.dynamic_programming_table.append(column)
+        self.prefixes.append(prefixes)
+        self.node_words.extend(node_words)
+        self.node_backs.extend(node_backs)
+        self.node_starts.extend(node_starts)
+        self.node_counts.append(len(self.node_words))
+
+    def update(self, pinyin_list):
+        """
+        Make the session hold pinyin_list, the columns of the prefix shared with the current pinyin are kept.
+
+        Args:
+            pinyin_list: A list of single pinyin.
+        """
+        pinyin_list = [normalize_pinyin(pinyin_single) for pinyin_single in pinyin_list]
+        common_length = 0
+        for pinyin_current, pinyin_new in zip(self.pinyin_list, pinyin_list):
+            if pinyin_current != pinyin_new:
+                break
+            common_length += 1
+        while len(self.pinyin_list) > common_length:
+            self.pop()
+        for pinyin_single in pinyin_list[common_length:]:
+            self.push(pinyin_single)
+
+    def sentence(self):
+        """
+        Get the best sentence of the current pinyin, an empty string if there is no pinyin.
+        """
+        if not self.dynamic_programming_table:
+            return ""
+        stats = self.stats
+        if stats is not None:
+            start_time = time.perf_counter()
+        max_node = -1
+        max_sentence_probability = float("-inf")
+        for node, _, sentence_probability, _ in self.dynamic_programming_table[-1]:
+            if max_node < 0 or sentence_probability > max_sentence_probability:
+                max_node = node
+                max_sentence_probability = sentence_probability
+        string_pool = self.pinyin_word_table.string_pool
+        words = []
+        while max_node >= 0:
+            words.append(string_pool.decode(self.node_words[max_node]))
+            max_node = self.node_backs[max_node]
+        sentence = ''.join(reversed(words))
+        if stats is not None:
+            stats.seconds["backtrack"] += time.perf_counter() - start_time
+            stats.sentences += 1
+        return sentence
+
+    def probability(self):
+        """
+        Get log(probability) of the best sentence of the current pinyin, 0 if there is no pinyin.
+        """
+        if not self.dynamic_programming_table:
+            return 0.0
+        return max(sentence_probability for _, _, sentence_probability, _ in self.dynamic_programming_table[-1])
+
+    def update_continuous(self, text, splitter):
+        """
+        Replace the pinyin with the most probable split of continuous pinyin, see PinyinSplitter.splits.
+        Splits sharing leading pinyin share their columns, like update().
+
+        Args:
+            text: A string of continuous pinyin, e.g. 'woaibeijing'.
+            splitter: A PinyinSplitter of the pinyin table.
+        """
+        max_split = None
+        max_probability = float("-inf")
+        for split in splitter.splits(text):
+            try:
+                self.update(split)
+            except InvalidPinyinError:
+                continue
+            probability = self.probability()
+            if probability > max_probability:
+                max_split = split
+                max_probability = probability
+        if max_split is None:
+            raise InvalidPinyinError("Invalid pinyin: " + text)
+        self.update(max_split)
+
+    def sentences(self, n):
+        """
+        Get the n best sentences of the current pinyin.
+        Paths are searched backwards from the last column with A*, where the probabilities of the dynamic programming
+        are the exact estimates of the unexplored front parts, so sentences come out best first and the search only
+        visits about n paths instead of decoding n times.
+
+        Args:
+            n: Number of sentences.
+
+        Returns:
+            A list of at most n distinct (sentence, log(probability)), best first.
+        """
+        if not self.dynamic_programming_table:
+            return []
+        string_pool = self.pinyin_word_table.string_pool
+        tie_breaker = itertools.count()
+        # heap: (-估计的总句probability，序号，节点，尾词probability，后句probability，后句)
+        heap = [(-sentence_probability, next(tie_breaker), node, word_probability, 0.0, "")
+                for node, word_probability, sentence_probability, _ in self.dynamic_programming_table[-1]]
+        heapq.heapify(heap)
+        # 同一节点后接相同的后句时，只有最先出堆的能得到新的句子
+        visited = set()
+        sentences = []
+        sentence_set = set()
+        while heap and len(sentences) < n:
+            estimate, _, node, word_probability, suffix_probability, suffix = heapq.heappop(heap)
+            if (node, suffix) in visited:
+                continue
+            visited.add((node, suffix))
+            word = self.node_words[node]
+            suffix = string_pool.decode(word) + suffix
+            start_index = self.node_starts[node]
+            if start_index == 0:
+                if suffix not in sentence_set:
+                    sentence_set.add(suffix)
+                    sentences.append((suffix, -estimate))
+                continue
+            for node_front, word_probability_front, sentence_probability_front, successors_front in self.dynamic_programming_table[start_index - 1]:
+                bigram_probability = successors_front.get(word)
+                # 与push中的转移概率一致
+                if bigram_probability is not None:
+                    transition_probability = bigram_probability - word_probability_front
+                else:
+                    transition_probability = word_probability - self.backoff_penalty
+                suffix_probability_front = suffix_probability + transition_probability
+                heapq.heappush(heap, (-(sentence_probability_front + suffix_probability_front), next(tie_breaker),
+                                      node_front, word_probability_front, suffix_probability_front, suffix))
+        return sentences
+
+    def words(self, n):
+        """
+        Get candidate words beginning at the first pinyin, longer words first, then more probable words first.
+
+        Args:
+            n: Number of words.
+
+        Returns:
+            A list of at most n (word, log(probability), number of pinyin of the word).
+        """
+        string_pool = self.pinyin_word_table.string_pool
+        candidates = []
+        prefix = b''
+        for length, pinyin_single in enumerate(self.pinyin_list, 1):
+            syllable = pinyin_single.encode('utf-8')
+            prefix = prefix + b' ' + syllable if prefix else syllable
+            low, high, pinyin_index = self.pinyin_word_table.prefix_range(prefix)
+            if low == high:
+                break
+            if pinyin_index >= 0:
+                candidates.extend((length, word_probability, word)
+                                  for word, word_probability in self.pinyin_word_table.entries_at(pinyin_index))
+        return [(string_pool.decode(word), word_probability, length)
+                for length, word_probability, word in heapq.nlargest(n, candidates)]
+
+
+def convert_pinyin(pinyin, pinyin_word_table, word_word_table, beam_width=None, beam_threshold=None,
+                   backoff_penalty=BACKOFF_PENALTY, stats=None):
     """
     Convert pinyin to Chinese sentence.
 
     Args:
         pinyin: A string, a sentence of pinyin separated by space.
-        pinyin_word_table: pinyin-word table, a dict, key->pinyin, value->[[word, log(probability)].
-        word_word_table: word-word table, a dict, key->str(word1-word2), value->log(probability)
+        pinyin_word_table: pinyin-word table, a PinyinWordTable.
+        word_word_table: word-word table, a WordWordTable.
+        beam_width: Keep at most beam_width best sentences for every stop index, None to keep all.
+        beam_threshold: Drop sentences worse than the best of the same stop index by more than beam_threshold
+            in log(probability), None to keep all.
+        backoff_penalty: Penalty in log(probability) of a pair not in the word-word table, see BACKOFF_PENALTY.
+        stats: A ConvertStats to count the work in, None not to count.
 
     Returns:
         A string of Chinese characters converted from pinyin.
@@ -31,45 +682,163 @@ def convert_pinyin(pinyin, pinyin_word_table, word_word_table):
     pinyin_list = pinyin.split(' ')
     if not pinyin_list or pinyin_list == ['']:
         return ""
-    # 'lue' should be 'lve' and 'nue' should be 'nve' in standard Chinese pinyin.
-    pinyin_list = ['lve' if pinyin_single == 'lue'
-                   else 'nve' if pinyin_single == 'nue'
-                   else pinyin_single
-                   for pinyin_single in pinyin_list]
-    dynamic_programming_table = [[] for _ in range(len(pinyin_list))]
-    # dynamic_programming_table:二维数组，记录pinyin_list[:stop_index+1]的所有可能尾词的分别最优解
-    # 第一维为stop_index，第二维为list(尾词，尾词probability，总句，总句probability)
-    for stop_index in range(len(pinyin_list)):
-        pinyin_whole = ' '.join(pinyin_list[:stop_index + 1])
-        if pinyin_whole in pinyin_word_table:
-            for word_whole, probability_whole in pinyin_word_table[pinyin_whole]:
-                dynamic_programming_table[stop_index].append(
-                    [word_whole, probability_whole, word_whole, probability_whole])
-        for mid_stop_index in range(stop_index):
-            pinyin_back = ' '.join(
-                pinyin_list[mid_stop_index + 1:stop_index + 1])
-            if pinyin_back in pinyin_word_table:
-                for word_back, word_probability_back in pinyin_word_table[pinyin_back]:
-                    # Pushes one sentence for every word_back
-                    max_sentence = [word_back,
-                                    word_probability_back, "", float("-inf")]
-                    for word_front, word_probability_front, sentence_front, sentence_probability_front in dynamic_programming_table[mid_stop_index]:
-                        word_pair = '-'.join((word_front, word_back))
-                        # log(probability), so * => + , / => -
-                        if word_pair in word_word_table:
-                            sentence_probability = (
-                                sentence_probability_front + word_word_table[word_pair] - word_probability_front)
-                        else:
-                            # Add a punishment to increase accuracy
-                            sentence_probability = sentence_probability_front + word_probability_back - 0.5
-                        if sentence_probability > max_sentence[3]:
-                            max_sentence[2] = sentence_front + word_back
-                            max_sentence[3] = sentence_probability
-                    assert max_sentence[2] != ""
-                    dynamic_programming_table[stop_index].append(max_sentence)
-    max_sentence = ("", float("-inf"))
-    for dp_node in dynamic_programming_table[-1]:
-        if dp_node[3] > max_sentence[1]:
-            max_sentence = (dp_node[2], dp_node[3])
-    assert max_sentence[0] != ""
-    return max_sentence[0]
+    session = ConvertSession(pinyin_word_table, word_word_table, beam_width, beam_threshold, backoff_penalty, stats)
+    session.update(pinyin_list)
+    return session.sentence()
+
+
+def convert_continuous(text, pinyin_word_table, word_word_table, beam_width=None, beam_threshold=None, splitter=None,
+                       backoff_penalty=BACKOFF_PENALTY, stats=None):
+    """
+    Convert continuous pinyin to Chinese sentence, trying the splits of the pinyin, see PinyinSplitter.
+
+    Args:
+        text: A string of continuous pinyin, e.g. 'woaibeijing', "xi'an" or 'lve'.
+        pinyin_word_table: pinyin-word table, a PinyinWordTable.
+        word_word_table: word-word table, a WordWordTable.
+        beam_width: Keep at most beam_width best sentences for every stop index, None to keep all.
+        beam_threshold: Drop sentences worse than the best of the same stop index by more than beam_threshold
+            in log(probability), None to keep all.
+        splitter: A PinyinSplitter, built from pinyin_word_table if None. Building it takes time, so reuse it.
+        backoff_penalty: Penalty in log(probability) of a pair not in the word-word table, see BACKOFF_PENALTY.
+        stats: A ConvertStats to count the work in, None not to count.
+
+    Returns:
+        A string of Chinese characters converted from the most probable split of the pinyin.
+    """
+    if splitter is None:
+        splitter = PinyinSplitter(pinyin_word_table.syllables())
+    session = ConvertSession(pinyin_word_table, word_word_table, beam_width, beam_threshold, backoff_penalty, stats)
+    session.update_continuous(text, splitter)
+    return session.sentence()
+
+
+def decode_abbreviated(pieces, pinyin_word_table, word_word_table, beam_width=ABBREVIATED_BEAM_WIDTH,
+                       beam_threshold=None, backoff_penalty=BACKOFF_PENALTY):
+    """
+    Decode a split of abbreviated pinyin by dynamic programming on the lattice of words matching its pieces.
+
+    Args:
+        pieces: A list of prefixes of single pinyin.
+        pinyin_word_table: pinyin-word table, a PinyinWordTable.
+        word_word_table: word-word table, a WordWordTable.
+        beam_width: Keep at most beam_width best sentences for every piece, None to keep all.
+        beam_threshold: Drop sentences worse than the best of the same piece by more than beam_threshold
+            in log(probability), None to keep all.
+        backoff_penalty: Penalty in log(probability) of a pair not in the word-word table, see BACKOFF_PENALTY.
+
+    Returns:
+        The best sentence and its log(probability), None if no words match the pieces.
+    """
+    successors = word_word_table.successors
+    # 结点为(word id, 词的概率, 句子的概率, 后继, 前一个结点)，与ConvertSession一致，句子的概率在下标2
+    dynamic_programming_table = []
+    for stop_index in range(len(pieces)):
+        column = []
+        for start_index in range(max(0, stop_index + 1 - MAX_INITIALS_LENGTH), stop_index + 1):
+            if start_index > 0 and not dynamic_programming_table[start_index - 1]:
+                continue
+            for word_back, word_probability_back in pinyin_word_table.abbreviated_entries(
+                    tuple(pieces[start_index:stop_index + 1])):
+                if start_index == 0:
+                    column.append((word_back, word_probability_back, word_probability_back,
+                                   successors(word_back), None))
+                    continue
+                max_node_front = None
+                max_sentence_probability = float("-inf")
+                for node_front in dynamic_programming_table[start_index - 1]:
+                    _, word_probability_front, sentence_probability_front, successors_front, _ = node_front
+                    bigram_probability = successors_front.get(word_back)
+                    if bigram_probability is not None:
+                        sentence_probability = (
+                            sentence_probability_front + bigram_probability - word_probability_front)
+                    else:
+                        sentence_probability = sentence_probability_front + word_probability_back - backoff_penalty
+                    if sentence_probability > max_sentence_probability:
+                        max_node_front = node_front
+                        max_sentence_probability = sentence_probability
+                column.append((word_back, word_probability_back, max_sentence_probability,
+                               successors(word_back), max_node_front))
+        dynamic_programming_table.append(prune_column(column, SENTENCE_PROBABILITY_INDEX, beam_width, beam_threshold))
+    if not dynamic_programming_table or not dynamic_programming_table[-1]:
+        return None
+    node = max(dynamic_programming_table[-1], key=lambda node: node[2])
+    sentence_probability = node[2]
+    words = []
+    while node is not None:
+        words.append(pinyin_word_table.string_pool.decode(node[0]))
+        node = node[4]
+    return ''.join(reversed(words)), sentence_probability
+
+
+def convert_abbreviated(text, pinyin_word_table, word_word_table, beam_width=None, beam_threshold=None,
+                        splitter=None, backoff_penalty=BACKOFF_PENALTY):
+    """
+    Convert abbreviated pinyin to Chinese sentence, e.g. 'bj' to '北京' or 'zhongguor' to '中国人'.
+    Every piece of the pinyin may be a prefix of a single pinyin, the words are found by the initials index
+    built by build_table.py, and the most probable split of the pinyin wins.
+
+    Args:
+        text: A string of abbreviated pinyin, continuous or separated by space or "'".
+        pinyin_word_table: pinyin-word table, a PinyinWordTable with initials index.
+        word_word_table: word-word table, a WordWordTable.
+        beam_width: Keep at most beam_width best sentences for every piece, None for ABBREVIATED_BEAM_WIDTH,
+            since abbreviated pinyin matches too many words to keep all.
+        beam_threshold: Drop sentences worse than the best of the same piece by more than beam_threshold
+            in log(probability), None to keep all.
+        backoff_penalty: Penalty in log(probability) of a pair not in the word-word table, see BACKOFF_PENALTY.
+        splitter: A PinyinSplitter, built from pinyin_word_table if None. Building it takes time, so reuse it.
+
+    Returns:
+        A string of Chinese characters converted from pinyin.
+    """
+    if pinyin_word_table.initials is None:
+        raise ValueError("Table has no initials index, rebuild it with build_table.py")
+    if splitter is None:
+        splitter = PinyinSplitter(pinyin_word_table.syllables())
+    if beam_width is None:
+        beam_width = ABBREVIATED_BEAM_WIDTH
+    max_result = None
+    for split in splitter.splits(text, partial=True):
+        result = decode_abbreviated([normalize_pinyin(piece) for piece in split], pinyin_word_table, word_word_table,
+                                    beam_width, beam_threshold, backoff_penalty) if split else ("", 0.0)
+        if result is not None and (max_result is None or result[1] > max_result[1]):
+            max_result = result
+    if max_result is None:
+        raise InvalidPinyinError("Invalid pinyin: " + text)
+    return max_result[0]
+
+
+def convert_batch(pinyin_lines, pinyin_word_table, word_word_table, beam_width=None, beam_threshold=None,
+                  backoff_penalty=BACKOFF_PENALTY, stats=None):
+    """
+    Convert a batch of pinyin to Chinese sentences.
+    Identical pinyin is converted only once. Distinct pinyin is converted in sorted order by one ConvertSession,
+    so the dynamic programming of a prefix shared by neighbours is done only once.
+
+    Args:
+        pinyin_lines: An iterable of strings, sentences of pinyin separated by space.
+        pinyin_word_table: pinyin-word table, a PinyinWordTable.
+        word_word_table: word-word table, a WordWordTable.
+        beam_width, beam_threshold: Beam pruning of convert_pinyin, None to keep all.
+        backoff_penalty: Penalty in log(probability) of a pair not in the word-word table, see BACKOFF_PENALTY.
+        stats: A ConvertStats to count the work in, None not to count.
+
+    Returns:
+        A list of strings of Chinese characters in the order of pinyin_lines, None for invalid pinyin.
+    """
+    pinyin_lines = list(pinyin_lines)
+    sentences = dict.fromkeys(pinyin_lines)
+    session = ConvertSession(pinyin_word_table, word_word_table, beam_width, beam_threshold, backoff_penalty, stats)
+    for pinyin_list in sorted(pinyin.split(' ') for pinyin in sentences):
+        pinyin = ' '.join(pinyin_list)
+        if pinyin_list == ['']:
+            sentences[pinyin] = ""
+            continue
+        try:
+            session.update(pinyin_list)
+        except InvalidPinyinError:
+            # 无法转换的句子保持为None，不影响批中的其他句子
+            continue
+        sentences[pinyin] = session.sentence()
+    return [sentences[pinyin] for pinyin in pinyin_lines]
@@ -0,0 +1,208 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "src"))
+
+from engines import ENGINE_NAMES, load_engine
+
+DATA_DIRNAME = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "data")
+# 按拼音个数分组统计延迟，每组为[下限, 上限]
+LENGTH_BUCKETS = ((1, 4), (5, 8), (9, 16), (17, 32), (33, None))
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of a sorted non-empty list.
+    """
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def bucket_name(length):
+    """
+    Name of the bucket of LENGTH_BUCKETS containing a sentence of length pinyin, e.g. '5-8' or '33+'.
+    """
+    for lower, upper in LENGTH_BUCKETS:
+        if upper is None:
+            return "%d+" % lower
+        if length <= upper:
+            return "%d-%d" % (lower, upper)
+
+
+def benchmark_engine(name, table_path, pinyin_lines, options, repeat):
+    """
+    Benchmark one model, run in a fresh process so that its peak RSS is not mixed with other models.
+
+    Args:
+        name: Name of the model, one of ENGINE_NAMES.
+        table_path: Path to the binary table file, None for data/<name>_table.bin.
+        pinyin_lines: A list of sentences of pinyin separated by space.
+        options: Keyword arguments of convert_batch of the model, e.g. beam_width.
+        repeat: Convert pinyin_lines this many times, the best time is taken as throughput.
+
+    Returns:
+        A dict of the results in seconds, bytes and sentences per second, with the number of invalid sentences.
+    """
+    start_time = time.perf_counter()
+    engine = load_engine(name, table_path)
+    load_seconds = time.perf_counter() - start_time
+    # 逐句转换，统计每句的延迟，无法转换的句子只计数
+    latencies = {}
+    invalid_sentences = 0
+    for pinyin in pinyin_lines:
+        start_time = time.perf_counter()
+        try:
+            engine.convert(pinyin, **options)
+        except engine.module.InvalidPinyinError:
+            invalid_sentences += 1
+            continue
+        latency = time.perf_counter() - start_time
+        latencies.setdefault(bucket_name(len(pinyin.split(' '))), []).append(latency)
+    # 整批转换，取最快的一次计算吞吐量，无法转换的句子由convert_batch记为None
+    batch_seconds = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        engine.convert_batch(pinyin_lines, **options)
+        batch_seconds = min(batch_seconds, time.perf_counter() - start_time)
+    latency_results = {}
+    for lower, upper in LENGTH_BUCKETS:
+        bucket = bucket_name(upper if upper is not None else lower)
+        if bucket not in latencies:
+            continue
+        bucket_latencies = sorted(latencies[bucket])
+        latency_results[bucket] = {"sentences": len(bucket_latencies), "max": bucket_latencies[-1]}
+        for percent in PERCENTILES:
+            latency_results[bucket]["p%d" % percent] = percentile(bucket_latencies, percent)
+    all_latencies = sorted(latency for bucket_latencies in latencies.values() for latency in bucket_latencies)
+    if all_latencies:
+        latency_results["all"] = {"sentences": len(all_latencies), "max": all_latencies[-1]}
+        for percent in PERCENTILES:
+            latency_results["all"]["p%d" % percent] = percentile(all_latencies, percent)
+    # Linux的ru_maxrss以KB为单位，macOS以字节为单位
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+    return {
+        "load_seconds": load_seconds,
+        "invalid_sentences": invalid_sentences,
+        "latency_seconds": latency_results,
+        "batch_seconds": batch_seconds,
+        "sentences_per_second": len(pinyin_lines) / batch_seconds if batch_seconds > 0 else None,
+        "peak_rss_bytes": peak_rss,
+    }
+
+
+def compare_results(results, baseline, tolerance):
+    """
+    Find the metrics of results worse than baseline by more than tolerance, e.g. 0.1 for 10%.
+
+    Returns:
+        A list of strings describing the regressions.
+    """
+    regressions = []
+
+    def check(label, value, baseline_value, higher_is_better=False):
+        if value is None or not baseline_value:
+            return
+        change = (baseline_value - value if higher_is_better else value - baseline_value) / baseline_value
+        if change > tolerance:
+            regressions.append("%s: %.6g -> %.6g (%+.1f%%)" % (
+                label, baseline_value, value, (value - baseline_value) / baseline_value * 100))
+
+    for name, engine_results in results["engines"].items():
+        baseline_results = baseline.get("engines", {}).get(name)
+        if baseline_results is None:
+            continue
+        check("%s load_seconds" % name, engine_results["load_seconds"], baseline_results.get("load_seconds"))
+        check("%s sentences_per_second" % name, engine_results["sentences_per_second"],
+              baseline_results.get("sentences_per_second"), higher_is_better=True)
+        check("%s peak_rss_bytes" % name, engine_results["peak_rss_bytes"], baseline_results.get("peak_rss_bytes"))
+        for bucket, latency in engine_results["latency_seconds"].items():
+            baseline_latency = baseline_results.get("latency_seconds", {}).get(bucket, {})
+            for percent in PERCENTILES:
+                key = "p%d" % percent
+                check("%s latency %s %s" % (name, bucket, key), latency[key], baseline_latency.get(key))
+    return regressions
+
+
+"""
+Benchmark load time, latency by sentence length, throughput and peak RSS of the models, and print them in json.
+"""
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs='*',
+                        help="files of pinyin, one sentence per line, data/input*.txt by default")
+    parser.add_argument("--engines", nargs='+', choices=ENGINE_NAMES, default=list(ENGINE_NAMES),
+                        help="models to benchmark")
+    parser.add_argument("--table", action="append", default=[], metavar="ENGINE=PATH",
+                        help="path to the binary table file of a model, data/<engine>_table.bin by default")
+    parser.add_argument("--beam-width", type=int, default=None,
+                        help="beam width of char2 and word2, default keep all")
+    parser.add_argument("--beam-threshold", type=float, default=None,
+                        help="beam threshold of char2 and word2, default keep all")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="convert the inputs as a batch this many times and take the fastest")
+    parser.add_argument("--output", default=None,
+                        help="write the json to this file instead of stdout")
+    parser.add_argument("--baseline", default=None,
+                        help="json of an earlier run, exit with 1 if any metric is worse than it beyond --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative regression against --baseline, default 0.2 for 20%%")
+    args = parser.parse_args()
+    input_paths = args.inputs
+    if not input_paths:
+        input_paths = sorted(
+            os.path.join(DATA_DIRNAME, filename) for filename in os.listdir(DATA_DIRNAME)
+            if filename.startswith("input") and filename.endswith(".txt"))
+    pinyin_lines = []
+    for input_path in input_paths:
+        with open(input_path, 'r') as input_file:
+            pinyin_lines.extend(line.strip().lower() for line in input_file if line.strip())
+    if not pinyin_lines:
+        parser.error("no pinyin in the inputs")
+    table_paths = {}
+    for table in args.table:
+        name, separator, path = table.partition('=')
+        if not separator or name not in ENGINE_NAMES:
+            parser.error("--table should be ENGINE=PATH, e.g. word2=data/word2_small.bin")
+        table_paths[name] = path
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "inputs": input_paths,
+        "sentences": len(pinyin_lines),
+        "engines": {},
+    }
+    # 每个模型在新的进程中测试，互不影响加载时间和内存
+    context = multiprocessing.get_context("spawn")
+    for name in args.engines:
+        options = {}
+        if name != "word1":
+            if args.beam_width is not None:
+                options["beam_width"] = args.beam_width
+            if args.beam_threshold is not None:
+                options["beam_threshold"] = args.beam_threshold
+        with context.Pool(1) as pool:
+            results["engines"][name] = pool.apply(
+                benchmark_engine, (name, table_paths.get(name), pinyin_lines, options, args.repeat))
+    output = json.dumps(results, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print("Regression:", regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
@@ -1,4 +1,7 @@
 import os
+import shlex
+import sys
+import time
 
 executable_file_path = os.path.join(
     os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "src", "word2", "pinyin.py")
@@ -8,8 +11,11 @@ output_file_path = os.path.join(
     os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "data", "output1.txt")
 std_output_file_path = os.path.join(
     os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "data", "output_std1.txt")
+# 其余命令行参数原样传给拼音程序，例如--beam-width 10
+start_time = time.time()
 return_value = os.system("python3 " + executable_file_path + " " +
-                         input_file_path + " " + output_file_path)
+                         input_file_path + " " + output_file_path + "".join(" " + shlex.quote(arg) for arg in sys.argv[1:]))
+elapsed_time = time.time() - start_time
 if return_value == 0:
     total_sentence_number = 0
     accurate_sentence_number = 0
@@ -32,5 +38,6 @@ if return_value == 0:
           "=", accurate_sentence_number / total_sentence_number * 100, "%")
     print("Character accuracy:", accurate_character_number, "/", total_character_number,
           "=", accurate_character_number / total_character_number * 100, "%")
+    print("Time:", elapsed_time, "s")
 else:
     print("Pinyin program is not executed properly.")
@@ -0,0 +1,197 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "src"))
+
+from accuracy import edit_distance
+from engines import ENGINE_NAMES, load_engine
+
+DATA_DIRNAME = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "data")
+# 每个任务转换的句数，大的测试集拆成多个任务并行
+CHUNK_SIZE = 2000
+# 可以调节的转换参数，word1没有这些参数
+SWEEP_OPTIONS = ("beam_width", "beam_threshold", "backoff_penalty")
+
+# 子进程中已加载的模型，每个模型只加载一次
+worker_engines = {}
+
+
+def find_test_sets():
+    """
+    Find the test sets data/inputN.txt with data/output_stdN.txt.
+
+    Returns:
+        A list of (name, input path, std output path), sorted by N.
+    """
+    test_sets = []
+    for filename in os.listdir(DATA_DIRNAME):
+        match = re.fullmatch(r"input(\d*)\.txt", filename)
+        std_path = os.path.join(DATA_DIRNAME, "output_std%s.txt" % (match.group(1) if match else ""))
+        if match and os.path.exists(std_path):
+            test_sets.append((int(match.group(1) or 0), "input%s" % match.group(1),
+                              os.path.join(DATA_DIRNAME, filename), std_path))
+    return [test_set[1:] for test_set in sorted(test_sets)]
+
+
+def evaluate_chunk(name, table_path, options, pinyin_lines, std_sentences, max_errors):
+    """
+    Convert a chunk of a test set in a worker process and score it.
+
+    Args:
+        name: Name of the model, one of ENGINE_NAMES.
+        table_path: Path to the binary table file, None for data/<name>_table.bin.
+        options: Keyword arguments of convert_batch of the model, e.g. beam_width.
+        pinyin_lines: A list of sentences of pinyin.
+        std_sentences: A list of the correct sentences of pinyin_lines.
+        max_errors: Keep at most max_errors wrong sentences as examples.
+
+    Returns:
+        A dict of the counts of sentences and characters, the seconds of conversion and the wrong sentences.
+    """
+    engine = worker_engines.get((name, table_path))
+    if engine is None:
+        engine = worker_engines[(name, table_path)] = load_engine(name, table_path)
+    start_time = time.perf_counter()
+    # 无法转换的句子记为空
+    sentences = [sentence or "" for sentence in engine.convert_batch(pinyin_lines, **options)]
+    seconds = time.perf_counter() - start_time
+    result = {"sentences": len(std_sentences), "accurate_sentences": 0, "characters": 0, "distance": 0,
+              "seconds": seconds, "errors": []}
+    for pinyin, sentence, std_sentence in zip(pinyin_lines, sentences, std_sentences):
+        result["characters"] += len(std_sentence)
+        if sentence == std_sentence:
+            result["accurate_sentences"] += 1
+            continue
+        result["distance"] += edit_distance(sentence, std_sentence)
+        if len(result["errors"]) < max_errors:
+            result["errors"].append((pinyin, sentence, std_sentence))
+    return result
+
+
+def evaluate_task(task):
+    """
+    evaluate_chunk() of a task of the pool, returning the key of the task with the result.
+    """
+    key, arguments = task
+    return key, evaluate_chunk(*arguments)
+
+
+def format_options(options):
+    """
+    Format options like 'beam_width=10 backoff_penalty=1.0', 'default' if there are none.
+    """
+    return " ".join("%s=%s" % item for item in options.items()) or "default"
+
+
+"""
+Evaluate sentence and character accuracy of the models on many test sets in parallel, optionally sweeping
+beam width, beam threshold and backoff penalty.
+Character accuracy is 1 - edit distance / characters of the correct sentences, so a missing or extra character
+only costs itself instead of shifting the rest of the sentence.
+"""
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engines", nargs='+', choices=ENGINE_NAMES, default=["word2"],
+                        help="models to evaluate")
+    parser.add_argument("--set", nargs=2, action="append", default=[], metavar=("INPUT", "STD_OUTPUT"),
+                        help="a file of pinyin and the file of its correct sentences, "
+                             "data/inputN.txt and data/output_stdN.txt by default")
+    parser.add_argument("--table", action="append", default=[], metavar="ENGINE=PATH",
+                        help="path to the binary table file of a model, data/<engine>_table.bin by default")
+    parser.add_argument("--beam-width", nargs='+', type=int, default=[],
+                        help="beam widths of char2 and word2 to try, default keep all")
+    parser.add_argument("--beam-threshold", nargs='+', type=float, default=[],
+                        help="beam thresholds of char2 and word2 to try, default keep all")
+    parser.add_argument("--backoff-penalty", nargs='+', type=float, default=[],
+                        help="penalties of pairs not in the table of char2 and word2 to try, default BACKOFF_PENALTY")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="number of processes, default the number of CPUs")
+    parser.add_argument("--errors", type=int, default=0,
+                        help="print at most this many wrong sentences of every test set")
+    parser.add_argument("--json", default=None,
+                        help="also write the results to this json file")
+    args = parser.parse_args()
+    test_sets = [(os.path.splitext(os.path.basename(input_path))[0], input_path, std_path)
+                 for input_path, std_path in args.set] or find_test_sets()
+    if not test_sets:
+        parser.error("no test sets, give them by --set INPUT STD_OUTPUT")
+    table_paths = {}
+    for table in args.table:
+        name, separator, path = table.partition('=')
+        if not separator or name not in ENGINE_NAMES:
+            parser.error("--table should be ENGINE=PATH, e.g. word2=data/word2_small.bin")
+        table_paths[name] = path
+    test_set_lines = {}
+    for set_name, input_path, std_path in test_sets:
+        with open(input_path, 'r') as input_file, open(std_path, 'r') as std_file:
+            pinyin_lines = [line.strip().lower() for line in input_file]
+            std_sentences = [line.strip() for line in std_file]
+        # 忽略文件末尾的空行
+        while pinyin_lines and not pinyin_lines[-1]:
+            pinyin_lines.pop()
+        while std_sentences and not std_sentences[-1]:
+            std_sentences.pop()
+        if len(pinyin_lines) != len(std_sentences):
+            parser.error("%s has %d lines but %s has %d" % (
+                input_path, len(pinyin_lines), std_path, len(std_sentences)))
+        test_set_lines[set_name] = (pinyin_lines, std_sentences)
+    # 所有模型、参数组合、测试集的块作为任务，结果按(模型, 参数, 测试集)汇总
+    sweep_values = [getattr(args, option) or [None] for option in SWEEP_OPTIONS]
+    configurations = []
+    for name in args.engines:
+        if name == "word1":
+            configurations.append((name, {}))
+            continue
+        for values in itertools.product(*sweep_values):
+            configurations.append((name, {option: value for option, value in zip(SWEEP_OPTIONS, values)
+                                          if value is not None}))
+    tasks = []
+    for configuration_index, (name, options) in enumerate(configurations):
+        for set_name, (pinyin_lines, std_sentences) in test_set_lines.items():
+            for start in range(0, len(pinyin_lines), CHUNK_SIZE):
+                tasks.append(((configuration_index, set_name), (
+                    name, table_paths.get(name), options, pinyin_lines[start:start + CHUNK_SIZE],
+                    std_sentences[start:start + CHUNK_SIZE], args.errors)))
+    # 空的测试集没有任务，也照常报告0句
+    results = {(configuration_index, set_name): {"sentences": 0, "accurate_sentences": 0, "characters": 0,
+                                                 "distance": 0, "seconds": 0.0, "errors": []}
+               for configuration_index in range(len(configurations)) for set_name in test_set_lines}
+    start_time = time.perf_counter()
+    with multiprocessing.Pool(max(1, min(args.jobs, len(tasks)))) as pool:
+        # 大的任务先提交，以免最后只剩一个进程在转换
+        tasks.sort(key=lambda task: -len(task[1][3]))
+        for key, chunk_result in pool.imap_unordered(evaluate_task, tasks):
+            result = results[key]
+            for counter in ("sentences", "accurate_sentences", "characters", "distance", "seconds"):
+                result[counter] += chunk_result[counter]
+            result["errors"].extend(chunk_result["errors"][:args.errors - len(result["errors"])])
+    elapsed_time = time.perf_counter() - start_time
+    report = []
+    print("%-6s %-48s %-10s %9s %10s %10s %9s" % (
+        "engine", "options", "set", "sentences", "sentence", "character", "seconds"))
+    for configuration_index, (name, options) in enumerate(configurations):
+        for set_name in test_set_lines:
+            result = results[(configuration_index, set_name)]
+            sentence_accuracy = result["accurate_sentences"] / result["sentences"] if result["sentences"] else 0.0
+            character_accuracy = 1 - result["distance"] / result["characters"] if result["characters"] else 0.0
+            print("%-6s %-48s %-10s %9d %9.2f%% %9.2f%% %9.2f" % (
+                name, format_options(options), set_name, result["sentences"], sentence_accuracy * 100,
+                character_accuracy * 100, result["seconds"]))
+            for pinyin, sentence, std_sentence in result["errors"]:
+                print("    %s: %s should be %s" % (pinyin, sentence or "(invalid)", std_sentence))
+            report.append({"engine": name, "options": options, "set": set_name,
+                           "sentences": result["sentences"], "accurate_sentences": result["accurate_sentences"],
+                           "sentence_accuracy": sentence_accuracy, "characters": result["characters"],
+                           "edit_distance": result["distance"], "character_accuracy": character_accuracy,
+                           "seconds": result["seconds"]})
+    print("Time:", elapsed_time, "s")
+    if args.json is not None:
+        with open(args.json, 'w') as json_file:
+            json.dump(report, json_file, ensure_ascii=False, indent=2)
+            json_file.write('\n')
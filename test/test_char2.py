@@ -0,0 +1,343 @@
+import itertools
+import copy
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "src"))
+
+from engines import import_convert_pinyin
+from test_engines import import_build_table
+
+convert_pinyin = import_convert_pinyin("char2")
+build_table = import_build_table("char2")
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# 小字表，每个字只有一个读音
+PINYIN_CHARS = {
+    "bei": "北被背", "jing": "京经精", "da": "大打", "xue": "学雪", "xi": "西系洗", "an": "安按",
+    "xian": "先县现", "qing": "清请青", "hua": "华话花",
+}
+
+PINYIN_LINES = ["bei", "bei jing", "bei jing da xue", "qing hua da xue", "xi an", "xian", "xi an bei jing",
+                "hua bei da xue xi", "jing hua qing xian an"]
+
+
+def make_tables(seed=0):
+    """
+    Make a pinyin-char table and a sorted pinyin-pinyin-char-char table of PINYIN_CHARS in the form of
+    build_table.build_table, with random log(probability), so that no two sentences are equally probable.
+    """
+    generator = random.Random(seed)
+    pinyin_char_table = {pinyin: [[char, math.log10(generator.uniform(0.05, 1))] for char in chars]
+                         for pinyin, chars in PINYIN_CHARS.items()}
+    entries = sorted((pinyin, char) for pinyin, chars in PINYIN_CHARS.items() for char in chars)
+    pinyin_pinyin_char_char_table = [
+        (pinyin1, pinyin2, char1, char2, math.log10(generator.uniform(0.01, 0.5)))
+        for pinyin1, char1 in entries for pinyin2, char2 in entries if generator.random() < 0.3]
+    return pinyin_char_table, pinyin_pinyin_char_char_table
+
+
+def exhaustive_sentences(pinyin_list, pinyin_char_table, pinyin_pinyin_char_char_table,
+                         backoff_penalty=convert_pinyin.BACKOFF_PENALTY):
+    """
+    Score every sentence of pinyin_list one by one, the same way as ConvertSession.
+
+    Returns:
+        A dict, key->sentence, value->log(probability).
+    """
+    sentences = dict()
+    for entries in itertools.product(*map(pinyin_char_table.entries, pinyin_list)):
+        entry_front, sentence_probability = entries[0]
+        char_probability_front = sentence_probability
+        for entry_back, char_probability_back in entries[1:]:
+            char_char_probability = pinyin_pinyin_char_char_table.probability(entry_front, entry_back)
+            if char_char_probability is not None:
+                sentence_probability = sentence_probability + char_char_probability - char_probability_front
+            else:
+                sentence_probability = sentence_probability + char_probability_back - backoff_penalty
+            entry_front, char_probability_front = entry_back, char_probability_back
+        sentences[''.join(pinyin_char_table.decode(entry) for entry, _ in entries)] = sentence_probability
+    return sentences
+
+
+def convert_pinyin_baseline(pinyin, pinyin_char_table, pinyin_pinyin_char_char_table,
+                            backoff_penalty=convert_pinyin.BACKOFF_PENALTY):
+    """
+    The decoder before back-pointers, which carries whole sentences in the dynamic programming table
+    and looks up the tables by pinyin and str(pinyin1-pinyin2-char1-char2).
+    """
+    pinyin_list = pinyin.split(' ')
+    dynamic_programming_table = [[] for _ in range(len(pinyin_list))]
+    # 第二维为list(总句，总句probability，尾字pinyin，尾字probability)
+    pinyin_whole = pinyin_list[0]
+    for char_whole, char_probability_whole in pinyin_char_table[pinyin_whole]:
+        dynamic_programming_table[0].append([char_whole, char_probability_whole, pinyin_whole, char_probability_whole])
+    for stop_index in range(1, len(pinyin_list)):
+        pinyin_back = pinyin_list[stop_index]
+        for char_back, char_probability_back in pinyin_char_table[pinyin_back]:
+            max_sentence = ["", float("-inf"), pinyin_back, char_probability_back]
+            for sentence_front, sentence_probability_front, pinyin_front, char_probability_front in dynamic_programming_table[stop_index - 1]:
+                pinyin_char_pair = '-'.join((pinyin_front, pinyin_back, sentence_front[-1], char_back))
+                if pinyin_char_pair in pinyin_pinyin_char_char_table:
+                    sentence_probability = (sentence_probability_front
+                                            + pinyin_pinyin_char_char_table[pinyin_char_pair] - char_probability_front)
+                else:
+                    sentence_probability = sentence_probability_front + char_probability_back - backoff_penalty
+                if sentence_probability > max_sentence[1]:
+                    max_sentence[0] = sentence_front + char_back
+                    max_sentence[1] = sentence_probability
+            dynamic_programming_table[stop_index].append(max_sentence)
+    max_sentence = ("", float("-inf"))
+    for dp_node in dynamic_programming_table[-1]:
+        if dp_node[1] > max_sentence[1]:
+            max_sentence = (dp_node[0], dp_node[1])
+    return max_sentence[0]
+
+
+class Char2ModelTest(unittest.TestCase):
+    """
+    char2 on a small table saved by build_table.save_table.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.table_path = os.path.join(cls.directory, "char2_table.bin")
+        cls.pinyin_char_table, cls.pinyin_pinyin_char_char_table = make_tables()
+        build_table.save_table(cls.pinyin_char_table, cls.pinyin_pinyin_char_char_table, cls.table_path)
+        cls.tables = convert_pinyin.load_table(cls.table_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_table_round_trip(self):
+        pinyin_char_table, pinyin_pinyin_char_char_table = self.tables
+        self.assertEqual(len(pinyin_char_table), len(self.pinyin_char_table))
+        self.assertEqual(sorted(pinyin_char_table.syllables()), sorted(self.pinyin_char_table))
+        for pinyin, char_list in self.pinyin_char_table.items():
+            loaded_char_list = sorted(pinyin_char_table[pinyin])
+            self.assertEqual([char for char, _ in loaded_char_list], sorted(char for char, _ in char_list))
+            for (_, loaded_probability), (_, probability) in zip(loaded_char_list, sorted(char_list)):
+                # 概率存为float32
+                self.assertAlmostEqual(loaded_probability, probability, places=5)
+        self.assertNotIn("qqq", pinyin_char_table)
+        self.assertEqual(len(pinyin_pinyin_char_char_table), len(self.pinyin_pinyin_char_char_table))
+        for pinyin1, pinyin2, char1, char2, probability in self.pinyin_pinyin_char_char_table:
+            self.assertAlmostEqual(
+                pinyin_pinyin_char_char_table['-'.join((pinyin1, pinyin2, char1, char2))], probability, places=5)
+
+    def test_table_mapped_in_place(self):
+        pinyin_char_table, pinyin_pinyin_char_char_table = self.tables
+        for section in (pinyin_char_table.pinyin_offsets, pinyin_char_table.entry_chars,
+                        pinyin_char_table.entry_probabilities, pinyin_pinyin_char_char_table.bigram_offsets,
+                        pinyin_pinyin_char_char_table.bigram_successors,
+                        pinyin_pinyin_char_char_table.bigram_probabilities):
+            self.assertIsInstance(section, memoryview)
+            self.assertTrue(section.readonly)
+
+    def test_bigram_lookups(self):
+        pinyin_char_table, pinyin_pinyin_char_char_table = self.tables
+        bigrams = {((pinyin1, char1), (pinyin2, char2)): probability
+                   for pinyin1, pinyin2, char1, char2, probability in self.pinyin_pinyin_char_char_table}
+        entries = {(pinyin, char): pinyin_char_table.find_entry(pinyin, char)
+                   for pinyin, chars in PINYIN_CHARS.items() for char in chars}
+        self.assertEqual(sorted(entries.values()), list(range(len(entries))))
+        for pinyin_char1, entry1 in entries.items():
+            successors = pinyin_pinyin_char_char_table.successors(entry1)
+            self.assertEqual(sorted(successors), sorted(entry2 for pinyin_char2, entry2 in entries.items()
+                                                        if (pinyin_char1, pinyin_char2) in bigrams))
+            for pinyin_char2, entry2 in entries.items():
+                probability = pinyin_pinyin_char_char_table.probability(entry1, entry2)
+                if (pinyin_char1, pinyin_char2) in bigrams:
+                    self.assertAlmostEqual(probability, bigrams[pinyin_char1, pinyin_char2], places=5)
+                    self.assertEqual(successors[entry2], probability)
+                else:
+                    self.assertIsNone(probability)
+        self.assertEqual(pinyin_char_table.find_entry("bei", "京"), -1)
+        self.assertEqual(pinyin_char_table.find_entry("qqq", "北"), -1)
+        self.assertIsNone(pinyin_pinyin_char_char_table.get("bei-qqq-北-京"))
+        with self.assertRaises(KeyError):
+            pinyin_pinyin_char_char_table["bei-jing-北-学"]
+
+    def test_beam_search(self):
+        for pinyin in PINYIN_LINES:
+            sentences = exhaustive_sentences(pinyin.split(' '), *self.tables)
+            best_sentence = max(sentences, key=sentences.get)
+            session = convert_pinyin.ConvertSession(*self.tables)
+            session.update(pinyin.split(' '))
+            # 不剪枝时与穷举一致
+            self.assertEqual(session.sentence(), best_sentence)
+            self.assertAlmostEqual(session.probability(), sentences[best_sentence])
+            # 束宽不小于每个拼音的字数时不会剪掉任何节点
+            self.assertEqual(convert_pinyin.convert_pinyin(pinyin, *self.tables, beam_width=3), best_sentence)
+            self.assertEqual(convert_pinyin.convert_pinyin(pinyin, *self.tables, beam_threshold=100), best_sentence)
+            self.assertEqual(len(convert_pinyin.convert_pinyin(pinyin, *self.tables, beam_width=1)),
+                             len(pinyin.split(' ')))
+        with self.assertRaises(ValueError):
+            convert_pinyin.convert_pinyin("bei jing", *self.tables, beam_width=0)
+
+    def test_back_pointers(self):
+        generator = random.Random(1)
+        syllables = sorted(self.tables[0].syllables())
+        pinyin_lines = PINYIN_LINES + [' '.join(generator.choice(syllables) for _ in range(generator.randint(1, 6)))
+                                       for _ in range(50)]
+        for pinyin in pinyin_lines:
+            self.assertEqual(convert_pinyin.convert_pinyin(pinyin, *self.tables),
+                             convert_pinyin_baseline(pinyin, *self.tables))
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_vectorized(self):
+        pinyin_char_table, pinyin_pinyin_char_char_table = self.tables
+        for pinyin1 in PINYIN_CHARS:
+            for pinyin2 in PINYIN_CHARS:
+                matrix = pinyin_pinyin_char_char_table.transition_matrix(pinyin_char_table.find(pinyin1),
+                                                                         pinyin_char_table.find(pinyin2))
+                for row, (entry1, _) in enumerate(pinyin_char_table.entries(pinyin1)):
+                    for column, (entry2, _) in enumerate(pinyin_char_table.entries(pinyin2)):
+                        probability = pinyin_pinyin_char_char_table.probability(entry1, entry2)
+                        if probability is None:
+                            self.assertTrue(numpy.isnan(matrix[row, column]))
+                        else:
+                            self.assertEqual(matrix[row, column], probability)
+        generator = random.Random(1)
+        syllables = sorted(PINYIN_CHARS)
+        pinyin_lines = PINYIN_LINES + [' '.join(generator.choice(syllables) for _ in range(generator.randint(1, 6)))
+                                       for _ in range(50)]
+        for pinyin in pinyin_lines:
+            self.assertEqual(convert_pinyin.convert_pinyin(pinyin, *self.tables, vectorized=True),
+                             convert_pinyin.convert_pinyin(pinyin, *self.tables))
+        self.assertEqual(convert_pinyin.convert_pinyin("", *self.tables, vectorized=True), "")
+        with self.assertRaises(convert_pinyin.InvalidPinyinError):
+            convert_pinyin.convert_pinyin("bei qqq", *self.tables, vectorized=True)
+
+    def test_batch(self):
+        # 重复、无效和空的句子不影响批中的其他句子
+        pinyin_lines = PINYIN_LINES + ["bei qqq", "", "bei jing"] + PINYIN_LINES[::-1]
+        expected_sentences = []
+        for pinyin in pinyin_lines:
+            try:
+                expected_sentences.append(convert_pinyin.convert_pinyin(pinyin, *self.tables))
+            except convert_pinyin.InvalidPinyinError:
+                expected_sentences.append(None)
+        self.assertIsNone(expected_sentences[len(PINYIN_LINES)])
+        self.assertEqual(convert_pinyin.convert_batch(pinyin_lines, *self.tables), expected_sentences)
+        self.assertEqual(
+            convert_pinyin.convert_batch(pinyin_lines, *self.tables, beam_width=1),
+            [None if sentence is None else convert_pinyin.convert_pinyin(pinyin, *self.tables, beam_width=1)
+             for pinyin, sentence in zip(pinyin_lines, expected_sentences)])
+        if numpy is not None:
+            self.assertEqual(convert_pinyin.convert_batch(pinyin_lines, *self.tables, vectorized=True),
+                             expected_sentences)
+
+    def session_state(self, session):
+        """
+        Copy the dynamic programming state of a session.
+        """
+        names = ("pinyin_list", "dynamic_programming_table", "node_entries", "node_backs", "node_counts")
+        return copy.deepcopy({name: getattr(session, name) for name in names})
+
+    def test_session(self):
+        session = convert_pinyin.ConvertSession(*self.tables)
+        for pinyin in PINYIN_LINES:
+            pinyin_list = pinyin.split(' ')
+            session.update(pinyin_list)
+            fresh_session = convert_pinyin.ConvertSession(*self.tables)
+            for pinyin_single in pinyin_list:
+                fresh_session.push(pinyin_single)
+            # update保留共同前缀的列，结果与从头逐个push一致
+            self.assertEqual(self.session_state(session), self.session_state(fresh_session))
+            self.assertEqual(session.sentence(), convert_pinyin.convert_pinyin(pinyin, *self.tables))
+            state = self.session_state(session)
+            for pinyin_single in ("jing", "da", "xue"):
+                session.push(pinyin_single)
+            for _ in range(3):
+                session.pop()
+            self.assertEqual(self.session_state(session), state)
+            with self.assertRaises(convert_pinyin.InvalidPinyinError):
+                session.push("qqq")
+            self.assertEqual(self.session_state(session), state)
+        # 另一会话在相同的前缀后恢复保存的列
+        session.update(["bei", "jing", "da"])
+        column_state = session.column_state()
+        restored_session = convert_pinyin.ConvertSession(*self.tables)
+        restored_session.update(["bei", "jing"])
+        restored_session.push_state("da", column_state)
+        self.assertEqual(self.session_state(restored_session), self.session_state(session))
+        self.assertEqual(restored_session.sentence(), session.sentence())
+        restored_session.pop()
+        self.assertEqual(restored_session.sentence(), convert_pinyin.convert_pinyin("bei jing", *self.tables))
+
+    def test_sentences(self):
+        for pinyin in PINYIN_LINES:
+            sentences = exhaustive_sentences(pinyin.split(' '), *self.tables)
+            best_sentences = sorted(sentences.items(), key=lambda item: item[1], reverse=True)
+            session = convert_pinyin.ConvertSession(*self.tables)
+            session.update(pinyin.split(' '))
+            k_best_sentences = session.sentences(10)
+            self.assertEqual([sentence for sentence, _ in k_best_sentences],
+                             [sentence for sentence, _ in best_sentences[:10]])
+            for (_, k_best_probability), (_, probability) in zip(k_best_sentences, best_sentences):
+                self.assertAlmostEqual(k_best_probability, probability)
+            self.assertEqual(k_best_sentences[0][0], session.sentence())
+            self.assertEqual(len(session.sentences(len(sentences) + 1)), len(sentences))
+        self.assertEqual(convert_pinyin.ConvertSession(*self.tables).sentences(10), [])
+        session = convert_pinyin.ConvertSession(*self.tables)
+        session.update(["xi", "an"])
+        self.assertEqual(session.words(2), [(char, probability, 1) for char, probability in
+                                            sorted(self.tables[0]["xi"], key=lambda item: item[1], reverse=True)[:2]])
+
+    def test_pruned_quantized_table(self):
+        probabilities = [probability for *_, probability in self.pinyin_pinyin_char_char_table]
+        for quantize_bits in (8, 16):
+            width = (max(probabilities) - min(probabilities)) / 2 ** quantize_bits
+            table_path = os.path.join(self.directory, "char2_table_%d.bin" % quantize_bits)
+            build_table.save_table(self.pinyin_char_table, self.pinyin_pinyin_char_char_table, table_path, top_k=2,
+                                   quantize_bits=quantize_bits)
+            pinyin_char_table, pinyin_pinyin_char_char_table = tables = convert_pinyin.load_table(table_path)
+            for (pinyin1, char1), bigrams in itertools.groupby(self.pinyin_pinyin_char_char_table,
+                                                               key=lambda bigram: (bigram[0], bigram[2])):
+                # 只保留最可能的top_k个后继
+                bigrams = sorted(bigrams, key=lambda bigram: bigram[4], reverse=True)
+                successors = pinyin_pinyin_char_char_table.successors(pinyin_char_table.find_entry(pinyin1, char1))
+                self.assertEqual(len(successors), min(len(bigrams), 2))
+                for _, pinyin2, _, char2, probability in bigrams[:2]:
+                    self.assertLessEqual(
+                        abs(successors[pinyin_char_table.find_entry(pinyin2, char2)] - probability), width + 1e-6)
+            for pinyin in PINYIN_LINES:
+                self.assertEqual(len(convert_pinyin.convert_pinyin(pinyin, *tables)), len(pinyin.split(' ')))
+
+    def test_continuous(self):
+        splitter = convert_pinyin.PinyinSplitter(self.tables[0].syllables())
+        for pinyin in PINYIN_LINES:
+            text = pinyin.replace(' ', '')
+            # 所有切分中最可能的句子
+            max_sentence = None
+            max_probability = float("-inf")
+            for split in splitter.splits(text):
+                session = convert_pinyin.ConvertSession(*self.tables)
+                try:
+                    session.update(split)
+                except convert_pinyin.InvalidPinyinError:
+                    continue
+                if session.probability() > max_probability:
+                    max_sentence = session.sentence()
+                    max_probability = session.probability()
+            self.assertEqual(convert_pinyin.convert_continuous(text, *self.tables, splitter=splitter), max_sentence)
+        self.assertEqual(convert_pinyin.convert_continuous("xi'an", *self.tables),
+                         convert_pinyin.convert_pinyin("xi an", *self.tables))
+        with self.assertRaises(convert_pinyin.InvalidPinyinError):
+            convert_pinyin.convert_continuous("beiqqq", *self.tables, splitter=splitter)
+
+
+if __name__ == "__main__":
+    unittest.main()
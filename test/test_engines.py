@@ -0,0 +1,78 @@
+import importlib.util
+import math
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "src"))
+
+from engines import SOURCE_DIRNAME, load_engine
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def import_build_table(name):
+    """
+    Import build_table.py of a model under its own module name, like engines.import_convert_pinyin.
+    """
+    spec = importlib.util.spec_from_file_location(
+        "%s_build_table" % name, os.path.join(SOURCE_DIRNAME, name, "build_table.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Char2EngineTest(unittest.TestCase):
+    """
+    Engine.convert of char2 on a tiny table, with and without the cache.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.table_path = os.path.join(cls.directory, "char2_table.bin")
+        pinyin_char_table = {
+            "bei": [["北", math.log10(0.6)], ["被", math.log10(0.4)]],
+            "jing": [["京", math.log10(0.3)], ["经", math.log10(0.7)]],
+        }
+        pinyin_pinyin_char_char_table = [("bei", "jing", "北", "京", math.log10(0.5))]
+        import_build_table("char2").save_table(pinyin_char_table, pinyin_pinyin_char_char_table, cls.table_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_cached_convert(self):
+        engine = load_engine("char2", self.table_path, cache_entries=16)
+        self.assertEqual(engine.convert("bei jing"), "北京")
+        self.assertEqual(engine.convert("bei jing"), "北京")
+        self.assertEqual(engine.cache.stats()["sentences"]["hits"], 1)
+
+    def test_cached_convert_not_vectorized(self):
+        engine = load_engine("char2", self.table_path, cache_entries=16)
+        self.assertEqual(engine.convert("bei jing", vectorized=False), "北京")
+        self.assertEqual(engine.convert_batch(["bei jing", "jing", "qqq"], vectorized=False), ["北京", "经", None])
+        self.assertEqual(engine.cache.stats()["sentences"]["hits"], 1)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_cached_convert_vectorized(self):
+        engine = load_engine("char2", self.table_path, cache_entries=16)
+        self.assertEqual(engine.convert("bei jing", vectorized=True), "北京")
+        self.assertEqual(engine.convert_batch(["bei jing", "jing"], vectorized=True), ["北京", "经"])
+        # 向量化解码不经过缓存
+        self.assertEqual(len(engine.cache.sentences), 0)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_convert_vectorized_invalid_pinyin(self):
+        engine = load_engine("char2", self.table_path, cache_entries=16)
+        with self.assertRaises(engine.module.InvalidPinyinError):
+            engine.convert("bei qqq", vectorized=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
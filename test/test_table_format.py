@@ -0,0 +1,144 @@
+import array
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "src"))
+
+from table_format import (InitialsIndex, PinyinSplitter, StringPool, build_initials, build_strings, map_sections,
+                          prune_bigrams, quantize, write_sections)
+
+
+class TableFormatTest(unittest.TestCase):
+    """
+    The binary table format shared by the models.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.table_path = os.path.join(self.directory, "table.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sections_round_trip(self):
+        sections = [
+            ("bytes", array.array('B', b'abc')),
+            ("ids", array.array('I', [0, 7, 4294967295])),
+            ("probabilities", array.array('f', [-0.5, -1.25, -3.0])),
+            ("codes", array.array('H', [65535, 0])),
+            ("empty", array.array('I')),
+        ]
+        with open(self.table_path, 'wb') as table_file:
+            write_sections(table_file, sections)
+        mapped_sections = map_sections(self.table_path)
+        self.assertEqual(sorted(mapped_sections), sorted(name for name, _ in sections))
+        for name, data in sections:
+            self.assertEqual(mapped_sections[name].format, data.typecode)
+            self.assertEqual(mapped_sections[name].tolist(), data.tolist())
+
+    def test_sections_mapped_in_place(self):
+        with open(self.table_path, 'wb') as table_file:
+            write_sections(table_file, [("ids", array.array('I', [1, 2, 3]))])
+        mapped_sections = map_sections(self.table_path)
+        ids = mapped_sections['ids']
+        # 各段是文件映射的只读视图，不复制
+        self.assertIsInstance(ids, memoryview)
+        self.assertTrue(ids.readonly)
+        with self.assertRaises(TypeError):
+            ids[0] = 4
+
+    def test_unknown_format(self):
+        with open(self.table_path, 'wb') as table_file:
+            table_file.write(b'{"bei": []}' + b'\0' * 16)
+        with self.assertRaises(ValueError):
+            map_sections(self.table_path)
+
+    def test_string_pool(self):
+        strings = {"bei", "bei jing", "北京", "jing", "京"}
+        sections, string_ids = build_strings(strings)
+        with open(self.table_path, 'wb') as table_file:
+            write_sections(table_file, sections)
+        mapped_sections = map_sections(self.table_path)
+        string_pool = StringPool(mapped_sections['strings'], mapped_sections['string_offsets'])
+        self.assertEqual(len(string_pool), len(strings))
+        for string, string_id in string_ids.items():
+            self.assertEqual(string_pool.decode(string_id), string)
+            self.assertEqual(string_pool.find(string), string_id)
+        # 字符串编号按排序，可二分查找
+        self.assertEqual([string_pool.decode(string_id) for string_id in range(len(string_pool))], sorted(strings))
+        self.assertEqual(string_pool.find("bei j"), -1)
+        self.assertEqual(string_pool.find("zhong"), -1)
+
+    def test_quantize(self):
+        generator = random.Random(0)
+        probabilities = array.array('f', (math.log10(generator.uniform(0.0001, 1)) for _ in range(1000)))
+        width = (max(probabilities) - min(probabilities)) / 256
+        codes, levels = quantize(probabilities, 8)
+        self.assertEqual(codes.typecode, 'B')
+        self.assertLessEqual(len(levels), 256)
+        for code, probability in zip(codes, probabilities):
+            self.assertLessEqual(abs(levels[code] - probability), width)
+        # 不同的值不多于级数时保持精确
+        codes, levels = quantize(probabilities, 16)
+        self.assertEqual(codes.typecode, 'H')
+        self.assertEqual([levels[code] for code in codes], probabilities.tolist())
+
+    def test_prune_bigrams(self):
+        unigram_probabilities = [-1.0, -2.0, -3.0]
+        bigrams = [(0, 1, -0.5), (0, 2, -2.5), (1, 0, -4.0), (1, 1, -0.25), (1, 2, -1.0), (2, 0, -1.5)]
+        self.assertEqual(list(prune_bigrams(bigrams, unigram_probabilities, 2)), bigrams)
+        # 每个id保留最可能的top_k个后继，仍按id排序
+        self.assertEqual(list(prune_bigrams(bigrams, unigram_probabilities, 2, top_k=1)),
+                         [(0, 1, -0.5), (1, 1, -0.25), (2, 0, -1.5)])
+        # (0, 2)和(1, 0)不常见，且与回退的打分相差不大
+        self.assertEqual(list(prune_bigrams(bigrams, unigram_probabilities, 2, prune_threshold=0.05)),
+                         [(0, 1, -0.5), (1, 1, -0.25), (1, 2, -1.0), (2, 0, -1.5)])
+
+    def test_pinyin_splitter(self):
+        splitter = PinyinSplitter(["a", "an", "bei", "jing", "lve", "xi", "xian"])
+        # 长的拼音在前，第一种切分即贪心的切分
+        self.assertEqual(list(splitter.splits("xian")), [["xian"], ["xi", "an"]])
+        self.assertEqual(list(splitter.splits("xian", max_splits=1)), [["xian"]])
+        self.assertEqual(list(splitter.splits(" XiAn ")), [["xian"], ["xi", "an"]])
+        self.assertEqual(list(splitter.splits("xi'an")), [["xi", "an"]])
+        self.assertEqual(list(splitter.splits("xi an")), [["xi", "an"]])
+        self.assertEqual(list(splitter.splits("beijingxian")),
+                         [["bei", "jing", "xian"], ["bei", "jing", "xi", "an"]])
+        self.assertEqual(list(splitter.splits("lüe")), [["lve"]])
+        self.assertEqual(list(splitter.splits("lu:e")), [["lve"]])
+        self.assertEqual(list(splitter.splits("lue")), [["lue"]])
+        self.assertEqual(list(splitter.splits("")), [[]])
+        self.assertEqual(list(splitter.splits("beiqqq")), [])
+        self.assertEqual(list(splitter.splits("xia'n")), [])
+
+    def test_partial_splits(self):
+        splitter = PinyinSplitter(["a", "an", "bei", "jing", "lve", "xi", "xian"])
+        self.assertEqual(list(splitter.splits("bj", partial=True)), [["b", "j"]])
+        self.assertEqual(list(splitter.splits("bj")), [])
+        self.assertEqual(next(splitter.splits("bjing", partial=True)), ["b", "jing"])
+        self.assertEqual(list(splitter.splits("b'ji", partial=True)), [["b", "ji"]])
+
+    def test_initials_index(self):
+        pinyin_entries = [("bei jing", 0, -1.0), ("bu jiu", 1, -0.5), ("bei", 2, -2.0), ("ba", 3, -1.0),
+                          ("bu", 4, -1.0), ("a a a a a a a", 5, -1.0)]
+        with open(self.table_path, 'wb') as table_file:
+            write_sections(table_file, build_initials(pinyin_entries, top_k=2))
+        mapped_sections = map_sections(self.table_path)
+        initials = InitialsIndex(StringPool(mapped_sections['initials'], mapped_sections['initial_offsets']),
+                                 mapped_sections['initial_entry_offsets'], mapped_sections['initial_entries'])
+        self.assertEqual(len(initials), 2)
+        # 最可能的在前，概率相同时靠前的entry在前
+        self.assertEqual(initials.entries("bj"), [1, 0])
+        self.assertEqual(initials.entries("b"), [3, 4])
+        # 太长的拼音不进入索引
+        self.assertEqual(initials.entries("aaaaaaa"), [])
+        self.assertEqual(initials.entries("x"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,257 @@
+import copy
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "src"))
+
+from engines import import_convert_pinyin
+from test_engines import import_build_table
+
+convert_pinyin = import_convert_pinyin("word1")
+build_table = import_build_table("word1")
+
+# 小词表，每个拼音只有最常见的一个词
+PINYIN_WORDS = {
+    "bei": "北", "jing": "京", "bei jing": "北京", "da": "大", "xue": "学", "da xue": "大学", "xi": "西",
+    "an": "安", "xi an": "西安", "xian": "先", "qing": "清", "hua": "华", "qing hua": "清华",
+    "qing hua da xue": "清华大学",
+}
+
+PINYIN_LINES = ["bei", "bei jing", "bei jing da xue", "qing hua da xue", "xi an", "xian", "xi an bei jing",
+                "hua bei da xue xi", "jing hua qing xian an"]
+
+
+def make_table(seed=0):
+    """
+    Make a pinyin-word table of PINYIN_WORDS in the form of build_table.build_table, with random log(probability),
+    so that no two sentences are equally probable.
+    """
+    generator = random.Random(seed)
+    return {pinyin: (word, math.log10(generator.uniform(0.05, 1))) for pinyin, word in PINYIN_WORDS.items()}
+
+
+def exhaustive_sentences(pinyin_list, pinyin_word_table, abbreviated=False):
+    """
+    Score every segmentation of pinyin_list one by one, the same way as ConvertSession.
+
+    Args:
+        abbreviated: Every piece of pinyin_list may be a prefix of a single pinyin, like decode_abbreviated.
+
+    Returns:
+        A dict, key->sentence, value->log(probability) of its most probable segmentation.
+    """
+    sentences = dict()
+    # 简拼时每个片段可以是拼音的前缀，遍历词库找出匹配的拼音
+    table_syllables = [pinyin.split(' ') for pinyin in
+                       map(pinyin_word_table.string_pool.decode, pinyin_word_table.pinyin_ids)]
+
+    def matching_pinyin(pieces):
+        if not abbreviated:
+            return [' '.join(pieces)]
+        return [' '.join(syllables) for syllables in table_syllables
+                if len(syllables) == len(pieces) and all(map(str.startswith, syllables, pieces))]
+
+    def search(start_index, sentence, sentence_probability):
+        if start_index == len(pinyin_list):
+            if sentence_probability > sentences.get(sentence, float("-inf")):
+                sentences[sentence] = sentence_probability
+            return
+        for stop_index in range(start_index + 1, len(pinyin_list) + 1):
+            for pinyin in matching_pinyin(pinyin_list[start_index:stop_index]):
+                if pinyin in pinyin_word_table:
+                    word, word_probability = pinyin_word_table[pinyin]
+                    search(stop_index, sentence + word, word_probability + sentence_probability)
+
+    search(0, "", 0.0)
+    return sentences
+
+def convert_pinyin_baseline(pinyin, pinyin_word_table):
+    """
+    The decoder before back-pointers, which carries whole sentences in the dynamic programming table.
+    """
+    pinyin_list = pinyin.split(' ')
+    dynamic_programming_table = [[] for _ in range(len(pinyin_list))]
+    # 第二维为(整句, 整句probability)
+    for stop_index in range(len(pinyin_list)):
+        pinyin_whole = ' '.join(pinyin_list[:stop_index + 1])
+        if pinyin_whole in pinyin_word_table:
+            max_now = pinyin_word_table[pinyin_whole]
+        else:
+            max_now = ["", float("-inf")]
+        for mid_stop_index in range(stop_index):
+            pinyin_back = ' '.join(pinyin_list[mid_stop_index + 1:stop_index + 1])
+            if pinyin_back in pinyin_word_table:
+                word, word_probability = pinyin_word_table[pinyin_back]
+                sentence, sentence_probability = dynamic_programming_table[mid_stop_index]
+                probability = word_probability + sentence_probability
+                if probability > max_now[1]:
+                    max_now = [sentence + word, probability]
+        dynamic_programming_table[stop_index] = max_now
+    return dynamic_programming_table[-1][0]
+
+
+class Word1ModelTest(unittest.TestCase):
+    """
+    word1 on a small table saved by build_table.save_table.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.table_path = os.path.join(cls.directory, "word1_table.bin")
+        cls.pinyin_word_table = make_table()
+        build_table.save_table(cls.pinyin_word_table, cls.table_path)
+        cls.table = convert_pinyin.load_table(cls.table_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_table_round_trip(self):
+        self.assertEqual(len(self.table), len(self.pinyin_word_table))
+        self.assertEqual(sorted(self.table.syllables()),
+                         sorted(pinyin for pinyin in self.pinyin_word_table if ' ' not in pinyin))
+        for pinyin, (word, probability) in self.pinyin_word_table.items():
+            loaded_word, loaded_probability = self.table[pinyin]
+            self.assertEqual(loaded_word, word)
+            # 概率存为float32
+            self.assertAlmostEqual(loaded_probability, probability, places=5)
+        self.assertNotIn("bei qqq", self.table)
+
+    def test_table_mapped_in_place(self):
+        for section in (self.table.pinyin_ids, self.table.entry_words, self.table.entry_probabilities):
+            self.assertIsInstance(section, memoryview)
+            self.assertTrue(section.readonly)
+
+    def test_back_pointers(self):
+        generator = random.Random(1)
+        syllables = sorted(self.table.syllables())
+        pinyin_lines = PINYIN_LINES + [' '.join(generator.choice(syllables) for _ in range(generator.randint(1, 6)))
+                                       for _ in range(50)]
+        for pinyin in pinyin_lines:
+            self.assertEqual(convert_pinyin.convert_pinyin(pinyin, self.table),
+                             convert_pinyin_baseline(pinyin, self.table))
+
+    def test_batch(self):
+        # 重复、无效和空的句子不影响批中的其他句子
+        pinyin_lines = PINYIN_LINES + ["bei qqq", "", "bei jing"] + PINYIN_LINES[::-1]
+        expected_sentences = []
+        for pinyin in pinyin_lines:
+            try:
+                expected_sentences.append(convert_pinyin.convert_pinyin(pinyin, self.table))
+            except convert_pinyin.InvalidPinyinError:
+                expected_sentences.append(None)
+        self.assertIsNone(expected_sentences[len(PINYIN_LINES)])
+        self.assertEqual(convert_pinyin.convert_batch(pinyin_lines, self.table), expected_sentences)
+
+    def session_state(self, session):
+        """
+        Copy the dynamic programming state of a session.
+        """
+        names = ("pinyin_list", "dynamic_programming_table", "candidates", "prefixes")
+        return copy.deepcopy({name: getattr(session, name) for name in names})
+
+    def test_session(self):
+        session = convert_pinyin.ConvertSession(self.table)
+        for pinyin in PINYIN_LINES:
+            pinyin_list = pinyin.split(' ')
+            session.update(pinyin_list)
+            fresh_session = convert_pinyin.ConvertSession(self.table)
+            for pinyin_single in pinyin_list:
+                fresh_session.push(pinyin_single)
+            # update保留共同前缀的列，结果与从头逐个push一致
+            self.assertEqual(self.session_state(session), self.session_state(fresh_session))
+            self.assertEqual(session.sentence(), convert_pinyin.convert_pinyin(pinyin, self.table))
+            state = self.session_state(session)
+            for pinyin_single in ("jing", "da", "xue"):
+                session.push(pinyin_single)
+            for _ in range(3):
+                session.pop()
+            self.assertEqual(self.session_state(session), state)
+            with self.assertRaises(convert_pinyin.InvalidPinyinError):
+                session.push("qqq")
+            self.assertEqual(self.session_state(session), state)
+        # 另一会话在相同的前缀后恢复保存的列
+        session.update(["bei", "jing", "da"])
+        column_state = session.column_state()
+        restored_session = convert_pinyin.ConvertSession(self.table)
+        restored_session.update(["bei", "jing"])
+        restored_session.push_state("da", column_state)
+        self.assertEqual(self.session_state(restored_session), self.session_state(session))
+        self.assertEqual(restored_session.sentence(), session.sentence())
+        restored_session.pop()
+        self.assertEqual(restored_session.sentence(), convert_pinyin.convert_pinyin("bei jing", self.table))
+
+    def test_sentences(self):
+        for pinyin in PINYIN_LINES:
+            sentences = exhaustive_sentences(pinyin.split(' '), self.table)
+            best_sentences = sorted(sentences.items(), key=lambda item: item[1], reverse=True)
+            session = convert_pinyin.ConvertSession(self.table)
+            session.update(pinyin.split(' '))
+            k_best_sentences = session.sentences(10)
+            self.assertEqual([sentence for sentence, _ in k_best_sentences],
+                             [sentence for sentence, _ in best_sentences[:10]])
+            for (_, k_best_probability), (_, probability) in zip(k_best_sentences, best_sentences):
+                self.assertAlmostEqual(k_best_probability, probability)
+            self.assertEqual(k_best_sentences[0][0], session.sentence())
+            self.assertEqual(len(session.sentences(len(sentences) + 1)), len(sentences))
+        self.assertEqual(convert_pinyin.ConvertSession(self.table).sentences(10), [])
+        session = convert_pinyin.ConvertSession(self.table)
+        session.update(["qing", "hua", "da"])
+        self.assertEqual([word for word, _, _ in session.words(3)], ["清华", "清"])
+
+    def test_continuous(self):
+        splitter = convert_pinyin.PinyinSplitter(self.table.syllables())
+        for pinyin in PINYIN_LINES:
+            text = pinyin.replace(' ', '')
+            # 所有切分中最可能的句子
+            max_sentence = None
+            max_probability = float("-inf")
+            for split in splitter.splits(text):
+                session = convert_pinyin.ConvertSession(self.table)
+                try:
+                    session.update(split)
+                except convert_pinyin.InvalidPinyinError:
+                    continue
+                if session.probability() > max_probability:
+                    max_sentence = session.sentence()
+                    max_probability = session.probability()
+            self.assertEqual(convert_pinyin.convert_continuous(text, self.table, splitter=splitter), max_sentence)
+        self.assertEqual(convert_pinyin.convert_continuous("xi'an", self.table),
+                         convert_pinyin.convert_pinyin("xi an", self.table))
+        with self.assertRaises(convert_pinyin.InvalidPinyinError):
+            convert_pinyin.convert_continuous("beiqqq", self.table, splitter=splitter)
+
+    def test_abbreviated(self):
+        for pinyin in PINYIN_LINES:
+            syllables = pinyin.split(' ')
+            for pieces in ([syllable[0] for syllable in syllables], [syllable[:2] for syllable in syllables],
+                           [syllable if index % 2 else syllable[0] for index, syllable in enumerate(syllables)]):
+                sentences = exhaustive_sentences(pieces, self.table, abbreviated=True)
+                best_sentence = max(sentences, key=sentences.get)
+                sentence, probability = convert_pinyin.decode_abbreviated(pieces, self.table)
+                self.assertEqual(sentence, best_sentence)
+                self.assertAlmostEqual(probability, sentences[best_sentence])
+        self.assertIsNone(convert_pinyin.decode_abbreviated(["z"], self.table))
+        # 'qhdx'只有一种切分
+        self.assertEqual(convert_pinyin.convert_abbreviated("qhdx", self.table),
+                         convert_pinyin.decode_abbreviated(["q", "h", "d", "x"], self.table)[0])
+        self.assertEqual(convert_pinyin.convert_abbreviated("qing'h d xue", self.table),
+                         convert_pinyin.decode_abbreviated(["qing", "h", "d", "xue"], self.table)[0])
+        self.assertEqual(convert_pinyin.convert_abbreviated("", self.table), "")
+        with self.assertRaises(convert_pinyin.InvalidPinyinError):
+            convert_pinyin.convert_abbreviated("zz", self.table)
+        # 没有简拼索引的词库
+        table_path = os.path.join(self.directory, "word1_table_no_initials.bin")
+        build_table.save_table(self.pinyin_word_table, table_path, initials_top_k=0)
+        with self.assertRaises(ValueError):
+            convert_pinyin.convert_abbreviated("bj", convert_pinyin.load_table(table_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,363 @@
+import copy
+import itertools
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir, "src"))
+
+from engines import import_convert_pinyin
+from test_engines import import_build_table
+
+convert_pinyin = import_convert_pinyin("word2")
+build_table = import_build_table("word2")
+
+# 小词表，每个词只有一个读音
+PINYIN_WORDS = {
+    "bei": "北 被 背", "jing": "京 经", "bei jing": "北京 背景", "da": "大 打", "xue": "学 雪", "da xue": "大学",
+    "xi": "西 系", "an": "安 按", "xi an": "西安", "xian": "先 县", "qing": "清 请", "hua": "华 话",
+    "qing hua": "清华", "qing hua da xue": "清华大学",
+}
+
+PINYIN_LINES = ["bei", "bei jing", "bei jing da xue", "qing hua da xue", "xi an", "xian", "xi an bei jing",
+                "hua bei da xue xi", "jing hua qing xian an"]
+
+
+def make_tables(seed=0):
+    """
+    Make a pinyin-word table and a sorted word-word table of PINYIN_WORDS in the form of build_table.build_table,
+    with random log(probability), so that no two sentences are equally probable.
+    """
+    generator = random.Random(seed)
+    pinyin_word_table = {pinyin: [[word, math.log10(generator.uniform(0.05, 1))] for word in words.split(' ')]
+                         for pinyin, words in PINYIN_WORDS.items()}
+    words = sorted(word for word_list in pinyin_word_table.values() for word, _ in word_list)
+    word_word_table = [(word1, word2, math.log10(generator.uniform(0.01, 0.5)))
+                       for word1 in words for word2 in words if generator.random() < 0.3]
+    return pinyin_word_table, word_word_table
+
+
+def exhaustive_sentences(pinyin_list, pinyin_word_table, word_word_table,
+                         backoff_penalty=convert_pinyin.BACKOFF_PENALTY, abbreviated=False):
+    """
+    Score every segmentation and word choice of pinyin_list one by one, the same way as ConvertSession.
+
+    Args:
+        abbreviated: Every piece of pinyin_list may be a prefix of a single pinyin, like decode_abbreviated.
+
+    Returns:
+        A dict, key->sentence, value->log(probability) of its most probable segmentation.
+    """
+    sentences = dict()
+    # 简拼时每个片段可以是拼音的前缀，遍历词库找出匹配的拼音
+    table_syllables = [pinyin.split(' ') for pinyin in
+                       map(pinyin_word_table.string_pool.decode, pinyin_word_table.pinyin_ids)]
+
+    def matching_pinyin(pieces):
+        if not abbreviated:
+            return [' '.join(pieces)]
+        return [' '.join(syllables) for syllables in table_syllables
+                if len(syllables) == len(pieces) and all(map(str.startswith, syllables, pieces))]
+
+    def search(start_index, sentence, sentence_probability, word_front, word_probability_front):
+        if start_index == len(pinyin_list):
+            if sentence_probability > sentences.get(sentence, float("-inf")):
+                sentences[sentence] = sentence_probability
+            return
+        for stop_index in range(start_index + 1, len(pinyin_list) + 1):
+            entries = itertools.chain.from_iterable(
+                map(pinyin_word_table.entries, matching_pinyin(pinyin_list[start_index:stop_index])))
+            for word_back, word_probability_back in entries:
+                if word_front is None:
+                    probability = word_probability_back
+                else:
+                    bigram_probability = word_word_table.probability(word_front, word_back)
+                    if bigram_probability is not None:
+                        probability = sentence_probability + bigram_probability - word_probability_front
+                    else:
+                        probability = sentence_probability + word_probability_back - backoff_penalty
+                search(stop_index, sentence + pinyin_word_table.string_pool.decode(word_back), probability,
+                       word_back, word_probability_back)
+
+    search(0, "", 0.0, None, None)
+    return sentences
+
+
+def convert_pinyin_baseline(pinyin, pinyin_word_table, word_word_table, backoff_penalty=convert_pinyin.BACKOFF_PENALTY):
+    """
+    The decoder before back-pointers, which carries whole sentences in the dynamic programming table
+    and looks up the tables by pinyin and str(word1-word2).
+    """
+    pinyin_list = pinyin.split(' ')
+    dynamic_programming_table = [[] for _ in range(len(pinyin_list))]
+    # 第二维为list(尾词，尾词probability，总句，总句probability)
+    for stop_index in range(len(pinyin_list)):
+        pinyin_whole = ' '.join(pinyin_list[:stop_index + 1])
+        if pinyin_whole in pinyin_word_table:
+            for word_whole, probability_whole in pinyin_word_table[pinyin_whole]:
+                dynamic_programming_table[stop_index].append([word_whole, probability_whole, word_whole,
+                                                              probability_whole])
+        for mid_stop_index in range(stop_index):
+            pinyin_back = ' '.join(pinyin_list[mid_stop_index + 1:stop_index + 1])
+            if pinyin_back not in pinyin_word_table:
+                continue
+            for word_back, word_probability_back in pinyin_word_table[pinyin_back]:
+                max_sentence = [word_back, word_probability_back, "", float("-inf")]
+                for word_front, word_probability_front, sentence_front, sentence_probability_front in dynamic_programming_table[mid_stop_index]:
+                    word_pair = '-'.join((word_front, word_back))
+                    if word_pair in word_word_table:
+                        sentence_probability = (
+                            sentence_probability_front + word_word_table[word_pair] - word_probability_front)
+                    else:
+                        sentence_probability = sentence_probability_front + word_probability_back - backoff_penalty
+                    if sentence_probability > max_sentence[3]:
+                        max_sentence[2] = sentence_front + word_back
+                        max_sentence[3] = sentence_probability
+                dynamic_programming_table[stop_index].append(max_sentence)
+    max_sentence = ("", float("-inf"))
+    for dp_node in dynamic_programming_table[-1]:
+        if dp_node[3] > max_sentence[1]:
+            max_sentence = (dp_node[2], dp_node[3])
+    return max_sentence[0]
+
+
+class Word2ModelTest(unittest.TestCase):
+    """
+    word2 on a small table saved by build_table.save_table.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.table_path = os.path.join(cls.directory, "word2_table.bin")
+        cls.pinyin_word_table, cls.word_word_table = make_tables()
+        build_table.save_table(cls.pinyin_word_table, cls.word_word_table, cls.table_path)
+        cls.tables = convert_pinyin.load_table(cls.table_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_table_round_trip(self):
+        pinyin_word_table, word_word_table = self.tables
+        self.assertEqual(len(pinyin_word_table), len(self.pinyin_word_table))
+        self.assertEqual(sorted(pinyin_word_table.syllables()),
+                         sorted(pinyin for pinyin in self.pinyin_word_table if ' ' not in pinyin))
+        for pinyin, word_list in self.pinyin_word_table.items():
+            loaded_word_list = sorted(pinyin_word_table[pinyin])
+            self.assertEqual([word for word, _ in loaded_word_list], sorted(word for word, _ in word_list))
+            for (_, loaded_probability), (_, probability) in zip(loaded_word_list, sorted(word_list)):
+                # 概率存为float32
+                self.assertAlmostEqual(loaded_probability, probability, places=5)
+        self.assertNotIn("bei qqq", pinyin_word_table)
+        self.assertEqual(len(word_word_table), len(self.word_word_table))
+        for word1, word2, probability in self.word_word_table:
+            self.assertAlmostEqual(word_word_table[word1 + '-' + word2], probability, places=5)
+
+    def test_table_mapped_in_place(self):
+        pinyin_word_table, word_word_table = self.tables
+        for section in (pinyin_word_table.pinyin_offsets, pinyin_word_table.entry_words,
+                        pinyin_word_table.entry_probabilities, word_word_table.bigram_offsets,
+                        word_word_table.bigram_successors, word_word_table.bigram_probabilities):
+            self.assertIsInstance(section, memoryview)
+            self.assertTrue(section.readonly)
+
+    def test_bigram_lookups(self):
+        pinyin_word_table, word_word_table = self.tables
+        bigrams = {(word1, word2): probability for word1, word2, probability in self.word_word_table}
+        string_pool = pinyin_word_table.string_pool
+        word_ids = {word: string_pool.find(word) for word_list in self.pinyin_word_table.values()
+                    for word, _ in word_list}
+        for pinyin, word_list in self.pinyin_word_table.items():
+            word_ids_of_pinyin = [word_id for word_id, _ in pinyin_word_table.entries(pinyin)]
+            self.assertEqual(sorted(map(string_pool.decode, word_ids_of_pinyin)), sorted(word for word, _ in word_list))
+        for word1, word1_id in word_ids.items():
+            successors = word_word_table.successors(word1_id)
+            self.assertEqual(sorted(map(string_pool.decode, successors)),
+                             sorted(word2 for word2 in word_ids if (word1, word2) in bigrams))
+            for word2, word2_id in word_ids.items():
+                probability = word_word_table.probability(word1_id, word2_id)
+                if (word1, word2) in bigrams:
+                    self.assertAlmostEqual(probability, bigrams[word1, word2], places=5)
+                    self.assertEqual(successors[word2_id], probability)
+                else:
+                    self.assertIsNone(probability)
+        self.assertEqual(pinyin_word_table.entries("bei qqq"), [])
+        self.assertIsNone(word_word_table.get("北京-qqq"))
+        with self.assertRaises(KeyError):
+            word_word_table["qqq-北京"]
+
+    def test_beam_search(self):
+        for pinyin in PINYIN_LINES:
+            sentences = exhaustive_sentences(pinyin.split(' '), *self.tables)
+            best_sentence = max(sentences, key=sentences.get)
+            session = convert_pinyin.ConvertSession(*self.tables)
+            session.update(pinyin.split(' '))
+            # 不剪枝时与穷举一致
+            self.assertEqual(session.sentence(), best_sentence)
+            self.assertAlmostEqual(session.probability(), sentences[best_sentence])
+            # 束宽不小于每列的节点数时不会剪掉任何节点
+            self.assertEqual(convert_pinyin.convert_pinyin(pinyin, *self.tables, beam_width=100), best_sentence)
+            self.assertEqual(convert_pinyin.convert_pinyin(pinyin, *self.tables, beam_threshold=100), best_sentence)
+            self.assertTrue(convert_pinyin.convert_pinyin(pinyin, *self.tables, beam_width=1))
+        with self.assertRaises(ValueError):
+            convert_pinyin.convert_pinyin("bei jing", *self.tables, beam_width=0)
+
+    def test_back_pointers(self):
+        generator = random.Random(1)
+        syllables = sorted(self.tables[0].syllables())
+        pinyin_lines = PINYIN_LINES + [' '.join(generator.choice(syllables) for _ in range(generator.randint(1, 6)))
+                                       for _ in range(50)]
+        for pinyin in pinyin_lines:
+            self.assertEqual(convert_pinyin.convert_pinyin(pinyin, *self.tables),
+                             convert_pinyin_baseline(pinyin, *self.tables))
+
+    def test_batch(self):
+        # 重复、无效和空的句子不影响批中的其他句子
+        pinyin_lines = PINYIN_LINES + ["bei qqq", "", "bei jing"] + PINYIN_LINES[::-1]
+        expected_sentences = []
+        for pinyin in pinyin_lines:
+            try:
+                expected_sentences.append(convert_pinyin.convert_pinyin(pinyin, *self.tables))
+            except convert_pinyin.InvalidPinyinError:
+                expected_sentences.append(None)
+        self.assertIsNone(expected_sentences[len(PINYIN_LINES)])
+        self.assertEqual(convert_pinyin.convert_batch(pinyin_lines, *self.tables), expected_sentences)
+        self.assertEqual(
+            convert_pinyin.convert_batch(pinyin_lines, *self.tables, beam_width=1),
+            [None if sentence is None else convert_pinyin.convert_pinyin(pinyin, *self.tables, beam_width=1)
+             for pinyin, sentence in zip(pinyin_lines, expected_sentences)])
+
+    def session_state(self, session):
+        """
+        Copy the dynamic programming state of a session.
+        """
+        names = ("pinyin_list", "dynamic_programming_table", "prefixes", "node_words", "node_backs", "node_starts",
+                 "node_counts")
+        return copy.deepcopy({name: getattr(session, name) for name in names})
+
+    def test_session(self):
+        session = convert_pinyin.ConvertSession(*self.tables)
+        for pinyin in PINYIN_LINES:
+            pinyin_list = pinyin.split(' ')
+            session.update(pinyin_list)
+            fresh_session = convert_pinyin.ConvertSession(*self.tables)
+            for pinyin_single in pinyin_list:
+                fresh_session.push(pinyin_single)
+            # update保留共同前缀的列，结果与从头逐个push一致
+            self.assertEqual(self.session_state(session), self.session_state(fresh_session))
+            self.assertEqual(session.sentence(), convert_pinyin.convert_pinyin(pinyin, *self.tables))
+            state = self.session_state(session)
+            for pinyin_single in ("jing", "da", "xue"):
+                session.push(pinyin_single)
+            for _ in range(3):
+                session.pop()
+            self.assertEqual(self.session_state(session), state)
+            with self.assertRaises(convert_pinyin.InvalidPinyinError):
+                session.push("qqq")
+            self.assertEqual(self.session_state(session), state)
+        # 另一会话在相同的前缀后恢复保存的列
+        session.update(["bei", "jing", "da"])
+        column_state = session.column_state()
+        restored_session = convert_pinyin.ConvertSession(*self.tables)
+        restored_session.update(["bei", "jing"])
+        restored_session.push_state("da", column_state)
+        self.assertEqual(self.session_state(restored_session), self.session_state(session))
+        self.assertEqual(restored_session.sentence(), session.sentence())
+        restored_session.pop()
+        self.assertEqual(restored_session.sentence(), convert_pinyin.convert_pinyin("bei jing", *self.tables))
+
+    def test_sentences(self):
+        for pinyin in PINYIN_LINES:
+            sentences = exhaustive_sentences(pinyin.split(' '), *self.tables)
+            best_sentences = sorted(sentences.items(), key=lambda item: item[1], reverse=True)
+            session = convert_pinyin.ConvertSession(*self.tables)
+            session.update(pinyin.split(' '))
+            k_best_sentences = session.sentences(10)
+            self.assertEqual([sentence for sentence, _ in k_best_sentences],
+                             [sentence for sentence, _ in best_sentences[:10]])
+            for (_, k_best_probability), (_, probability) in zip(k_best_sentences, best_sentences):
+                self.assertAlmostEqual(k_best_probability, probability)
+            self.assertEqual(k_best_sentences[0][0], session.sentence())
+            self.assertEqual(len(session.sentences(len(sentences) + 1)), len(sentences))
+        self.assertEqual(convert_pinyin.ConvertSession(*self.tables).sentences(10), [])
+        session = convert_pinyin.ConvertSession(*self.tables)
+        session.update(["qing", "hua", "da"])
+        # 长词在前，同长的词按概率排序
+        self.assertEqual([word for word, _, _ in session.words(3)],
+                         ["清华"] + [word for word, _ in sorted(self.tables[0]["qing"],
+                                                                key=lambda item: item[1], reverse=True)])
+
+    def test_pruned_quantized_table(self):
+        probabilities = [probability for _, _, probability in self.word_word_table]
+        for quantize_bits in (8, 16):
+            width = (max(probabilities) - min(probabilities)) / 2 ** quantize_bits
+            table_path = os.path.join(self.directory, "word2_table_%d.bin" % quantize_bits)
+            build_table.save_table(self.pinyin_word_table, self.word_word_table, table_path, top_k=2,
+                                   quantize_bits=quantize_bits)
+            pinyin_word_table, word_word_table = tables = convert_pinyin.load_table(table_path)
+            string_pool = pinyin_word_table.string_pool
+            for word1, bigrams in itertools.groupby(self.word_word_table, key=lambda bigram: bigram[0]):
+                # 只保留最可能的top_k个后继
+                bigrams = sorted(bigrams, key=lambda bigram: bigram[2], reverse=True)
+                successors = word_word_table.successors(string_pool.find(word1))
+                self.assertEqual(len(successors), min(len(bigrams), 2))
+                for _, word2, probability in bigrams[:2]:
+                    self.assertLessEqual(abs(successors[string_pool.find(word2)] - probability), width + 1e-6)
+            for pinyin in PINYIN_LINES:
+                self.assertTrue(convert_pinyin.convert_pinyin(pinyin, *tables))
+
+    def test_continuous(self):
+        splitter = convert_pinyin.PinyinSplitter(self.tables[0].syllables())
+        for pinyin in PINYIN_LINES:
+            text = pinyin.replace(' ', '')
+            # 所有切分中最可能的句子
+            max_sentence = None
+            max_probability = float("-inf")
+            for split in splitter.splits(text):
+                session = convert_pinyin.ConvertSession(*self.tables)
+                try:
+                    session.update(split)
+                except convert_pinyin.InvalidPinyinError:
+                    continue
+                if session.probability() > max_probability:
+                    max_sentence = session.sentence()
+                    max_probability = session.probability()
+            self.assertEqual(convert_pinyin.convert_continuous(text, *self.tables, splitter=splitter), max_sentence)
+        self.assertEqual(convert_pinyin.convert_continuous("xi'an", *self.tables),
+                         convert_pinyin.convert_pinyin("xi an", *self.tables))
+        with self.assertRaises(convert_pinyin.InvalidPinyinError):
+            convert_pinyin.convert_continuous("beiqqq", *self.tables, splitter=splitter)
+
+    def test_abbreviated(self):
+        for pinyin in PINYIN_LINES:
+            syllables = pinyin.split(' ')
+            for pieces in ([syllable[0] for syllable in syllables], [syllable[:2] for syllable in syllables],
+                           [syllable if index % 2 else syllable[0] for index, syllable in enumerate(syllables)]):
+                sentences = exhaustive_sentences(pieces, *self.tables, abbreviated=True)
+                best_sentence = max(sentences, key=sentences.get)
+                sentence, probability = convert_pinyin.decode_abbreviated(pieces, *self.tables, beam_width=None)
+                self.assertEqual(sentence, best_sentence)
+                self.assertAlmostEqual(probability, sentences[best_sentence])
+        self.assertIsNone(convert_pinyin.decode_abbreviated(["z"], *self.tables))
+        # 'qhdx'只有一种切分
+        self.assertEqual(convert_pinyin.convert_abbreviated("qhdx", *self.tables),
+                         convert_pinyin.decode_abbreviated(["q", "h", "d", "x"], *self.tables)[0])
+        self.assertEqual(convert_pinyin.convert_abbreviated("qing'h d xue", *self.tables),
+                         convert_pinyin.decode_abbreviated(["qing", "h", "d", "xue"], *self.tables)[0])
+        self.assertEqual(convert_pinyin.convert_abbreviated("", *self.tables), "")
+        with self.assertRaises(convert_pinyin.InvalidPinyinError):
+            convert_pinyin.convert_abbreviated("zz", *self.tables)
+        # 没有简拼索引的词库
+        table_path = os.path.join(self.directory, "word2_table_no_initials.bin")
+        build_table.save_table(self.pinyin_word_table, self.word_word_table, table_path, initials_top_k=0)
+        with self.assertRaises(ValueError):
+            convert_pinyin.convert_abbreviated("bj", *convert_pinyin.load_table(table_path))
+
+
+if __name__ == "__main__":
+    unittest.main()